@@ -1,27 +1,50 @@
+import time
+BOOT_STARTED = time.perf_counter()  # 开始导入模块的时间，用于统计启动各阶段的耗时
 import datetime
 import os
 import logging
 import sqlite3
 import asyncio
 import sys
-import time
+import random
+import hashlib
 from logging.handlers import RotatingFileHandler
-import uuid
+import json
 from telegram import Message, Update, InlineKeyboardButton, InlineKeyboardMarkup, BotCommand
 from telegram.ext import (
     Application,
+    ExtBot,
+    Updater,
     CommandHandler,
     ContextTypes,
     CallbackQueryHandler,
     MessageHandler,
+    TypeHandler,
+    BaseRateLimiter,
     filters,
 )
 from telegram.helpers import escape_markdown
+from telegram.request import HTTPXRequest
+from telegram.error import BadRequest, Forbidden, RetryAfter
 from telethon.sessions import StringSession
 from telethon import TelegramClient, events, errors
 from dotenv import load_dotenv
-import stat
-from datetime import datetime
+from telethon.tl import types, functions
+from telethon import utils
+import io
+import re
+import base64
+import functools
+import inspect
+import heapq
+import mmap
+import struct
+import bisect
+import threading
+import traceback
+from collections import OrderedDict, Counter, deque
+from array import array
+from datetime import datetime, timedelta
 # 加载环境变量
 load_dotenv()
 
@@ -54,7 +77,7 @@ logger.addHandler(console_handler)
 logger.addHandler(file_handler)
 
 # 数据库文件路径
-DB_PATH = 'bot.db'
+DB_PATH = os.getenv('DATABASE_PATH', 'bot.db')
 
 # 环境变量
 BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
@@ -62,6 +85,119 @@ ADMIN_IDS = os.getenv('ADMIN_IDS')  # 逗号分隔的管理员用户 ID
 ADMIN_USERNAME = os.getenv('ADMIN_USERNAME', 'demonkinghaha')  # 默认值为 'demonkinghaha'
 API_ID = os.getenv('TELEGRAM_API_ID')
 API_HASH = os.getenv('TELEGRAM_API_HASH')
+# 接收更新的方式：polling（长轮询，默认）或 webhook（由本地反向代理转发到 WEBHOOK_LISTEN:WEBHOOK_PORT）
+BOT_MODE = os.getenv('BOT_MODE', 'polling').strip().lower()
+WEBHOOK_URL = os.getenv('WEBHOOK_URL', '').rstrip('/')  # 反向代理对外的 HTTPS 地址，例如 https://bot.example.com
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '127.0.0.1')  # 本地监听地址
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8443'))  # 本地监听端口
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'webhook').strip('/')  # 接收更新的路径
+WEBHOOK_SECRET_TOKEN = os.getenv('WEBHOOK_SECRET_TOKEN')  # 校验请求头的密钥，未设置时由 BOT_TOKEN 派生
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '40'))  # Telegram 同时推送更新的最大连接数
+# Bot API 连接配置：长轮询（getUpdates）和其他请求使用独立的连接池，轮询不会占用发送消息的连接
+TELEGRAM_API_BASE_URL = os.getenv('TELEGRAM_API_BASE_URL', 'https://api.telegram.org/bot')  # 可指向自建或测试用的 Bot API 服务器
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))  # 建立连接的超时（秒）
+SEND_POOL_SIZE = int(os.getenv('SEND_POOL_SIZE', '64'))  # 发送消息等请求的连接池大小
+SEND_TIMEOUT = float(os.getenv('SEND_TIMEOUT', '10'))  # 发送请求的读写超时（秒）
+SEND_POOL_TIMEOUT = float(os.getenv('SEND_POOL_TIMEOUT', '5'))  # 连接池占满时等待空闲连接的超时（秒）
+POLL_TIMEOUT = int(os.getenv('POLL_TIMEOUT', '10'))  # 长轮询在服务器端等待新更新的时长（秒）
+POLL_READ_TIMEOUT = float(os.getenv('POLL_READ_TIMEOUT', '5'))  # 长轮询在 POLL_TIMEOUT 之外额外等待响应的时间（秒）
+# 断线补偿（补拉）配置
+BACKFILL_LIMIT = int(os.getenv('BACKFILL_LIMIT', '200'))  # 每个聊天单次最多补拉的消息数
+BACKFILL_DELAY = float(os.getenv('BACKFILL_DELAY', '0.05'))  # 补拉每条消息之间的间隔（秒）
+WATERMARK_FLUSH_INTERVAL = int(os.getenv('WATERMARK_FLUSH_INTERVAL', '10'))  # 水位线写回数据库的间隔（秒）
+# 账号健康检查配置
+SUPERVISOR_INTERVAL = int(os.getenv('SUPERVISOR_INTERVAL', '60'))  # 每轮健康检查的周期（秒），探测分散在整个周期内
+RECONNECT_BASE_DELAY = int(os.getenv('RECONNECT_BASE_DELAY', '5'))  # 重连退避的初始间隔（秒）
+RECONNECT_MAX_DELAY = int(os.getenv('RECONNECT_MAX_DELAY', '600'))  # 重连退避的最大间隔（秒）
+PROBE_TIMEOUT = 15  # 单次探测超时时间（秒）
+# 批量导入账号配置
+BULK_IMPORT_CONCURRENCY = int(os.getenv('BULK_IMPORT_CONCURRENCY', '5'))  # 同时验证的会话数量
+BULK_IMPORT_MAX_SESSIONS = 200  # 单次导入的最大会话数
+BULK_IMPORT_MAX_FILE_SIZE = 5 * 1024 * 1024  # 压缩包内单个文件的最大大小
+# 关键词导入配置
+KEYWORD_IMPORT_MAX = 5000  # 单次导入的最大关键词数
+BOT_UPLOAD_LIMIT = 50 * 1024 * 1024  # 机器人上传文件的大小上限
+FUZZY_MAX_ERRORS = 3  # 容错关键词（关键词~N）最多允许的错误数
+KEYWORD_SNAPSHOT_PATH = os.getenv('KEYWORD_SNAPSHOT_PATH', '')  # 关键词匹配器快照文件，为空时保存在数据库文件旁
+# 群组同步配置
+SYNC_GROUPS_BATCH_SIZE = int(os.getenv('SYNC_GROUPS_BATCH_SIZE', '100'))  # 每批写入数据库的群组数，同时也是两次限速等待之间读取的对话数
+SYNC_GROUPS_DELAY = float(os.getenv('SYNC_GROUPS_DELAY', '1'))  # 每批对话之间的等待时间（秒）
+# 分页配置
+PAGE_SIZE = 20  # 关键词、屏蔽用户列表每页显示的条数
+ACCOUNTS_PAGE_SIZE = 10  # 账号列表每页显示的条数
+# 持久化推送队列配置
+QUEUE_BATCH_SIZE = int(os.getenv('QUEUE_BATCH_SIZE', '50'))  # 每批入队/出队的最大条数
+QUEUE_BATCH_WINDOW = float(os.getenv('QUEUE_BATCH_WINDOW', '0.05'))  # 入队攒批的最长等待时间（秒）
+DELIVERY_MAX_ATTEMPTS = int(os.getenv('DELIVERY_MAX_ATTEMPTS', '5'))  # 单条推送的最大尝试次数
+DELIVERY_LEASE_SECONDS = 120  # 出队后的租约时长（秒），超时未确认的消息会被重新投递
+# 推送日志保留与压缩配置
+STATS_MAX_DAYS = 30  # /my_stats 支持的最长统计窗口（天）
+PUSH_STATS_DAYS = 2 * STATS_MAX_DAYS + 2  # 按天统计汇总保留的天数，覆盖最长窗口和用于比较趋势的上一个同等长度窗口
+PUSH_LOG_RETENTION_DAYS = int(os.getenv('PUSH_LOG_RETENTION_DAYS', '30'))  # 原始推送日志保留天数，更早的汇总为每日统计
+RETENTION_INTERVAL = int(os.getenv('RETENTION_INTERVAL', '3600'))  # 压缩任务的运行间隔（秒）
+RETENTION_BATCH_SIZE = 1000  # 每个事务压缩的原始日志条数
+VACUUM_PAGES_PER_RUN = 2000  # 每次增量回收的最大页数
+# 低内存模式，适合单机运行大量账号
+LOW_MEMORY_MODE = os.getenv('LOW_MEMORY_MODE', 'false').lower() in ('1', 'true', 'yes', 'on')
+# 刷屏过滤配置
+SPAM_WINDOW = int(os.getenv('SPAM_WINDOW', '600'))  # 滑动窗口长度（秒）
+SPAM_MAX_PER_SENDER = int(os.getenv('SPAM_MAX_PER_SENDER', '5'))  # 窗口内同一发送者最多推送给同一用户的条数，0 表示不限制
+SPAM_SIMHASH_DISTANCE = int(os.getenv('SPAM_SIMHASH_DISTANCE', '8'))  # SimHash 汉明距离不超过该值视为重复，-1 表示不检测
+SIMHASH_MAX_CHARS = 4096  # 计算 SimHash 时最多使用的字符数
+# 出站 Bot API 请求的优先级，数值越小越优先
+PRIORITY_INTERACTIVE = 0  # 命令回复、按钮回调（默认）
+PRIORITY_ALERT = 1  # 关键词推送、账号状态通知
+PRIORITY_BROADCAST = 2  # 公告
+# 关键词回放配置
+REPLAY_CHUNK_SIZE = 5000  # 回放时每批从数据库读取并匹配的消息数
+# 运行时配置项，key: 配置名（按 "分区.名称" 划分）, value: (类型, 默认值, 最小值, 说明)
+# 默认值来自上面的环境变量，管理员通过 /set_config 修改后保存在 config 表中，立即生效
+CONFIG_SPEC = {
+    'access.group_id': (int, -1002271927749, None, '使用机器人前必须加入的群组ID'),
+    'access.group_link': (str, 'https://t.me/demon_discuss', None, '加入群组按钮的链接'),
+    'announcement.concurrency': (int, 10, 1, '发送公告的最大并发数'),
+    'log.max_bytes': (int, 5 * 1024 * 1024, 1024, '单个日志文件的最大字节数'),
+    'backfill.limit': (int, BACKFILL_LIMIT, 0, '每个聊天单次最多补拉的消息数'),
+    'backfill.delay': (float, BACKFILL_DELAY, 0, '补拉每条消息之间的间隔（秒）'),
+    'backfill.watermark_flush_interval': (int, WATERMARK_FLUSH_INTERVAL, 1, '水位线写回数据库的间隔（秒）'),
+    'supervisor.interval': (int, SUPERVISOR_INTERVAL, 1, '每轮健康检查的周期（秒）'),
+    'supervisor.reconnect_base_delay': (int, RECONNECT_BASE_DELAY, 1, '重连退避的初始间隔（秒）'),
+    'supervisor.reconnect_max_delay': (int, RECONNECT_MAX_DELAY, 1, '重连退避的最大间隔（秒）'),
+    'supervisor.probe_timeout': (int, PROBE_TIMEOUT, 1, '单次探测超时时间（秒）'),
+    'import.concurrency': (int, BULK_IMPORT_CONCURRENCY, 1, '批量导入时同时验证的会话数量'),
+    'import.max_keywords': (int, KEYWORD_IMPORT_MAX, 1, '单次导入的最大关键词数'),
+    'sync_groups.batch_size': (int, SYNC_GROUPS_BATCH_SIZE, 1, '群组同步每批读取/写入的对话数'),
+    'sync_groups.delay': (float, SYNC_GROUPS_DELAY, 0, '群组同步每批之间的等待时间（秒）'),
+    'chat_owner.stall_timeout': (int, 300, 10, '其他账号收到消息后，归属账号超过该时长（秒）仍未处理该聊天的消息时由其他账号接管'),
+    'chat_owner.active_days': (int, 7, 1, '重新分配归属时，水位线在该天数内推进过的聊天仍视为账号所在的聊天'),
+    'ui.page_size': (int, PAGE_SIZE, 1, '关键词、屏蔽用户、群组列表每页显示的条数'),
+    'ui.accounts_page_size': (int, ACCOUNTS_PAGE_SIZE, 1, '账号列表每页显示的条数'),
+    'queue.batch_size': (int, QUEUE_BATCH_SIZE, 1, '推送队列每批入队/出队的最大条数'),
+    'queue.batch_window': (float, QUEUE_BATCH_WINDOW, 0, '入队攒批的最长等待时间（秒）'),
+    'queue.max_attempts': (int, DELIVERY_MAX_ATTEMPTS, 1, '单条推送的最大尝试次数'),
+    'retention.days': (int, PUSH_LOG_RETENTION_DAYS, 1, '原始推送日志保留天数'),
+    'retention.interval': (int, RETENTION_INTERVAL, 60, '推送日志压缩任务的运行间隔（秒）'),
+    'spam.window': (int, SPAM_WINDOW, 1, '刷屏过滤的滑动窗口长度（秒）'),
+    'spam.max_per_sender': (int, SPAM_MAX_PER_SENDER, 0, '窗口内同一发送者最多推送给同一用户的条数，0 表示不限制'),
+    'spam.simhash_distance': (int, SPAM_SIMHASH_DISTANCE, -1, '近似重复的 SimHash 汉明距离阈值，-1 表示不检测'),
+    'replay.default_limit': (int, 10000, 1, '/replay_keywords 默认回放的消息数'),
+    'replay.fetch_per_chat': (int, 1000, 1, '每个聊天缓存的最近消息数'),
+    'replay.fetch_delay': (float, 1.0, 0, '拉取历史消息时每个聊天之间的等待时间（秒）'),
+    'replay.refresh_interval': (int, 600, 0, '同一聊天两次拉取历史消息的最小间隔（秒）'),
+    'export.chunk_size': (int, 1000, 1, '导出推送记录时每批读取和写入的行数'),
+    'memory.low_memory': (bool, LOW_MEMORY_MODE, None, '低内存模式：有界实体缓存，没有关键词的账号不连接（对之后连接的账号生效）'),
+    'memory.entity_cache_limit': (int, 1000, 100, '低内存模式下每个账号缓存的实体数量上限'),
+    'rate_limit.global_rate': (float, 30.0, 0.1, '机器人每秒最多发出的请求数（所有用户合计）'),
+    'rate_limit.quantum': (int, 1, 1, '同一优先级内每个用户每轮最多发送的请求数'),
+    'rate_limit.max_retries': (int, 1, 0, '遇到 Telegram 限流（RetryAfter）后的重试次数'),
+    'startup.connect_concurrency': (int, 10, 1, '启动时同时连接的账号数量'),
+    'webhook.check_interval': (int, 60, 10, 'webhook 模式下查询推送状态的间隔（秒）'),
+    'webhook.max_pending': (int, 100, 1, 'Telegram 积压的更新数达到该值时视为 webhook 异常'),
+    'webhook.max_failures': (int, 3, 1, '连续多少次检查异常后改用长轮询'),
+    'profile.loop_interval': (float, 0.5, 0.01, '性能分析时事件循环延迟的采样间隔（秒）'),
+    'profile.block_threshold': (float, 0.2, 0.01, '事件循环阻塞超过该时长（秒）时采样调用栈'),
+    'profile.top_n': (int, 10, 1, '/profile 显示的慢调用条数'),
+}
 # 验证必要的环境变量
 required_env_vars = ['TELEGRAM_BOT_TOKEN', 'ADMIN_IDS', 'TELEGRAM_API_ID', 'TELEGRAM_API_HASH']
 missing_vars = [var for var in required_env_vars if not os.getenv(var)]
@@ -76,16 +212,1291 @@ except ValueError:
     logger.error("ADMIN_IDS 必须是逗号分隔的整数。")
     ADMIN_IDS = set()
 
+
+# 启动阶段计时，每个阶段结束时记录该阶段和累计的耗时
+class BootTimer:
+    def __init__(self, started):
+        self.started = started
+        self.last = started
+
+    def phase(self, name):
+        now = time.perf_counter()
+        logger.info(f"启动阶段「{name}」耗时 {(now - self.last) * 1000:.0f}ms，累计 {(now - self.started) * 1000:.0f}ms")
+        self.last = now
+
+
+boot_timer = BootTimer(BOOT_STARTED)
+boot_timer.phase("导入模块")
+
+# 低内存会话：只保留有限数量的实体（带标记的ID -> access_hash、用户名），按最近使用淘汰
+# MemorySession 会无限累积见过的所有实体，并且按线性扫描查找
+class CompactSession(StringSession):
+    def __init__(self, string=None, entity_limit=1000):
+        super().__init__(string)
+        self.entity_limit = entity_limit
+        self._entities = OrderedDict()
+
+    def process_entities(self, tlo):
+        for marked_id, access_hash, username, _, _ in self._entities_to_rows(tlo):
+            self._entities[marked_id] = (access_hash, username)
+            self._entities.move_to_end(marked_id)
+        while len(self._entities) > self.entity_limit:
+            self._entities.popitem(last=False)
+
+    def get_entity_rows_by_id(self, id, exact=True):
+        if exact:
+            candidates = (id,)
+        else:
+            candidates = (
+                utils.get_peer_id(types.PeerUser(id)),
+                utils.get_peer_id(types.PeerChat(id)),
+                utils.get_peer_id(types.PeerChannel(id)),
+            )
+        for marked_id in candidates:
+            row = self._entities.get(marked_id)
+            if row is not None:
+                self._entities.move_to_end(marked_id)
+                return marked_id, row[0]
+        return None
+
+    def get_entity_rows_by_username(self, username):
+        for marked_id, (access_hash, found_username) in self._entities.items():
+            if found_username == username:
+                return marked_id, access_hash
+        return None
+
+    def get_entity_rows_by_phone(self, phone):
+        return None
+
+    def get_entity_rows_by_name(self, name):
+        return None
+
+
+def current_rss():
+    # 当前进程的常驻内存（字节），Linux 读取 /proc，其他系统退回到峰值常驻内存
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+# 会话转换
+def session_bytes_to_string(session_bytes):
+    # 在内存中读取 Telethon 的 SQLite 会话文件内容，转换为 StringSession 字符串
+    data = bytearray(session_bytes)
+    if len(data) >= 20 and data[18] == 2 and data[19] == 2:
+        # WAL 模式的数据库无法直接反序列化，改写文件头为传统日志模式
+        data[18] = data[19] = 1
+    conn = sqlite3.connect(':memory:')
+    try:
+        conn.deserialize(bytes(data))
+        row = conn.execute('SELECT dc_id, server_address, port, auth_key FROM sessions').fetchone()
+    finally:
+        conn.close()
+    if not row or not row[3]:
+        raise ValueError("会话文件中没有授权信息。")
+    dc_id, server_address, port, auth_key = row
+    # 以下组件只在导入账号时用到，延迟导入以加快启动
+    from telethon.crypto import AuthKey
+    session = StringSession()
+    session.set_dc(dc_id, server_address, port)
+    session.auth_key = AuthKey(data=auth_key)
+    return session.save()
+
+
+def _session_file_to_string(session_bytes):
+    # Python 3.11 以下没有 Connection.deserialize，只能借助临时文件读取
+    import tempfile
+    from telethon.sessions import SQLiteSession
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, 'upload.session')
+        with open(path, 'wb') as f:
+            f.write(session_bytes)
+        session = SQLiteSession(path)
+        try:
+            if not session.auth_key:
+                raise ValueError("会话文件中没有授权信息。")
+            return StringSession.save(session)
+        finally:
+            session.close()
+
+
+def extract_session_entries(file_name, data):
+    # 从压缩包或文本文件中读取会话，返回 [(名称, 'file' 或 'string', 内容), ...]
+    entries = []
+
+    def add_text(name, text):
+        for line_no, line in enumerate(text.splitlines(), 1):
+            line = line.strip()
+            if line and not line.startswith('#'):
+                entries.append((f"{name}:{line_no}", 'string', line))
+
+    def add_member(name, size, read):
+        if size > BULK_IMPORT_MAX_FILE_SIZE:
+            raise ValueError(f"{name} 超过大小限制")
+        lower = name.lower()
+        if lower.endswith('.session'):
+            entries.append((os.path.basename(name), 'file', read()))
+        elif lower.endswith('.txt'):
+            add_text(os.path.basename(name), read().decode('utf-8-sig'))
+
+    import tarfile
+    import zipfile
+    lower_name = file_name.lower()
+    try:
+        if lower_name.endswith('.zip'):
+            with zipfile.ZipFile(io.BytesIO(data)) as archive:
+                for info in archive.infolist():
+                    if not info.is_dir():
+                        add_member(info.filename, info.file_size, lambda info=info: archive.read(info))
+        elif lower_name.endswith(('.tar', '.tar.gz', '.tgz', '.gz')):
+            with tarfile.open(fileobj=io.BytesIO(data), mode='r:*') as archive:
+                for member in archive.getmembers():
+                    if member.isfile():
+                        add_member(member.name, member.size, lambda member=member: archive.extractfile(member).read())
+        else:
+            add_text(file_name, data.decode('utf-8-sig'))
+    except (zipfile.BadZipFile, tarfile.TarError) as e:
+        raise ValueError(f"压缩包已损坏: {e}")
+
+    if len(entries) > BULK_IMPORT_MAX_SESSIONS:
+        raise ValueError(f"单次最多导入 {BULK_IMPORT_MAX_SESSIONS} 个会话")
+    return entries
+
+
+def parse_keyword_file(file_name, data):
+    # .csv 文件每个单元格一个关键词（忽略名为 keyword 的表头），其他文件每行一个关键词，保持顺序去重
+    text = data.decode('utf-8-sig')
+    if file_name.lower().endswith('.csv'):
+        import csv
+        cells = [cell for row in csv.reader(io.StringIO(text)) for cell in row]
+        if cells and cells[0].strip().lower() == 'keyword':
+            cells = cells[1:]
+    else:
+        cells = text.splitlines()
+    return list(dict.fromkeys(cell.strip() for cell in cells if cell.strip()))
+
+
+
+PUSH_EXPORT_COLUMNS = ('id', 'user_id', 'timestamp', 'keyword', 'chat_id', 'chat_title', 'message_id')
+
+
+def write_push_export(chunks, fmt, path):
+    # 把分批读取的推送日志写入 gzip 压缩的 CSV 或 NDJSON 文件，一次只保留一批在内存中，返回写入的行数
+    import gzip
+    count = 0
+    with gzip.open(path, 'wt', encoding='utf-8', newline='') as f:
+        if fmt == 'csv':
+            import csv
+            writer = csv.writer(f)
+            writer.writerow(PUSH_EXPORT_COLUMNS)
+        for rows in chunks:
+            if fmt == 'csv':
+                writer.writerows(rows)
+            else:
+                f.writelines(json.dumps(dict(zip(PUSH_EXPORT_COLUMNS, row)), ensure_ascii=False) + '\n' for row in rows)
+            count += len(rows)
+    return count
+
+async def convert_session_bytes(session_bytes):
+    if hasattr(sqlite3.Connection, 'deserialize'):
+        return session_bytes_to_string(session_bytes)
+    return await asyncio.to_thread(_session_file_to_string, bytes(session_bytes))
+
+
+# 回调数据编码：1 个字符的动作前缀 + 若干整数的 zigzag 变长编码（urlsafe base64）
+CALLBACK_BLOCK_USER = 'b'
+CALLBACK_PAGE = 'p'
+CALLBACK_DELETE_KEYWORD = 'd'
+CALLBACK_NOOP = 'n'
+CALLBACK_TOGGLE_GROUP = 'g'
+# 分页视图编号
+PAGE_VIEW_KEYWORDS = 0
+PAGE_VIEW_REMOVE_KEYWORDS = 1
+PAGE_VIEW_BLOCKED = 2
+PAGE_VIEW_ACCOUNTS = 3
+PAGE_VIEW_GROUPS = 4
+
+
+def encode_callback(action, *values):
+    buffer = bytearray()
+    for value in values:
+        value = (value << 1) ^ (value >> 63)  # zigzag，让负数（如群组ID）也能紧凑编码
+        while value >= 0x80:
+            buffer.append((value & 0x7F) | 0x80)
+            value >>= 7
+        buffer.append(value)
+    return action + base64.urlsafe_b64encode(bytes(buffer)).rstrip(b'=').decode('ascii')
+
+
+def decode_callback(data):
+    # 返回 (action, values)，数据格式错误时抛出 ValueError
+    if not data:
+        raise ValueError("回调数据为空")
+    payload = data[1:]
+    raw = base64.urlsafe_b64decode(payload + '=' * (-len(payload) % 4))
+    values, value, shift = [], 0, 0
+    for byte in raw:
+        value |= (byte & 0x7F) << shift
+        if byte & 0x80:
+            shift += 7
+            continue
+        values.append((value >> 1) ^ -(value & 1))
+        value, shift = 0, 0
+    if shift:
+        raise ValueError("回调数据不完整")
+    return data[0], values
+
+
+# 容错关键词：关键词后加 ~N 表示允许 N 个字符的错误（插入、删除或替换），例如 招聘~1
+FUZZY_SUFFIX = re.compile(r'~([0-9])$')
+
+
+def parse_keyword_spec(spec):
+    # 返回 (关键词, 允许的错误数)，无效时抛出 ValueError
+    match = FUZZY_SUFFIX.search(spec)
+    if not match:
+        return spec, 0
+    keyword, max_errors = spec[:match.start()].strip(), int(match.group(1))
+    if not keyword:
+        raise ValueError("关键词不能为空")
+    if max_errors > FUZZY_MAX_ERRORS:
+        raise ValueError(f"最多允许 {FUZZY_MAX_ERRORS} 个错误")
+    if len(keyword) < 2 * max_errors + 1:
+        raise ValueError(f"允许 {max_errors} 个错误的关键词至少需要 {2 * max_errors + 1} 个字符")
+    return keyword, max_errors
+
+
+def format_keyword(keyword, max_errors):
+    return f"{keyword}~{max_errors}" if max_errors else keyword
+
+
+def normalize_keyword_specs(specs):
+    # 校验关键词，返回 (规范化后的关键词, [(无效的关键词, 原因), ...])，保持顺序去重
+    valid, invalid = [], []
+    for spec in dict.fromkeys(specs):
+        try:
+            valid.append(format_keyword(*parse_keyword_spec(spec)))
+        except ValueError as e:
+            invalid.append((spec, str(e)))
+    return list(dict.fromkeys(valid)), invalid
+
+
+class FuzzyKeyword:
+    # 编辑距离不超过 max_errors 的子串视为命中，用 Myers 位并行算法逐字符计算，每个字符只需常数次整数运算
+    # 按鸽巢原理把关键词切成 max_errors + 1 段，命中时至少有一段原样出现，只在这些段出现的位置附近验证
+    def __init__(self, keyword, max_errors):
+        self.keyword = keyword
+        self.max_errors = max_errors
+        self.length = len(keyword)
+        self.peq = {}  # 每个字符在关键词中出现位置的位图
+        for i, ch in enumerate(keyword):
+            self.peq[ch] = self.peq.get(ch, 0) | (1 << i)
+        self.full = (1 << self.length) - 1
+        self.high = 1 << (self.length - 1)
+        bounds = [self.length * i // (max_errors + 1) for i in range(max_errors + 2)]
+        self.pieces = [keyword[a:b] for a, b in zip(bounds, bounds[1:])]
+
+    def search(self, text, start, end, state=None):
+        # text[start:end] 中是否存在与关键词编辑距离不超过 max_errors 的子串
+        # state 为 [已扫描到的位置, pv, mv, score]，窗口与上次扫描重叠时从上次的位置继续，每个字符最多扫描一次
+        if state is not None and state[0] >= start:
+            i, pv, mv, score = state
+        elif end - start < self.length - self.max_errors:
+            return False
+        else:
+            i, pv, mv, score = start, self.full, 0, self.length
+        peq, full, high, k = self.peq, self.full, self.high, self.max_errors
+        found = False
+        while i < end:
+            eq = peq.get(text[i], 0)
+            i += 1
+            xv = eq | mv
+            xh = (((eq & pv) + pv) ^ pv) | eq
+            ph = mv | (~(xh | pv) & full)
+            mh = pv & xh
+            if ph & high:
+                score += 1
+            elif mh & high:
+                score -= 1
+                if score <= k:
+                    found = True
+                    break
+            ph = (ph << 1) & full
+            mh = (mh << 1) & full
+            pv = mh | (~(xv | ph) & full)
+            mv = ph & xv
+        if state is not None:
+            state[:] = (i, pv, mv, score)
+        return found
+
+    def verify(self, text, piece_end, lo=0, hi=None, state=None):
+        # 片段在 text 中结束于 piece_end，包含它的匹配一定在 [piece_end - m - k, piece_end + m + k) 内（不超出 [lo, hi)）
+        # 窗口只取决于 piece_end，按位置顺序验证时窗口单调右移，可以接着上次的扫描进度继续
+        hi = len(text) if hi is None else hi
+        span = self.length + self.max_errors
+        return self.search(text, max(lo, piece_end - span), min(hi, piece_end + span), state)
+
+    def find_in(self, text, lo=0, hi=None):
+        # 在 text[lo:hi] 中查找，按出现位置依次验证各片段
+        hi = len(text) if hi is None else hi
+        piece_ends = []
+        for piece in self.pieces:
+            position = text.find(piece, lo, hi)
+            while position != -1:
+                piece_ends.append(position + len(piece))
+                position = text.find(piece, position + 1, hi)
+        scan = [-1, 0, 0, 0]
+        for piece_end in sorted(piece_ends):
+            if self.verify(text, piece_end, lo, hi, scan):
+                return True
+        return False
+
+
+# 关键词匹配
+class KeywordMatcher:
+    # 关键词较少时直接逐个做子串查找更快，超过该数量时使用 Aho-Corasick 自动机一次扫描
+    SMALL_SET = 8
+
+    def __init__(self, keywords):
+        self.keywords = list(keywords)
+        # 容错关键词，key: 关键词下标, value: FuzzyKeyword
+        self.fuzzy = {}
+        self.patterns = []
+        for index, spec in enumerate(self.keywords):
+            keyword, max_errors = parse_keyword_spec(spec)
+            self.patterns.append(keyword)
+            if max_errors:
+                self.fuzzy[index] = FuzzyKeyword(keyword, max_errors)
+        self.goto = [{}]  # 每个状态的转移表
+        self.fail = [0]  # 失败指针
+        self.first = [len(self.keywords)]  # 到达该状态时命中的精确关键词中，顺序最靠前的下标
+        self.pieces = [()]  # 到达该状态时有片段完整出现的容错关键词下标
+        self.piece_link = [0]  # 沿失败链最近的有片段的状态
+        if len(self.keywords) > self.SMALL_SET:
+            self._build()
+
+    # 快照头部：状态数、转移边数、片段引用数、元数据长度；之后是 JSON 元数据和若干 uint32 数组
+    _SNAPSHOT_HEADER = struct.Struct('<4I')
+
+    def to_snapshot(self):
+        # 把编译好的自动机展开为连续的 uint32 数组，加载时无需重新插入关键词和计算失败指针
+        meta = json.dumps({
+            'keywords': self.keywords,
+            'patterns': self.patterns,
+            'fuzzy': [[index, fuzzy.max_errors] for index, fuzzy in self.fuzzy.items()],
+        }, ensure_ascii=False).encode('utf-8')
+        meta += b'\0' * (-len(meta) % 4)
+        edge_start, edge_chars, edge_targets = array('I', [0]), array('I'), array('I')
+        for edges in self.goto:
+            edge_chars.extend(map(ord, edges))
+            edge_targets.extend(edges.values())
+            edge_start.append(len(edge_chars))
+        piece_start, piece_refs = array('I', [0]), array('I')
+        for refs in self.pieces:
+            piece_refs.extend(refs)
+            piece_start.append(len(piece_refs))
+        arrays = (
+            edge_start, edge_chars, edge_targets, array('I', self.fail), array('I', self.first),
+            array('I', self.piece_link), piece_start, piece_refs,
+        )
+        header = self._SNAPSHOT_HEADER.pack(len(self.goto), len(edge_chars), len(piece_refs), len(meta))
+        return header + meta + b''.join(a.tobytes() for a in arrays)
+
+    @classmethod
+    def from_snapshot(cls, buffer):
+        # 从 to_snapshot 的结果（可以是内存映射文件的 memoryview）恢复匹配器
+        states, edges, refs, meta_length = cls._SNAPSHOT_HEADER.unpack_from(buffer)
+        offset = cls._SNAPSHOT_HEADER.size
+        meta = json.loads(bytes(buffer[offset:offset + meta_length]).rstrip(b'\0'))
+        with buffer[offset + meta_length:].cast('I') as words:
+            if len(words) != 5 * states + 2 + 2 * edges + refs:
+                raise ValueError("快照数据长度不符")
+            position = 0
+
+            def take(count):
+                nonlocal position
+                position += count
+                return words[position - count:position].tolist()
+
+            edge_start, edge_chars, edge_targets = take(states + 1), ''.join(map(chr, take(edges))), take(edges)
+            fail, first, piece_link = take(states), take(states), take(states)
+            piece_start, piece_refs = take(states + 1), take(refs)
+        matcher = cls.__new__(cls)
+        matcher.keywords = meta['keywords']
+        matcher.patterns = meta['patterns']
+        matcher.fuzzy = {index: FuzzyKeyword(matcher.patterns[index], max_errors) for index, max_errors in meta['fuzzy']}
+        matcher.goto = [
+            dict(zip(edge_chars[a:b], edge_targets[a:b])) for a, b in zip(edge_start, edge_start[1:])
+        ]
+        matcher.fail, matcher.first, matcher.piece_link = fail, first, piece_link
+        matcher.pieces = [tuple(piece_refs[a:b]) if a != b else () for a, b in zip(piece_start, piece_start[1:])]
+        return matcher
+
+    def _insert(self, word):
+        goto = self.goto
+        state = 0
+        for ch in word:
+            next_state = goto[state].get(ch)
+            if next_state is None:
+                next_state = len(goto)
+                goto[state][ch] = next_state
+                goto.append({})
+                self.fail.append(0)
+                self.first.append(len(self.keywords))
+                self.pieces.append(())
+                self.piece_link.append(0)
+            state = next_state
+        return state
+
+    def _build(self):
+        goto, fail, first, pieces, piece_link = self.goto, self.fail, self.first, self.pieces, self.piece_link
+        for index, keyword in enumerate(self.patterns):
+            fuzzy = self.fuzzy.get(index)
+            if fuzzy is None:
+                state = self._insert(keyword)
+                first[state] = min(first[state], index)
+                continue
+            # 容错关键词的精确出现也一定包含各个片段，只需插入片段
+            for piece in fuzzy.pieces:
+                state = self._insert(piece)
+                pieces[state] += (index,)
+        # 广度优先计算失败指针，并沿失败链合并命中的关键词
+        queue = [0]
+        for state in queue:
+            for ch, next_state in goto[state].items():
+                queue.append(next_state)
+                if state == 0:
+                    continue  # 第一层节点的失败指针指向根节点
+                f = fail[state]
+                while f and ch not in goto[f]:
+                    f = fail[f]
+                fail[next_state] = goto[f].get(ch, 0)
+                first[next_state] = min(first[next_state], first[fail[next_state]])
+                f = fail[next_state]
+                piece_link[next_state] = f if pieces[f] else piece_link[f]
+
+    def match(self, text):
+        # 返回消息中包含的关键词里顺序最靠前的一个，没有则返回 None
+        if len(self.keywords) <= self.SMALL_SET:
+            for index, keyword in enumerate(self.patterns):
+                fuzzy = self.fuzzy.get(index)
+                if fuzzy.find_in(text) if fuzzy else keyword in text:
+                    return self.keywords[index]
+            return None
+        if self.fuzzy:
+            return self._match_fuzzy(text)
+        goto, fail, first = self.goto, self.fail, self.first
+        best = len(self.keywords)
+        state = 0
+        for ch in text:
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if first[state] < best:
+                best = first[state]
+                if best == 0:
+                    break
+        return self.keywords[best] if best < len(self.keywords) else None
+
+    def _match_fuzzy(self, text):
+        # 与精确匹配同一次扫描；扫描到容错关键词的片段时，只验证比当前结果更靠前的关键词
+        goto, fail, first, pieces, piece_link, fuzzy = (
+            self.goto, self.fail, self.first, self.pieces, self.piece_link, self.fuzzy
+        )
+        best = len(self.keywords)
+        scans = {}  # 每个容错关键词的扫描进度
+        state = 0
+        for position, ch in enumerate(text, 1):
+            while state and ch not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            if first[state] < best:
+                best = first[state]
+                if best == 0:
+                    break
+            hit = state if pieces[state] else piece_link[state]
+            while hit:
+                for index in pieces[hit]:
+                    if index >= best:
+                        continue
+                    scan = scans.get(index)
+                    if scan is None:
+                        scan = scans[index] = [-1, 0, 0, 0]
+                    if fuzzy[index].verify(text, position, state=scan):
+                        best = index
+                hit = piece_link[hit]
+            if best == 0:
+                break
+        return self.keywords[best] if best < len(self.keywords) else None
+
+
+# 关键词匹配器快照：启动时内存映射，关键词版本未变化的用户直接加载，无需重新编译
+class MatcherSnapshot:
+    # 文件格式：文件头（魔数、格式版本、字节序、数据库ID、用户数）+ 索引（用户ID、关键词版本、偏移、长度）+ 各用户的匹配器数据
+    MAGIC = b'KWMSNAP\0'
+    FORMAT_VERSION = 2
+    _HEADER = struct.Struct('<8sIBxxx16sI')
+    _ENTRY = struct.Struct('<qqQQ')
+
+    def __init__(self, path, database_id):
+        self.path = path
+        # 关键词版本是每个数据库各自的计数，换了数据库后版本号可能相同而关键词不同，快照只对生成它的数据库有效
+        self.database_id = database_id
+        self._file = None
+        self._mmap = None
+        self._index = {}  # key: 用户ID, value: (关键词版本, 偏移, 长度)
+        self._lock = threading.Lock()  # 写入快照在线程中进行，替换文件时不能同时读取
+
+    def open(self):
+        # 映射快照文件并读取索引，返回用户数；文件不存在、格式不兼容或不完整时视为空快照
+        with self._lock:
+            self._close()
+            try:
+                f = open(self.path, 'rb')
+            except FileNotFoundError:
+                return 0
+            mapped = None
+            try:
+                mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, version, little_endian, database_id, count = self._HEADER.unpack_from(mapped)
+                if magic != self.MAGIC or version != self.FORMAT_VERSION:
+                    raise ValueError("格式版本不兼容")
+                if little_endian != (sys.byteorder == 'little'):
+                    raise ValueError("字节序不一致")
+                if database_id != self.database_id:
+                    raise ValueError("快照不是由当前数据库生成的")
+                index = {}
+                for i in range(count):
+                    user_id, keyword_version, offset, length = self._ENTRY.unpack_from(
+                        mapped, self._HEADER.size + i * self._ENTRY.size
+                    )
+                    if offset + length > len(mapped):
+                        raise ValueError("文件不完整")
+                    index[user_id] = (keyword_version, offset, length)
+            except (OSError, ValueError, struct.error) as e:
+                logger.warning(f"忽略无效的关键词匹配器快照 {self.path}: {e}")
+                if mapped is not None:
+                    mapped.close()
+                f.close()
+                return 0
+            self._file, self._mmap, self._index = f, mapped, index
+            return len(index)
+
+    def close(self):
+        with self._lock:
+            self._close()
+
+    def _close(self):
+        self._index = {}
+        if self._mmap is not None:
+            self._mmap.close()
+            self._file.close()
+            self._mmap = self._file = None
+
+    def versions(self):
+        return {user_id: entry[0] for user_id, entry in self._index.items()}
+
+    def load(self, user_id, version):
+        # 快照中该用户的关键词版本与当前一致时返回匹配器，否则返回 None
+        with self._lock:
+            entry = self._index.get(user_id)
+            if entry is None or entry[0] != version:
+                return None
+            _, offset, length = entry
+            try:
+                with memoryview(self._mmap) as view, view[offset:offset + length] as record:
+                    return KeywordMatcher.from_snapshot(record)
+            except (ValueError, KeyError, IndexError, TypeError, struct.error) as e:
+                logger.warning(f"快照中用户 {user_id} 的匹配器已损坏，将重新编译: {e}")
+                return None
+
+    def raw(self, user_id, version):
+        # 返回快照中该用户的原始数据，用于重写快照时原样保留未变化的用户
+        with self._lock:
+            entry = self._index.get(user_id)
+            if entry is None or entry[0] != version:
+                return None
+            return self._mmap[entry[1]:entry[1] + entry[2]]
+
+    def write(self, records):
+        # records: {用户ID: (关键词版本, 匹配器数据)}；先写临时文件再原子替换，写入中途崩溃不会损坏原快照
+        header_size = self._HEADER.size + self._ENTRY.size * len(records)
+        offset = header_size + (-header_size % 8)
+        entries, blobs = [], []
+        for user_id, (keyword_version, data) in records.items():
+            entries.append(self._ENTRY.pack(user_id, keyword_version, offset, len(data)))
+            blobs.append(data + b'\0' * (-len(data) % 8))  # 每段数据按 8 字节对齐
+            offset += len(blobs[-1])
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, 'wb') as f:
+            f.write(self._HEADER.pack(
+                self.MAGIC, self.FORMAT_VERSION, sys.byteorder == 'little', self.database_id, len(records)
+            ))
+            f.write(b''.join(entries))
+            f.write(b'\0' * (-header_size % 8))
+            for blob in blobs:
+                f.write(blob)
+            f.flush()
+            os.fsync(f.fileno())
+        with self._lock:
+            self._close()
+            os.replace(temp_path, self.path)
+        return self.open()
+
+
+# 每个字节的 8 个比特展开到 8 个 16 位计数槽，SimHash 累加时一次加法即可统计所有比特
+_SIMHASH_LANES = [sum(((b >> i) & 1) << (16 * i) for i in range(8)) for b in range(256)]
+
+
+def simhash(text):
+    # 对归一化文本的 3 字符片段计算 64 位 SimHash，文本为空时返回 None
+    # 使用内置 hash()，指纹只在当前进程内比较
+    chars = ''.join(ch for ch in text[:SIMHASH_MAX_CHARS].casefold() if ch.isalnum())
+    if not chars:
+        return None
+    shingles = {chars[i:i + 3] for i in range(max(1, len(chars) - 2))}
+    lanes = _SIMHASH_LANES
+    total = 0
+    for shingle in shingles:
+        h = hash(shingle) & 0xFFFFFFFFFFFFFFFF
+        spread = 0
+        for k in range(8):
+            spread |= lanes[(h >> (8 * k)) & 0xFF] << (128 * k)
+        total += spread
+    half = len(shingles) / 2
+    fingerprint = 0
+    for i in range(64):
+        if (total >> (16 * i)) & 0xFFFF > half:
+            fingerprint |= 1 << i
+    return fingerprint
+
+
+# 聊天归属：同一用户的多个账号在同一个聊天中时，只由一个账号接收该聊天的消息
+def assign_chat_owners(members, owners, accounts):
+    # members: {聊天ID: 在该聊天中的账号ID集合}，owners: 当前的 {聊天ID: 账号ID}，accounts: 用户的全部账号ID
+    # 尽量保留现有的归属，只把超出平均负载的聊天移给负载最低的成员账号，返回新的 {聊天ID: 账号ID}
+    assigned = {chat_id: account_id for chat_id, account_id in owners.items() if account_id in accounts}
+    for chat_id, account_ids in members.items():
+        if assigned.get(chat_id) not in account_ids:
+            assigned.pop(chat_id, None)
+    load = Counter(assigned.values())
+    cap = -(-len(members) // max(1, len({a for account_ids in members.values() for a in account_ids})))
+    # 可选账号少的聊天先分配，给只能由某个账号负责的聊天留出余量
+    for chat_id in sorted(members, key=lambda c: (len(members[c]), c)):
+        best = min(members[chat_id], key=lambda a: (load[a], a))
+        owner = assigned.get(chat_id)
+        if owner is None or (load[owner] > cap and load[best] + 1 < load[owner]):
+            if owner is not None:
+                load[owner] -= 1
+            assigned[chat_id] = best
+            load[best] += 1
+    return assigned
+
+
+# 刷屏过滤：按 (用户, 发送者) 的滑动窗口限流，并用 SimHash 丢弃窗口内近似重复的消息
+class SpamFilter:
+    def __init__(self, window=SPAM_WINDOW, max_per_sender=SPAM_MAX_PER_SENDER, max_distance=SPAM_SIMHASH_DISTANCE):
+        self.window = window
+        self.max_per_sender = max_per_sender
+        self.max_distance = max_distance
+        # 汉明距离不超过 d 时，把指纹分成 d+1 段，至少有一段完全相同，只需比较同段的候选
+        self.bands = max(max_distance, 0) + 1
+        self.band_bits = 64 // self.bands
+        self._sender_hits = {}  # key: (uid, sender_id), value: 窗口内推送时间的 deque
+        self._sender_events = deque()  # (时间, (uid, sender_id))，按时间顺序过期
+        self._buckets = {}  # key: (uid, 段号, 段值), value: (时间, 指纹) 的 deque
+        self._fingerprints = deque()  # (时间, 段键列表)，按时间顺序过期
+
+    def _evict(self, now):
+        cutoff = now - self.window
+        while self._sender_events and self._sender_events[0][0] <= cutoff:
+            _, key = self._sender_events.popleft()
+            hits = self._sender_hits[key]
+            hits.popleft()
+            if not hits:
+                del self._sender_hits[key]
+        while self._fingerprints and self._fingerprints[0][0] <= cutoff:
+            _, band_keys = self._fingerprints.popleft()
+            for band_key in band_keys:
+                bucket = self._buckets[band_key]
+                bucket.popleft()
+                if not bucket:
+                    del self._buckets[band_key]
+
+    def check(self, uid, sender_id, text, now=None):
+        # 返回过滤原因（'rate' 或 'duplicate'），允许推送时返回 None 并记录本次推送
+        now = time.monotonic() if now is None else now
+        self._evict(now)
+        key = (uid, sender_id)
+        if self.max_per_sender and len(self._sender_hits.get(key, ())) >= self.max_per_sender:
+            return 'rate'
+        fingerprint = simhash(text) if self.max_distance >= 0 else None
+        if fingerprint is not None:
+            mask = (1 << self.band_bits) - 1
+            band_keys = [(uid, i, (fingerprint >> (i * self.band_bits)) & mask) for i in range(self.bands)]
+            for band_key in band_keys:
+                for _, other in self._buckets.get(band_key, ()):
+                    if bin(fingerprint ^ other).count('1') <= self.max_distance:
+                        return 'duplicate'
+            for band_key in band_keys:
+                self._buckets.setdefault(band_key, deque()).append((now, fingerprint))
+            self._fingerprints.append((now, band_keys))
+        self._sender_hits.setdefault(key, deque()).append(now)
+        self._sender_events.append((now, key))
+        return None
+
+
+
+class FairRateLimiter(BaseRateLimiter):
+    # 出站请求调度：按优先级分道（交互 > 推送 > 公告），同一优先级内按接收的聊天做差额轮询（DRR），
+    # 所有请求按 rate 整体限速，单个用户的推送高峰不会拖慢其他用户
+    def __init__(self, rate=30.0, quantum=1, max_retries=1):
+        self.rate = rate
+        self.quantum = quantum
+        self.max_retries = max_retries
+        # 每个优先级一个轮询队列，key: chat_id, value: [等待放行的 future 的 deque, 剩余额度]
+        self._lanes = [OrderedDict() for _ in (PRIORITY_INTERACTIVE, PRIORITY_ALERT, PRIORITY_BROADCAST)]
+        self._next_slot = 0.0  # 下一个请求最早的放行时间
+        self._paused_until = 0.0  # 不针对聊天的请求遇到 RetryAfter（整个机器人被限流）后，所有请求暂停到该时间
+        self._paused_chats = {}  # key: chat_id, value: 该聊天遇到 RetryAfter 后暂停到的时间
+        self._parked = {}  # key: 暂停中的 chat_id, value: {优先级: 队列}，暂停结束后放回轮询队列
+        self._wakeup = None
+        self._dispatcher = None
+
+    async def initialize(self):
+        # Application 和 Updater 初始化时都会调用，只启动一个调度任务
+        if self._dispatcher is not None:
+            return
+        self._wakeup = asyncio.Event()
+        self._dispatcher = asyncio.create_task(self._dispatch())
+
+    async def shutdown(self):
+        if self._dispatcher is not None:
+            self._dispatcher.cancel()
+            await asyncio.gather(self._dispatcher, return_exceptions=True)
+            self._dispatcher = None
+        for flows in [*self._lanes, *self._parked.values()]:
+            for waiters, _ in flows.values():
+                for waiter in waiters:
+                    waiter.cancel()
+            flows.clear()
+        self._parked.clear()
+        self._paused_chats.clear()
+
+    def pending(self):
+        # 返回每个优先级正在排队的请求数，包括暂停中的聊天
+        counts = [sum(len(waiters) for waiters, _ in lane.values()) for lane in self._lanes]
+        for flows in self._parked.values():
+            for priority, (waiters, _) in flows.items():
+                counts[priority] += len(waiters)
+        return counts
+
+    @staticmethod
+    def _retry_delay(error):
+        retry_after = error.retry_after
+        return float(retry_after.total_seconds() if hasattr(retry_after, 'total_seconds') else retry_after)
+
+    async def process_request(self, callback, args, kwargs, endpoint, data, rate_limit_args):
+        chat_id = data.get('chat_id')
+        # 没有接收者的请求（如 getMe、answerCallbackQuery）不排队
+        if chat_id is None or self._dispatcher is None:
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                if chat_id is None:
+                    # 不针对聊天的请求被限流，说明整个机器人触发了限流，暂停所有请求
+                    self._paused_until = max(self._paused_until, time.monotonic() + self._retry_delay(e))
+                    logger.warning(f"{endpoint} 被 Telegram 限流，所有请求暂停 {self._retry_delay(e)} 秒。")
+                raise
+        priority = rate_limit_args if rate_limit_args in (PRIORITY_ALERT, PRIORITY_BROADCAST) else PRIORITY_INTERACTIVE
+        attempt = 0
+        while True:
+            await self._acquire(priority, chat_id)
+            try:
+                return await callback(*args, **kwargs)
+            except RetryAfter as e:
+                # 限流只针对这个聊天，其他聊天和其他优先级的请求照常放行
+                delay = self._retry_delay(e)
+                self._pause_chat(chat_id, time.monotonic() + delay)
+                attempt += 1
+                if attempt > self.max_retries:
+                    raise
+                logger.warning(f"{endpoint} 在聊天 {chat_id} 被 Telegram 限流，该聊天暂停发送 {delay} 秒后重试（第 {attempt} 次）。")
+
+    def _pause_chat(self, chat_id, until):
+        # 把该聊天在各优先级排队的请求移出轮询队列，暂停期间新到的请求也放在这里
+        self._paused_chats[chat_id] = max(self._paused_chats.get(chat_id, 0.0), until)
+        parked = self._parked.setdefault(chat_id, {})
+        for priority, lane in enumerate(self._lanes):
+            flow = lane.pop(chat_id, None)
+            if flow is not None:
+                parked[priority] = flow
+        self._wakeup.set()
+
+    def _resume_chats(self, now):
+        # 暂停结束的聊天放回轮询队列，返回仍在暂停中的聊天最早的结束时间
+        earliest = None
+        for chat_id, until in list(self._paused_chats.items()):
+            if until > now:
+                earliest = until if earliest is None else min(earliest, until)
+                continue
+            del self._paused_chats[chat_id]
+            for priority, flow in self._parked.pop(chat_id, {}).items():
+                self._lanes[priority][chat_id] = flow
+        return earliest
+
+    async def _acquire(self, priority, chat_id):
+        waiter = asyncio.get_running_loop().create_future()
+        # 暂停中的聊天按优先级放在 _parked 中，其他聊天放在对应优先级的轮询队列中
+        if chat_id in self._parked:
+            flows, key = self._parked[chat_id], priority
+        else:
+            flows, key = self._lanes[priority], chat_id
+        if key not in flows:
+            flows[key] = [deque(), 0]
+        flows[key][0].append(waiter)
+        self._wakeup.set()
+        await waiter
+
+    def _pick(self):
+        # 从优先级最高的非空队列中按 DRR 取出下一个等待者
+        for lane in self._lanes:
+            while lane:
+                chat_id, flow = next(iter(lane.items()))
+                waiters = flow[0]
+                while waiters and waiters[0].done():  # 已取消的等待者
+                    waiters.popleft()
+                if not waiters:
+                    del lane[chat_id]
+                    continue
+                if flow[1] < 1:
+                    flow[1] += self.quantum
+                flow[1] -= 1
+                waiter = waiters.popleft()
+                if not waiters:
+                    del lane[chat_id]
+                elif flow[1] < 1:
+                    lane.move_to_end(chat_id)
+                return waiter
+        return None
+
+    async def _dispatch(self):
+        while True:
+            now = time.monotonic()
+            resume = self._resume_chats(now) if self._paused_chats else None
+            if not any(self._lanes):
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), timeout=None if resume is None else resume - now)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            delay = max(self._next_slot, self._paused_until) - now
+            if delay > 0:
+                # 等待期间可能有更高优先级的请求到达，醒来后重新选择
+                await asyncio.sleep(delay)
+                continue
+            waiter = self._pick()
+            if waiter is None:
+                continue
+            waiter.set_result(None)
+            self._next_slot = max(self._next_slot, time.monotonic() - 1 / self.rate) + 1 / self.rate
+
+
+# 接收更新：webhook 启动失败（Telegram 拒绝 webhook 地址、证书错误、端口被占用等）时改用长轮询，机器人不会因此退出
+class FallbackUpdater(Updater):
+    def __init__(self, bot, update_queue):
+        super().__init__(bot=bot, update_queue=update_queue)
+        self.webhook_active = False  # 当前是否通过 webhook 接收更新
+
+    async def start_webhook(self, *args, **kwargs):
+        try:
+            queue = await super().start_webhook(*args, **kwargs)
+        except Exception as e:
+            logger.error(f"webhook 模式启动失败，改用长轮询: {e}", exc_info=True)
+            return await self.start_polling(timeout=POLL_TIMEOUT)
+        self.webhook_active = True
+        return queue
+
+    async def switch_to_polling(self):
+        # 运行中的 webhook 持续推送失败时调用：停止 webhook 服务器，长轮询启动时会删除已设置的 webhook
+        await self.stop()
+        await self.start_polling(timeout=POLL_TIMEOUT)
+
+    async def stop(self):
+        self.webhook_active = False
+        await super().stop()
+
+
+def replay_keywords(chunks, keywords, blocked_users, spam_filter, uid):
+    # 按推送流程回放缓存的消息：关键词匹配 -> 屏蔽用户 -> 刷屏过滤
+    # 每批消息用 \x00 拼接成一个字符串，每个关键词用 str.find 在整批上扫描，再按偏移量定位到消息
+    # 容错关键词先查找各片段，再在片段所在的消息内验证
+    # 返回 (消息总数, 每个关键词命中的消息数, 每个关键词会产生的推送数)
+    patterns = [parse_keyword_spec(keyword) for keyword in keywords]
+    fuzzy = {index: FuzzyKeyword(keyword, max_errors) for index, (keyword, max_errors) in enumerate(patterns) if max_errors}
+    hits = [0] * len(keywords)
+    alerts = [0] * len(keywords)
+    total = 0
+    for chunk in chunks:
+        total += len(chunk)
+        offsets, position = [], 0
+        for _, text, _ in chunk:
+            offsets.append(position)
+            position += len(text) + 1
+        offsets.append(position)
+        haystack = '\x00'.join(text for _, text, _ in chunk)
+        first = [None] * len(chunk)  # 每条消息命中的关键词中顺序最靠前的下标
+        for index, (keyword, _) in enumerate(patterns):
+            if index in fuzzy:
+                for message_index in _replay_fuzzy(fuzzy[index], haystack, offsets):
+                    hits[index] += 1
+                    if first[message_index] is None:
+                        first[message_index] = index
+                continue
+            start = haystack.find(keyword)
+            while start != -1:
+                message_index = bisect.bisect_right(offsets, start) - 1
+                hits[index] += 1
+                if first[message_index] is None:
+                    first[message_index] = index
+                # 同一条消息只计一次，直接跳到下一条消息继续查找
+                start = haystack.find(keyword, offsets[message_index + 1])
+        for (sender_id, text, date), index in zip(chunk, first):
+            if index is None or sender_id in blocked_users:
+                continue
+            if spam_filter.check(uid, sender_id, text, now=date):
+                continue
+            alerts[index] += 1
+    return total, hits, alerts
+
+
+def _replay_fuzzy(fuzzy, haystack, offsets):
+    # 返回容错关键词命中的消息下标
+    piece_ends = []
+    for piece in fuzzy.pieces:
+        position = haystack.find(piece)
+        while position != -1:
+            piece_ends.append(position + len(piece))
+            position = haystack.find(piece, position + 1)
+    matched = []
+    current, scan = None, None
+    for piece_end in sorted(piece_ends):
+        message_index = bisect.bisect_right(offsets, piece_end - 1) - 1
+        if message_index != current:
+            current, scan = message_index, [-1, 0, 0, 0]
+        elif matched and matched[-1] == message_index:
+            continue
+        if fuzzy.verify(haystack, piece_end, offsets[message_index], offsets[message_index + 1] - 1, scan):
+            matched.append(message_index)
+    return matched
+
+
+# 性能分析：默认关闭，关闭时计时包装只多一次属性判断
+# 开启后记录每个被包装函数的耗时和最慢的调用、采样事件循环延迟，
+# 并由看门狗线程在事件循环被阻塞时对事件循环线程的调用栈采样
+class Profiler:
+    SLOW_CALLS_KEPT = 100  # 保留的最慢调用条数
+    STACK_DEPTH = 8  # 调用栈采样保留的帧数
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._sampler_task = None
+        self._watchdog = None
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stats = {}  # key: 函数名, value: [调用次数, 总耗时, 最大耗时]
+            self.slow_calls = []  # (耗时, 序号, 函数名, 开始时间) 的最小堆
+            self.loop_lags = deque(maxlen=1000)
+            self.stack_samples = Counter()
+            self._seq = 0
+            self.started_at = time.time()
+
+    def record(self, name, duration):
+        with self._lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = [0, 0.0, 0.0]
+            stat[0] += 1
+            stat[1] += duration
+            stat[2] = max(stat[2], duration)
+            self._seq += 1
+            entry = (duration, self._seq, name, time.time() - duration)
+            if len(self.slow_calls) < self.SLOW_CALLS_KEPT:
+                heapq.heappush(self.slow_calls, entry)
+            elif duration > self.slow_calls[0][0]:
+                heapq.heapreplace(self.slow_calls, entry)
+
+    def start(self, loop_interval, block_threshold):
+        # 需要在事件循环中调用
+        if self.enabled:
+            return
+        self.enabled = True
+        # 每个监视线程使用独立的停止事件，快速关闭再开启时旧线程也能收到停止信号
+        self._stop = threading.Event()
+        self._deadline = time.perf_counter()
+        self._sampler_task = asyncio.create_task(self._sample_loop_lag(loop_interval))
+        self._watchdog = threading.Thread(
+            target=self._watch_loop, args=(threading.get_ident(), block_threshold, self._stop), daemon=True
+        )
+        self._watchdog.start()
+
+    def stop(self):
+        self.enabled = False
+        self._stop.set()
+        if self._sampler_task:
+            self._sampler_task.cancel()
+            self._sampler_task = None
+        if self._watchdog:
+            # 监视线程在停止事件设置后立即退出，这里只做短暂等待
+            self._watchdog.join(timeout=1)
+            self._watchdog = None
+
+    async def _sample_loop_lag(self, interval):
+        while True:
+            self._deadline = time.perf_counter() + interval
+            await asyncio.sleep(interval)
+            with self._lock:
+                self.loop_lags.append(max(0.0, time.perf_counter() - self._deadline))
+
+    def _watch_loop(self, loop_thread_id, threshold, stop_event):
+        # 采样协程超过预定唤醒时间仍未运行，说明事件循环被阻塞，对其当前调用栈采样
+        while not stop_event.wait(threshold / 2):
+            if time.perf_counter() - self._deadline < threshold:
+                continue
+            frame = sys._current_frames().get(loop_thread_id)
+            if frame is None:
+                continue
+            stack = traceback.extract_stack(frame, limit=self.STACK_DEPTH)
+            key = ' <- '.join(
+                f"{os.path.basename(f.filename)}:{f.lineno} {f.name}" for f in reversed(stack)
+            )
+            with self._lock:
+                self.stack_samples[key] += 1
+
+    def report(self, top_n):
+        with self._lock:
+            lags = sorted(self.loop_lags)
+            by_total = sorted(self.stats.items(), key=lambda item: item[1][1], reverse=True)[:top_n]
+            slowest = heapq.nlargest(top_n, self.slow_calls)
+            stacks = self.stack_samples.most_common(3)
+        lines = [
+            f"🔬 性能分析：{'运行中' if self.enabled else '已关闭'}，"
+            f"统计自 {datetime.fromtimestamp(self.started_at).strftime('%m-%d %H:%M:%S')}"
+        ]
+        if lags:
+            lines.append(
+                f"\n⏱ 事件循环延迟（{len(lags)} 次采样）：平均 {sum(lags) / len(lags) * 1000:.1f}ms，"
+                f"p99 {lags[min(len(lags) - 1, int(len(lags) * 0.99))] * 1000:.1f}ms，最大 {lags[-1] * 1000:.1f}ms"
+            )
+        if by_total:
+            lines.append("\n📊 总耗时最多的函数：")
+            for name, (count, total, longest) in by_total:
+                lines.append(f"• {name}：{count} 次，共 {total * 1000:.0f}ms，最长 {longest * 1000:.0f}ms")
+        if slowest:
+            lines.append(f"\n🐢 最慢的 {len(slowest)} 次调用：")
+            for duration, _, name, started in slowest:
+                lines.append(f"• {duration * 1000:.0f}ms {name}（{datetime.fromtimestamp(started).strftime('%H:%M:%S')}）")
+        if stacks:
+            lines.append("\n🧵 事件循环阻塞时的调用栈采样：")
+            for stack, count in stacks:
+                lines.append(f"• {count} 次：{stack}")
+        return '\n'.join(lines)
+
+
+profiler = Profiler()
+
+
+def _profiled_generator(generator, name):
+    # 累计生成器内部（如 SQLite 分批读取）的耗时，不包括调用方处理每一项的时间，迭代结束或关闭时记录一次
+    elapsed = 0.0
+    try:
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(generator)
+            except StopIteration:
+                return
+            finally:
+                elapsed += time.perf_counter() - start
+            yield item
+    finally:
+        generator.close()
+        profiler.record(name, elapsed)
+
+
+def profiled(func, name=None):
+    # 计时包装，支持普通函数、协程函数和生成器函数（统计整个迭代过程，而不只是创建生成器）
+    name = name or func.__qualname__
+    if inspect.isgeneratorfunction(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            generator = func(*args, **kwargs)
+            if not profiler.enabled:
+                return generator
+            return _profiled_generator(generator, name)
+    elif asyncio.iscoroutinefunction(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return await func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                profiler.record(name, time.perf_counter() - start)
+    else:
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return func(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.record(name, time.perf_counter() - start)
+    return wrapper
+
+
+def profile_methods(cls):
+    # 为类的所有公开方法加上计时包装
+    for attr, value in list(vars(cls).items()):
+        if callable(value) and not isinstance(value, (staticmethod, classmethod)) and not attr.startswith('_'):
+            setattr(cls, attr, profiled(value))
+    return cls
+
+
+# 运行时配置：以 config 表为后端，读取走内存缓存，修改后通知订阅者
+class RuntimeConfig:
+    def __init__(self, db_manager):
+        self.db_manager = db_manager
+        self._values = {key: spec[1] for key, spec in CONFIG_SPEC.items()}
+        self._overridden = set()
+        self._subscribers = {}  # key: 配置名, value: 回调函数列表
+        for key, raw in db_manager.get_config_values(list(CONFIG_SPEC)).items():
+            try:
+                self._values[key] = self.parse(key, raw)
+                self._overridden.add(key)
+            except ValueError as e:
+                logger.warning(f"忽略无效的配置项 {key}={raw}: {e}")
+
+    @staticmethod
+    def parse(key, raw):
+        if key not in CONFIG_SPEC:
+            raise ValueError(f"未知的配置项: {key}")
+        value_type, _, minimum, _ = CONFIG_SPEC[key]
+        try:
+            if value_type is bool:
+                if str(raw).lower() not in ('1', 'true', 'yes', 'on', '0', 'false', 'no', 'off'):
+                    raise ValueError(raw)
+                value = str(raw).lower() in ('1', 'true', 'yes', 'on')
+            else:
+                value = value_type(raw)
+        except (TypeError, ValueError):
+            raise ValueError(f"{key} 的值必须是 {value_type.__name__} 类型")
+        if minimum is not None and value < minimum:
+            raise ValueError(f"{key} 不能小于 {minimum}")
+        return value
+
+    def __getitem__(self, key):
+        return self._values[key]
+
+    def is_overridden(self, key):
+        return key in self._overridden
+
+    def sections(self):
+        return sorted({key.split('.', 1)[0] for key in CONFIG_SPEC})
+
+    def items(self, section=None):
+        return [
+            (key, self._values[key]) for key in CONFIG_SPEC
+            if section is None or key.split('.', 1)[0] == section
+        ]
+
+    def set(self, key, raw):
+        # 校验并保存配置，返回转换后的值，无效时抛出 ValueError
+        value = self.parse(key, raw)
+        self.db_manager.set_config_value(key, str(value))
+        self._overridden.add(key)
+        self._apply(key, value)
+        return value
+
+    def reset(self, key):
+        if key not in CONFIG_SPEC:
+            raise ValueError(f"未知的配置项: {key}")
+        self.db_manager.delete_config_value(key)
+        self._overridden.discard(key)
+        self._apply(key, CONFIG_SPEC[key][1])
+        return self._values[key]
+
+    def subscribe(self, key, callback):
+        # 注册变更回调，注册时立即以当前值调用一次
+        self._subscribers.setdefault(key, []).append(callback)
+        callback(self._values[key])
+
+    def _apply(self, key, value):
+        self._values[key] = value
+        for callback in self._subscribers.get(key, []):
+            try:
+                callback(value)
+            except Exception as e:
+                logger.error(f"应用配置项 {key} 的变更失败: {e}", exc_info=True)
+
+
 # 数据库管理类
+@profile_methods
 class DatabaseManager:
+    # 数据库结构版本，记录在 PRAGMA user_version 中；修改表结构时需要递增
+    SCHEMA_VERSION = 9
+
     def __init__(self, db_path):
         self.db_path = db_path
+        # 每个用户的关键词和屏蔽列表缓存，写入时失效
+        self._keyword_cache = {}  # key: user_id, value: [(keyword_id, keyword), ...]
+        self._blocked_ids = {}  # key: receiving_user_id, value: 屏蔽的用户ID，升序的 array('q')，增删时增量更新
+        self._blocked_list_cache = {}  # key: receiving_user_id, value: 屏蔽列表 {user_id: {'first_name', 'username'}}，增删时失效
+        self._accounts_cache = {}  # key: user_id, value: 用户的账号列表，账号增删或状态变化时失效
+        self._global_blocked = set()  # 管理员全局屏蔽的用户ID，启动时加载
+        self._keyword_versions = {}  # key: user_id, value: 关键词变更次数，用于判断匹配器是否需要重建
+        self._monitored_cache = {}  # key: user_id, value: 监听的群组ID集合，为空表示监听全部聊天
+        self._claim_cursor = None  # 上一批推送取到的最后一个用户，下一批从它之后的用户开始轮流取
         self.initialize_database()
+        self.load_global_blocked_users()
+        self.load_keyword_versions()
 
     def initialize_database(self):
         logger.debug("初始化数据库连接。")
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
+            # 结构版本一致时跳过建表和迁移检查，加快启动
+            cursor.execute('PRAGMA user_version')
+            if cursor.fetchone()[0] == self.SCHEMA_VERSION:
+                logger.info("数据库结构已是最新版本，跳过初始化检查。")
+                return
+            # 启用增量 VACUUM，旧数据库需要执行一次完整 VACUUM 才能生效
+            cursor.execute('PRAGMA auto_vacuum')
+            if cursor.fetchone()[0] != 2:
+                cursor.execute('PRAGMA auto_vacuum = INCREMENTAL')
+                cursor.execute("SELECT COUNT(*) FROM sqlite_master WHERE type = 'table'")
+                if cursor.fetchone()[0]:
+                    logger.info("正在迁移数据库以启用增量 VACUUM，这只会执行一次。")
+                    cursor.execute('VACUUM')
+            # 使用 WAL 模式，推送队列的频繁读写不会阻塞其他查询
+            cursor.execute('PRAGMA journal_mode=WAL')
             # 创建配置表
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS config (
@@ -110,12 +1521,59 @@ class DatabaseManager:
                     message_id INTEGER,
                     timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
                 )
-            ''')            # 创建用户 Telegram 账号表，支持多账号
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_push_logs_timestamp ON push_logs (timestamp)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_push_logs_user_keyword ON push_logs (user_id, keyword)')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_push_logs_user_id ON push_logs (user_id, id)')
+            # 创建推送日志每日汇总表，超过保留期的原始日志压缩到这里
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS push_log_daily (
+                    user_id INTEGER NOT NULL,
+                    keyword TEXT NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    day TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (user_id, keyword, chat_id, day)
+                )
+            ''')
+            # 创建推送统计汇总表，随推送记录增量更新，/my_stats 只读取这些表
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS push_stats_totals (
+                    user_id INTEGER PRIMARY KEY,
+                    total INTEGER NOT NULL
+                )
+            ''')
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS push_stats_hourly (
+                    user_id INTEGER NOT NULL,
+                    hour TEXT NOT NULL,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (user_id, hour)
+                )
+            ''')
+            # kind 为 keyword / chat / sender，item 为对应的关键词、群组ID或发送者ID，label 为显示名称
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS push_stats_daily (
+                    user_id INTEGER NOT NULL,
+                    day TEXT NOT NULL,
+                    kind TEXT NOT NULL,
+                    item TEXT NOT NULL,
+                    label TEXT,
+                    count INTEGER NOT NULL,
+                    PRIMARY KEY (user_id, day, kind, item)
+                )
+            ''')
+            # 首次升级时根据已有推送日志生成汇总数据
+            cursor.execute("SELECT 1 FROM config WHERE key = 'push_stats_version'")
+            if cursor.fetchone() is None:
+                self._rebuild_push_stats(cursor)
+                cursor.execute("INSERT OR REPLACE INTO config (key, value) VALUES ('push_stats_version', '1')")
+            # 创建用户 Telegram 账号表，支持多账号
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS user_accounts (
                     account_id INTEGER PRIMARY KEY AUTOINCREMENT,
                     user_id INTEGER NOT NULL,
-                    username TEXT NOT NULL UNIQUE,
+                    username TEXT NOT NULL,
                     firstname TEXT,
                     lastname TEXT,
                     session_string TEXT NOT NULL UNIQUE,
@@ -154,6 +1612,49 @@ class DatabaseManager:
                 ''')
                 cursor.execute('DROP TABLE user_accounts')
                 cursor.execute('ALTER TABLE user_accounts_new RENAME TO user_accounts')
+            # 检查是否需要添加账号健康状态列
+            cursor.execute("PRAGMA table_info(user_accounts)")
+            columns = [column[1] for column in cursor.fetchall()]
+            if 'is_healthy' not in columns:
+                cursor.execute('ALTER TABLE user_accounts ADD COLUMN is_healthy INTEGER DEFAULT 1')
+                cursor.execute('ALTER TABLE user_accounts ADD COLUMN last_error TEXT')
+                cursor.execute('ALTER TABLE user_accounts ADD COLUMN last_checked DATETIME')
+            # 旧版本的 username 列带有 UNIQUE 约束，没有用户名的账号（存为空字符串）只能保存一个，需要重建表去掉该约束
+            cursor.execute("PRAGMA index_list(user_accounts)")
+            unique_indexes = [row[1] for row in cursor.fetchall() if row[2] and row[3] == 'u']
+            username_unique = False
+            for index_name in unique_indexes:
+                cursor.execute(f"PRAGMA index_info('{index_name}')")
+                if [row[2] for row in cursor.fetchall()] == ['username']:
+                    username_unique = True
+            if username_unique:
+                logger.info("正在迁移账号表，去掉用户名的唯一约束。")
+                cursor.execute('''
+                    CREATE TABLE user_accounts_new (
+                        account_id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        user_id INTEGER NOT NULL,
+                        username TEXT NOT NULL,
+                        firstname TEXT,
+                        lastname TEXT,
+                        session_string TEXT UNIQUE,
+                        is_authenticated INTEGER DEFAULT 0,
+                        two_factor_enabled INTEGER DEFAULT 0,
+                        is_healthy INTEGER DEFAULT 1,
+                        last_error TEXT,
+                        last_checked DATETIME,
+                        FOREIGN KEY(user_id) REFERENCES allowed_users(user_id)
+                    )
+                ''')
+                cursor.execute('''
+                    INSERT INTO user_accounts_new
+                    (account_id, user_id, username, firstname, lastname, session_string, is_authenticated,
+                     two_factor_enabled, is_healthy, last_error, last_checked)
+                    SELECT account_id, user_id, username, firstname, lastname, session_string, is_authenticated,
+                           two_factor_enabled, is_healthy, last_error, last_checked
+                    FROM user_accounts
+                ''')
+                cursor.execute('DROP TABLE user_accounts')
+                cursor.execute('ALTER TABLE user_accounts_new RENAME TO user_accounts')
             # 创建用户群组监听表
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS user_monitored_groups (
@@ -171,6 +1672,27 @@ class DatabaseManager:
                     group_name TEXT NOT NULL
                 )
             ''')
+            # 创建消息缓存表，保存 /replay_keywords 拉取的历史消息
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS message_cache (
+                    chat_id INTEGER NOT NULL,
+                    message_id INTEGER NOT NULL,
+                    sender_id INTEGER,
+                    text TEXT NOT NULL,
+                    date INTEGER NOT NULL,
+                    PRIMARY KEY (chat_id, message_id)
+                ) WITHOUT ROWID
+            ''')
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_message_cache_date ON message_cache(date)')
+            # 创建账号所在群组表，由 /sync_groups 从账号的对话列表中同步
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS account_groups (
+                    account_id INTEGER NOT NULL,
+                    group_id INTEGER NOT NULL,
+                    synced_at REAL NOT NULL,
+                    PRIMARY KEY (account_id, group_id)
+                )
+            ''')
             # 创建屏蔽用户表，新增 receiving_user_id 字段
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS blocked_users (
@@ -182,22 +1704,133 @@ class DatabaseManager:
                     FOREIGN KEY(receiving_user_id) REFERENCES allowed_users(user_id)
                 )
             ''')
+            # 创建全局屏蔽用户表，由管理员维护，对所有用户生效
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS global_blocked_users (
+                    user_id INTEGER PRIMARY KEY,
+                    first_name TEXT,
+                    username TEXT,
+                    blocked_by INTEGER,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
             # 创建关键词表
             cursor.execute('''
                 CREATE TABLE IF NOT EXISTS keywords (
                     id INTEGER PRIMARY KEY AUTOINCREMENT,
                     user_id INTEGER NOT NULL,
                     keyword TEXT NOT NULL,
+                    max_errors INTEGER NOT NULL DEFAULT 0,
                     UNIQUE(user_id, keyword)
                 )
             ''')
+            # 检查是否需要添加容错匹配的错误数列
+            cursor.execute("PRAGMA table_info(keywords)")
+            if 'max_errors' not in [column[1] for column in cursor.fetchall()]:
+                cursor.execute('ALTER TABLE keywords ADD COLUMN max_errors INTEGER NOT NULL DEFAULT 0')
+            # 创建关键词变更计数表，由触发器维护，重启后仍能判断匹配器快照是否过期
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS keyword_changes (
+                    user_id INTEGER PRIMARY KEY,
+                    version INTEGER NOT NULL
+                )
+            ''')
+            cursor.execute('INSERT OR IGNORE INTO keyword_changes (user_id, version) SELECT DISTINCT user_id, 1 FROM keywords')
+            bump = '''
+                INSERT INTO keyword_changes (user_id, version) VALUES ({0}.user_id, 1)
+                ON CONFLICT(user_id) DO UPDATE SET version = version + 1;
+            '''
+            for event, rows in (('INSERT', ('NEW',)), ('DELETE', ('OLD',)), ('UPDATE', ('OLD', 'NEW'))):
+                cursor.execute(f'''
+                    CREATE TRIGGER IF NOT EXISTS keywords_after_{event.lower()} AFTER {event} ON keywords
+                    BEGIN {''.join(bump.format(row) for row in rows)} END
+                ''')
+            # 创建持久化推送队列表，匹配到的消息先入队，发送成功并确认后才删除
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS delivery_queue (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    user_id INTEGER NOT NULL,
+                    payload TEXT NOT NULL,
+                    attempts INTEGER DEFAULT 0,
+                    leased_until REAL,
+                    created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                )
+            ''')
+            # 按用户取队首消息，取一批的开销只和批大小有关，与队列长度无关
+            cursor.execute('CREATE INDEX IF NOT EXISTS idx_delivery_queue_user_id ON delivery_queue (user_id, id)')
+            # 创建聊天水位线表，记录每个账号在每个聊天中已处理的最大消息ID
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS chat_watermarks (
+                    account_id INTEGER NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    last_message_id INTEGER NOT NULL,
+                    access_hash INTEGER,
+                    updated_at REAL,
+                    PRIMARY KEY (account_id, chat_id)
+                )
+            ''')
+            # 检查是否需要添加水位线推进时间列，已有的水位线视为刚推进过
+            cursor.execute("PRAGMA table_info(chat_watermarks)")
+            if 'updated_at' not in [column[1] for column in cursor.fetchall()]:
+                cursor.execute('ALTER TABLE chat_watermarks ADD COLUMN updated_at REAL')
+                cursor.execute('UPDATE chat_watermarks SET updated_at = ?', (time.time(),))
+            # 创建聊天归属表，记录每个用户的每个聊天由哪个账号接收消息
+            cursor.execute('''
+                CREATE TABLE IF NOT EXISTS chat_owners (
+                    user_id INTEGER NOT NULL,
+                    chat_id INTEGER NOT NULL,
+                    account_id INTEGER NOT NULL,
+                    PRIMARY KEY (user_id, chat_id)
+                )
+            ''')
 
             # 如果没有设置默认的 interval，则插入一个默认值，例如 60 秒
             cursor.execute("INSERT OR IGNORE INTO config (key, value) VALUES (?, ?)", ("global_interval_seconds", "60"))
 
+            cursor.execute(f'PRAGMA user_version = {self.SCHEMA_VERSION}')
             conn.commit()
         logger.info("数据库初始化完成。") 
 
+    def _rebuild_push_stats(self, cursor):
+        logger.info("正在根据推送日志生成推送统计汇总数据。")
+        cursor.execute('DELETE FROM push_stats_totals')
+        cursor.execute('DELETE FROM push_stats_hourly')
+        cursor.execute('DELETE FROM push_stats_daily')
+        cursor.execute('''
+            INSERT INTO push_stats_totals (user_id, total)
+            SELECT user_id, SUM(count) FROM (
+                SELECT user_id, COUNT(*) AS count FROM push_logs GROUP BY user_id
+                UNION ALL
+                SELECT user_id, SUM(count) AS count FROM push_log_daily GROUP BY user_id
+            ) GROUP BY user_id
+        ''')
+        since = (datetime.now() - timedelta(days=PUSH_STATS_DAYS)).strftime('%Y-%m-%d')
+        cursor.execute('''
+            INSERT INTO push_stats_hourly (user_id, hour, count)
+            SELECT user_id, substr(timestamp, 1, 13), COUNT(*) FROM push_logs
+            WHERE timestamp >= ? GROUP BY user_id, substr(timestamp, 1, 13)
+        ''', (since,))
+        cursor.execute('''
+            INSERT INTO push_stats_daily (user_id, day, kind, item, label, count)
+            SELECT user_id, day, 'keyword', keyword, keyword, SUM(count) FROM (
+                SELECT user_id, substr(timestamp, 1, 10) AS day, keyword, COUNT(*) AS count FROM push_logs
+                WHERE timestamp >= ? GROUP BY user_id, substr(timestamp, 1, 10), keyword
+                UNION ALL
+                SELECT user_id, day, keyword, SUM(count) FROM push_log_daily
+                WHERE day >= ? GROUP BY user_id, day, keyword
+            ) GROUP BY user_id, day, keyword
+        ''', (since, since))
+        cursor.execute('''
+            INSERT INTO push_stats_daily (user_id, day, kind, item, label, count)
+            SELECT user_id, day, 'chat', CAST(chat_id AS TEXT), NULL, SUM(count) FROM (
+                SELECT user_id, substr(timestamp, 1, 10) AS day, chat_id, COUNT(*) AS count FROM push_logs
+                WHERE timestamp >= ? AND chat_id IS NOT NULL GROUP BY user_id, substr(timestamp, 1, 10), chat_id
+                UNION ALL
+                SELECT user_id, day, chat_id, SUM(count) FROM push_log_daily
+                WHERE day >= ? GROUP BY user_id, day, chat_id
+            ) GROUP BY user_id, day, chat_id
+        ''', (since, since))
+
     # 添加存储用户账号信息的方法
     def add_user_account(self, user_id, username, firstname, lastname, session_string, is_authenticated=0, two_factor_enabled=0):
         if not session_string:
@@ -212,16 +1845,52 @@ class DatabaseManager:
             ''', (user_id, username, firstname, lastname, session_string, is_authenticated, two_factor_enabled))
             account_id = cursor.lastrowid
             conn.commit()
+        self._accounts_cache.pop(user_id, None)
         return account_id
 
+    def add_user_accounts(self, user_id, accounts):
+        # accounts: [(username, firstname, lastname, session_string), ...]
+        # 在一个事务中批量写入，返回与输入对应的 account_id，会话已存在的账号为 None
+        # 只按 session_string 判断重复，没有用户名的账号可以有多个
+        account_ids = []
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            for username, firstname, lastname, session_string in accounts:
+                cursor.execute("SELECT 1 FROM user_accounts WHERE session_string = ?", (session_string,))
+                if cursor.fetchone():
+                    account_ids.append(None)
+                    continue
+                cursor.execute('''
+                    INSERT INTO user_accounts
+                    (user_id, username, firstname, lastname, session_string, is_authenticated)
+                    VALUES (?, ?, ?, ?, ?, 1)
+                ''', (user_id, username, firstname, lastname, session_string))
+                account_ids.append(cursor.lastrowid)
+            conn.commit()
+        self._accounts_cache.pop(user_id, None)
+        return account_ids
+
     def get_user_accounts(self, user_id):
+        # 优先使用缓存，账号列表翻页时不再查询数据库
+        cached = self._accounts_cache.get(user_id)
+        if cached is not None:
+            return cached
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
             cursor.execute('''
-                SELECT account_id, username, firstname, lastname, session_string, is_authenticated, two_factor_enabled
+                SELECT account_id, username, firstname, lastname, session_string, is_authenticated, two_factor_enabled,
+                       is_healthy, last_error
                 FROM user_accounts WHERE user_id = ?
             ''', (user_id,))
-            return cursor.fetchall()
+            accounts = cursor.fetchall()
+        self._accounts_cache[user_id] = accounts
+        return accounts
+
+    def _invalidate_account(self, account_id):
+        # 按账号ID修改账号时，清除包含该账号的用户的账号列表缓存
+        for user_id, accounts in list(self._accounts_cache.items()):
+            if any(account[0] == account_id for account in accounts):
+                del self._accounts_cache[user_id]
 
     def get_account_by_id(self, account_id):
         with sqlite3.connect(self.db_path) as conn:
@@ -246,6 +1915,16 @@ class DatabaseManager:
                 UPDATE user_accounts SET is_authenticated = ? WHERE account_id = ?
             ''', (is_authenticated, account_id))
             conn.commit()
+        self._invalidate_account(account_id)
+
+    def set_account_health(self, account_id, is_healthy, last_error=None):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                UPDATE user_accounts SET is_healthy = ?, last_error = ?, last_checked = ? WHERE account_id = ?
+            ''', (1 if is_healthy else 0, last_error, datetime.now(), account_id))
+            conn.commit()
+        self._invalidate_account(account_id)
 
     def set_session_string(self, account_id, session_string):
         with sqlite3.connect(self.db_path) as conn:
@@ -253,7 +1932,9 @@ class DatabaseManager:
             cursor.execute('''
                 UPDATE user_accounts SET session_string = ? WHERE account_id = ?
             ''', (session_string, account_id))
-            conn.commit()    
+            conn.commit()
+        self._invalidate_account(account_id)
+
     def remove_user_account(self, account_id):
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
@@ -261,7 +1942,17 @@ class DatabaseManager:
             cursor.execute('''
                 DELETE FROM user_accounts WHERE account_id = ?
             ''', (account_id,))
+            cursor.execute('''
+                DELETE FROM chat_watermarks WHERE account_id = ?
+            ''', (account_id,))
+            cursor.execute('''
+                DELETE FROM account_groups WHERE account_id = ?
+            ''', (account_id,))
+            cursor.execute('''
+                DELETE FROM chat_owners WHERE account_id = ?
+            ''', (account_id,))
             conn.commit()
+        self._invalidate_account(account_id)
 
     def get_all_authenticated_accounts(self):
         with sqlite3.connect(self.db_path) as conn:
@@ -272,6 +1963,357 @@ class DatabaseManager:
             ''')
             return cursor.fetchall()
 
+    # 将早于 cutoff 的原始推送日志汇总到 push_log_daily 并分批删除，返回压缩的条数
+    def compact_push_logs(self, cutoff, batch_size=RETENTION_BATCH_SIZE):
+        total = 0
+        while True:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute('BEGIN IMMEDIATE')
+                cursor.execute('''
+                    CREATE TEMP TABLE IF NOT EXISTS compact_batch (id INTEGER PRIMARY KEY)
+                ''')
+                cursor.execute('DELETE FROM compact_batch')
+                cursor.execute('''
+                    INSERT INTO compact_batch (id)
+                    SELECT id FROM push_logs WHERE timestamp < ? ORDER BY id LIMIT ?
+                ''', (cutoff, batch_size))
+                count = cursor.rowcount
+                if count <= 0:
+                    conn.commit()
+                    break
+                cursor.execute('''
+                    INSERT INTO push_log_daily (user_id, keyword, chat_id, day, count)
+                    SELECT user_id, keyword, IFNULL(chat_id, 0), substr(timestamp, 1, 10), COUNT(*)
+                    FROM push_logs WHERE id IN (SELECT id FROM compact_batch)
+                    GROUP BY user_id, keyword, IFNULL(chat_id, 0), substr(timestamp, 1, 10)
+                    ON CONFLICT(user_id, keyword, chat_id, day) DO UPDATE SET count = count + excluded.count
+                ''')
+                cursor.execute('DELETE FROM push_logs WHERE id IN (SELECT id FROM compact_batch)')
+                conn.commit()
+            total += count
+            if count < batch_size:
+                break
+            time.sleep(0.05)  # 让出写锁，避免长时间阻塞推送队列的写入
+        return total
+
+    def incremental_vacuum(self, pages=VACUUM_PAGES_PER_RUN):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('PRAGMA freelist_count')
+            free_pages = cursor.fetchone()[0]
+            cursor.execute(f'PRAGMA incremental_vacuum({int(pages)})')
+            cursor.fetchall()
+        return min(free_pages, pages)
+
+    # 推送队列相关的方法
+    def enqueue_deliveries(self, items):
+        # items: [(user_id, payload), ...]，一次事务批量入队
+        if not items:
+            return
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT INTO delivery_queue (user_id, payload) VALUES (?, ?)
+            ''', [(user_id, json.dumps(payload, ensure_ascii=False)) for user_id, payload in items])
+            conn.commit()
+
+    def claim_deliveries(self, limit, lease_seconds=DELIVERY_LEASE_SECONDS):
+        # 取出一批待发送的消息并加租约，返回 [(id, user_id, payload, attempts), ...]
+        # 按用户轮流取（每个用户先取最早的一条，再取第二条……），积压很多的用户不会占满整批
+        # 每次都通过 (user_id, id) 索引只取一个用户的下一条，不扫描整个队列
+        now = time.time()
+        rows = []
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('BEGIN IMMEDIATE')
+
+            def next_row(user_id, after_id):
+                cursor.execute('''
+                    SELECT id, user_id, payload, attempts FROM delivery_queue
+                    WHERE user_id = ? AND id > ? AND (leased_until IS NULL OR leased_until < ?)
+                    ORDER BY id LIMIT 1
+                ''', (user_id, after_id, now))
+                return cursor.fetchone()
+
+            # 第一轮：从上一批的最后一个用户之后开始，依次取每个用户最早的一条，到末尾后从头绕回
+            heads = {}  # key: user_id, value: 已取到的最后一条的队列ID
+            start = self._claim_cursor
+            user_id, wrapped = start, start is None
+            while len(rows) < limit:
+                if user_id is None:
+                    cursor.execute('SELECT MIN(user_id) FROM delivery_queue')
+                else:
+                    cursor.execute('SELECT MIN(user_id) FROM delivery_queue WHERE user_id > ?', (user_id,))
+                user_id = cursor.fetchone()[0]
+                if user_id is None:
+                    if wrapped:
+                        break
+                    wrapped = True
+                    continue
+                if wrapped and start is not None and user_id > start:
+                    break
+                row = next_row(user_id, 0)
+                if row:
+                    rows.append(row)
+                    heads[user_id] = row[0]
+            if rows:
+                self._claim_cursor = rows[-1][1]
+            # 之后每轮给第一轮取到的用户各取下一条，直到取满一批或都取完
+            while heads and len(rows) < limit:
+                for user_id in list(heads):
+                    row = next_row(user_id, heads[user_id])
+                    if row is None:
+                        del heads[user_id]
+                        continue
+                    rows.append(row)
+                    heads[user_id] = row[0]
+                    if len(rows) == limit:
+                        break
+            cursor.executemany('''
+                UPDATE delivery_queue SET leased_until = ?, attempts = attempts + 1 WHERE id = ?
+            ''', [(now + lease_seconds, row[0]) for row in rows])
+            conn.commit()
+        return [(row[0], row[1], json.loads(row[2]), row[3] + 1) for row in rows]
+
+    def ack_deliveries(self, queue_ids, pushes):
+        # 确认发送成功：删除队列记录、写入推送日志并更新统计汇总，在同一事务中完成
+        if not queue_ids:
+            return
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.executemany('DELETE FROM delivery_queue WHERE id = ?', [(i,) for i in queue_ids])
+            self._insert_pushes(cursor, pushes)
+            conn.commit()
+
+    def retry_deliveries(self, retries):
+        # retries: [(queue_id, retry_at), ...]，在 retry_at 之前不会被再次取出
+        if not retries:
+            return
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.executemany('UPDATE delivery_queue SET leased_until = ? WHERE id = ?', [(t, i) for i, t in retries])
+            conn.commit()
+
+    def drop_deliveries(self, queue_ids):
+        if not queue_ids:
+            return
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.executemany('DELETE FROM delivery_queue WHERE id = ?', [(i,) for i in queue_ids])
+            conn.commit()
+
+    def recover_deliveries(self):
+        # 启动时释放上次运行遗留的租约，返回待发送的消息数
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('UPDATE delivery_queue SET leased_until = NULL WHERE leased_until IS NOT NULL')
+            cursor.execute('SELECT COUNT(*) FROM delivery_queue')
+            pending = cursor.fetchone()[0]
+            conn.commit()
+        return pending
+
+    # 聊天水位线相关的方法
+    def get_chat_watermarks(self, account_id):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT chat_id, last_message_id, access_hash FROM chat_watermarks
+                WHERE account_id = ?
+            ''', (account_id,))
+            rows = cursor.fetchall()
+            return {row[0]: (row[1], row[2]) for row in rows}
+
+    def save_chat_watermarks(self, watermarks):
+        # watermarks: [(account_id, chat_id, last_message_id, access_hash), ...]，一次事务批量写入
+        # 水位线推进时记录时间，重新分配归属时据此判断账号是否仍在该聊天中
+        if not watermarks:
+            return
+        now = time.time()
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT INTO chat_watermarks (account_id, chat_id, last_message_id, access_hash, updated_at)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(account_id, chat_id) DO UPDATE SET
+                    last_message_id = MAX(last_message_id, excluded.last_message_id),
+                    access_hash = COALESCE(excluded.access_hash, access_hash),
+                    updated_at = CASE WHEN excluded.last_message_id > last_message_id
+                                      THEN excluded.updated_at ELSE updated_at END
+            ''', [row + (now,) for row in watermarks])
+            conn.commit()
+
+    def forget_account_chats(self, account_id, chat_ids):
+        # 账号退出或被移出聊天后，删除它在这些聊天中的群组记录、水位线和归属
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            self._delete_account_chats(cursor, account_id, chat_ids)
+            conn.commit()
+
+    @staticmethod
+    def _delete_account_chats(cursor, account_id, chat_ids):
+        rows = [(account_id, chat_id) for chat_id in chat_ids]
+        cursor.executemany('DELETE FROM account_groups WHERE account_id = ? AND group_id = ?', rows)
+        cursor.executemany('DELETE FROM chat_watermarks WHERE account_id = ? AND chat_id = ?', rows)
+        cursor.executemany('DELETE FROM chat_owners WHERE account_id = ? AND chat_id = ?', rows)
+
+    # 聊天归属相关的方法
+    def get_chat_owners(self):
+        # 返回 {(用户ID, 聊天ID): 账号ID}
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT user_id, chat_id, account_id FROM chat_owners')
+            return {(row[0], row[1]): row[2] for row in cursor.fetchall()}
+
+    def save_chat_owners(self, owners):
+        # owners: [(user_id, chat_id, account_id), ...]，一次事务批量写入
+        if not owners:
+            return
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT INTO chat_owners (user_id, chat_id, account_id) VALUES (?, ?, ?)
+                ON CONFLICT(user_id, chat_id) DO UPDATE SET account_id = excluded.account_id
+            ''', owners)
+            conn.commit()
+
+    def rebalance_chat_owners(self, user_id, active_since):
+        # 根据账号所在的群组（account_groups）和 active_since 之后水位线推进过的聊天（chat_watermarks）重新分配聊天归属
+        # 很久没有推进的水位线可能是账号已退出的聊天，不再作为成员，以免归属留在收不到消息的账号上
+        # 返回 {聊天ID: 账号ID}
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT account_id FROM user_accounts WHERE user_id = ?', (user_id,))
+            accounts = {row[0] for row in cursor.fetchall()}
+            cursor.execute('''
+                SELECT membership.chat_id, membership.account_id FROM (
+                    SELECT group_id AS chat_id, account_id FROM account_groups
+                    UNION
+                    SELECT chat_id, account_id FROM chat_watermarks WHERE updated_at >= ?
+                ) AS membership
+                JOIN user_accounts ON user_accounts.account_id = membership.account_id
+                WHERE user_accounts.user_id = ?
+            ''', (active_since, user_id))
+            members = {}
+            for chat_id, account_id in cursor.fetchall():
+                members.setdefault(chat_id, set()).add(account_id)
+            cursor.execute('SELECT chat_id, account_id FROM chat_owners WHERE user_id = ?', (user_id,))
+            assigned = assign_chat_owners(members, dict(cursor.fetchall()), accounts)
+            cursor.execute('DELETE FROM chat_owners WHERE user_id = ?', (user_id,))
+            cursor.executemany(
+                'INSERT INTO chat_owners (user_id, chat_id, account_id) VALUES (?, ?, ?)',
+                [(user_id, chat_id, account_id) for chat_id, account_id in assigned.items()]
+            )
+            conn.commit()
+        return assigned
+
+    # 消息缓存相关的方法
+    def get_user_chat_accounts(self, user_id):
+        # 返回 {群组ID: [账号ID, ...]}，即用户的哪些账号在哪些群组中
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT account_groups.group_id, account_groups.account_id FROM account_groups
+                JOIN user_accounts ON user_accounts.account_id = account_groups.account_id
+                WHERE user_accounts.user_id = ?
+            ''', (user_id,))
+            chat_accounts = {}
+            for group_id, account_id in cursor.fetchall():
+                chat_accounts.setdefault(group_id, []).append(account_id)
+            return chat_accounts
+
+    def get_cached_max_message_id(self, chat_id):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT MAX(message_id) FROM message_cache WHERE chat_id = ?', (chat_id,))
+            return cursor.fetchone()[0] or 0
+
+    def cache_messages(self, chat_id, rows, keep):
+        # rows 为 [(message_id, sender_id, text, date), ...]，写入后只保留该聊天最新的 keep 条
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT OR IGNORE INTO message_cache (chat_id, message_id, sender_id, text, date)
+                VALUES (?, ?, ?, ?, ?)
+            ''', [(chat_id, *row) for row in rows])
+            cursor.execute('''
+                DELETE FROM message_cache WHERE chat_id = ? AND message_id < (
+                    SELECT message_id FROM message_cache WHERE chat_id = ?
+                    ORDER BY message_id DESC LIMIT 1 OFFSET ?
+                )
+            ''', (chat_id, chat_id, keep - 1))
+            conn.commit()
+
+    def iter_cached_messages(self, chat_ids, limit, chunk_size=REPLAY_CHUNK_SIZE):
+        # 按时间顺序分批返回这些聊天中最近的 limit 条消息，每批为 [(sender_id, text, date), ...]
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT sender_id, text, date FROM (
+                    SELECT sender_id, text, date FROM message_cache
+                    WHERE chat_id IN (SELECT value FROM json_each(?))
+                    ORDER BY date DESC LIMIT ?
+                ) ORDER BY date
+            ''', (json.dumps(list(chat_ids)), limit))
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+
+    def iter_push_logs(self, user_id, chunk_size):
+        # 按推送顺序分批返回推送日志，user_id 为 None 时返回所有用户的日志
+        # 每批为 [(id, user_id, timestamp, keyword, chat_id, chat_title, message_id), ...]，按索引顺序读取，不需要排序
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(f'''
+                SELECT p.id, p.user_id, p.timestamp, p.keyword, p.chat_id, g.group_name, p.message_id
+                FROM push_logs p LEFT JOIN groups g ON g.group_id = p.chat_id
+                {'WHERE p.user_id = ?' if user_id is not None else ''}
+                ORDER BY p.id
+            ''', (user_id,) if user_id is not None else ())
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                yield rows
+
+    # 运行时配置相关的方法
+    def get_config_values(self, keys):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                f"SELECT key, value FROM config WHERE key IN ({','.join('?' * len(keys))})", keys
+            )
+            return dict(cursor.fetchall())
+
+    def set_config_value(self, key, value):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT INTO config (key, value) VALUES (?, ?)
+                ON CONFLICT(key) DO UPDATE SET value = excluded.value
+            ''', (key, value))
+            conn.commit()
+
+    def delete_config_value(self, key):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM config WHERE key = ?', (key,))
+            conn.commit()
+
+    def get_database_id(self):
+        # 数据库的随机ID，首次调用时生成，用于识别派生文件（如关键词匹配器快照）属于哪个数据库
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute(
+                "INSERT OR IGNORE INTO config (key, value) VALUES ('database_id', ?)", (os.urandom(16).hex(),)
+            )
+            cursor.execute("SELECT value FROM config WHERE key = 'database_id'")
+            database_id = cursor.fetchone()[0]
+            conn.commit()
+        return bytes.fromhex(database_id)
+
     # 群组相关的方法
     def add_group(self, user_id, group_id, group_name):
         with sqlite3.connect(self.db_path) as conn:
@@ -287,6 +2329,7 @@ class DatabaseManager:
                 VALUES (?, ?)
             ''', (user_id, group_id))
             conn.commit()
+        self._monitored_cache.pop(user_id, None)
 
     def remove_group(self, user_id, group_id):
         with sqlite3.connect(self.db_path) as conn:
@@ -295,6 +2338,80 @@ class DatabaseManager:
                 DELETE FROM user_monitored_groups WHERE user_id = ? AND group_id = ?
             ''', (user_id, group_id))
             conn.commit()
+        self._monitored_cache.pop(user_id, None)
+
+    # 在一个事务中批量写入同步到的群组，群组名称以最新同步的为准
+    def upsert_account_groups(self, account_id, groups, synced_at):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.executemany('''
+                INSERT INTO groups (group_id, group_name) VALUES (?, ?)
+                ON CONFLICT(group_id) DO UPDATE SET group_name = excluded.group_name
+            ''', groups)
+            cursor.executemany('''
+                INSERT INTO account_groups (account_id, group_id, synced_at) VALUES (?, ?, ?)
+                ON CONFLICT(account_id, group_id) DO UPDATE SET synced_at = excluded.synced_at
+            ''', [(account_id, group_id, synced_at) for group_id, _ in groups])
+            conn.commit()
+
+    # 同步完成后删除账号已退出的群组及其水位线和归属，返回删除的群组ID列表
+    def prune_account_groups(self, account_id, synced_at):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT group_id FROM account_groups WHERE account_id = ? AND synced_at < ?
+            ''', (account_id, synced_at))
+            removed = [row[0] for row in cursor.fetchall()]
+            self._delete_account_chats(cursor, account_id, removed)
+            conn.commit()
+            return removed
+
+    # 用户所有账号所在的群组，以及每个群组是否已被选为监听
+    def get_user_account_groups(self, user_id):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT groups.group_id, groups.group_name,
+                       EXISTS(SELECT 1 FROM user_monitored_groups m
+                              WHERE m.user_id = ? AND m.group_id = groups.group_id)
+                FROM groups
+                WHERE groups.group_id IN (
+                    SELECT account_groups.group_id FROM account_groups
+                    JOIN user_accounts ON user_accounts.account_id = account_groups.account_id
+                    WHERE user_accounts.user_id = ?
+                )
+                ORDER BY groups.group_name COLLATE NOCASE, groups.group_id
+            ''', (user_id, user_id))
+            return [(group_id, group_name, bool(monitored)) for group_id, group_name, monitored in cursor.fetchall()]
+
+    # 切换群组的监听状态，返回切换后是否处于监听中
+    def toggle_monitored_group(self, user_id, group_id):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                DELETE FROM user_monitored_groups WHERE user_id = ? AND group_id = ?
+            ''', (user_id, group_id))
+            monitored = cursor.rowcount == 0
+            if monitored:
+                cursor.execute('''
+                    INSERT INTO user_monitored_groups (user_id, group_id) VALUES (?, ?)
+                ''', (user_id, group_id))
+            conn.commit()
+        self._monitored_cache.pop(user_id, None)
+        return monitored
+
+    def get_monitored_group_ids(self, user_id):
+        cached = self._monitored_cache.get(user_id)
+        if cached is not None:
+            return cached
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT group_id FROM user_monitored_groups WHERE user_id = ?
+            ''', (user_id,))
+            group_ids = frozenset(row[0] for row in cursor.fetchall())
+        self._monitored_cache[user_id] = group_ids
+        return group_ids
 
     def get_user_monitored_groups(self, user_id):
         with sqlite3.connect(self.db_path) as conn:
@@ -325,6 +2442,12 @@ class DatabaseManager:
                 VALUES (?, ?, ?, ?)
             ''', (receiving_user_id, target_user_id, first_name, username))
             conn.commit()
+        self._blocked_list_cache.pop(receiving_user_id, None)
+        ids = self._blocked_ids.get(receiving_user_id)
+        if ids is not None:
+            position = bisect.bisect_left(ids, target_user_id)
+            if position == len(ids) or ids[position] != target_user_id:
+                ids.insert(position, target_user_id)
 
     def remove_blocked_user(self, receiving_user_id, target_user_id):
         with sqlite3.connect(self.db_path) as conn:
@@ -333,8 +2456,19 @@ class DatabaseManager:
                 DELETE FROM blocked_users WHERE receiving_user_id = ? AND user_id = ?
             ''', (receiving_user_id, target_user_id))
             conn.commit()
+        self._blocked_list_cache.pop(receiving_user_id, None)
+        ids = self._blocked_ids.get(receiving_user_id)
+        if ids is not None:
+            position = bisect.bisect_left(ids, target_user_id)
+            if position < len(ids) and ids[position] == target_user_id:
+                del ids[position]
 
     def list_blocked_users(self, receiving_user_id):
+        # 返回 {user_id: {'first_name', 'username'}}，用于列表显示；判断是否屏蔽请使用 is_blocked
+        # 优先使用缓存，屏蔽列表翻页时不再查询数据库
+        cached = self._blocked_list_cache.get(receiving_user_id)
+        if cached is not None:
+            return cached
         with sqlite3.connect(self.db_path) as conn:
             cursor = conn.cursor()
             cursor.execute('''
@@ -342,7 +2476,68 @@ class DatabaseManager:
                 WHERE receiving_user_id = ?
             ''', (receiving_user_id,))
             rows = cursor.fetchall()
-            return {row[0]: {'first_name': row[1], 'username': row[2]} for row in rows}
+        blocked = {row[0]: {'first_name': row[1], 'username': row[2]} for row in rows}
+        self._blocked_list_cache[receiving_user_id] = blocked
+        return blocked
+
+    def get_blocked_ids(self, receiving_user_id):
+        # 返回用户屏蔽的用户ID（升序的 array('q')），首次访问时从数据库加载
+        ids = self._blocked_ids.get(receiving_user_id)
+        if ids is None:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute(
+                    'SELECT user_id FROM blocked_users WHERE receiving_user_id = ? ORDER BY user_id',
+                    (receiving_user_id,)
+                )
+                ids = array('q', (row[0] for row in cursor))
+            self._blocked_ids[receiving_user_id] = ids
+        return ids
+
+    def is_blocked(self, receiving_user_id, target_user_id):
+        ids = self.get_blocked_ids(receiving_user_id)
+        position = bisect.bisect_left(ids, target_user_id)
+        return position < len(ids) and ids[position] == target_user_id
+
+    # 全局屏蔽，对所有用户生效
+    def load_global_blocked_users(self):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT user_id FROM global_blocked_users')
+            self._global_blocked = {row[0] for row in cursor}
+
+    def add_global_blocked_user(self, target_user_id, first_name, username, blocked_by):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                INSERT OR REPLACE INTO global_blocked_users (user_id, first_name, username, blocked_by)
+                VALUES (?, ?, ?, ?)
+            ''', (target_user_id, first_name, username, blocked_by))
+            conn.commit()
+        self._global_blocked.add(target_user_id)
+
+    def remove_global_blocked_user(self, target_user_id):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM global_blocked_users WHERE user_id = ?', (target_user_id,))
+            conn.commit()
+        self._global_blocked.discard(target_user_id)
+        return cursor.rowcount > 0
+
+    def list_global_blocked_users(self):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT user_id, first_name, username FROM global_blocked_users ORDER BY created_at
+            ''')
+            rows = cursor.fetchall()
+        return {row[0]: {'first_name': row[1], 'username': row[2]} for row in rows}
+
+    def is_globally_blocked(self, target_user_id):
+        return target_user_id in self._global_blocked
+
+    def get_global_blocked_ids(self):
+        return frozenset(self._global_blocked)
 
     # 添加获取所有已认证用户的方法
     # 获取所有已认证用户的ID
@@ -366,8 +2561,12 @@ class DatabaseManager:
         try:
             with sqlite3.connect(self.db_path) as conn:
                 cursor = conn.cursor()
-                cursor.execute("INSERT INTO keywords (user_id, keyword) VALUES (?, ?)", (user_id, keyword))
+                cursor.execute(
+                    "INSERT INTO keywords (user_id, keyword, max_errors) VALUES (?, ?, ?)",
+                    (user_id, *parse_keyword_spec(keyword))
+                )
                 conn.commit()
+            self._invalidate_keywords(user_id)
             logger.info(f"关键词 '{keyword}' 被用户 {user_id} 添加。")
             return True
         except sqlite3.IntegrityError:
@@ -377,38 +2576,119 @@ class DatabaseManager:
             logger.error(f"添加关键词失败: {e}", exc_info=True)
             return False
 
-    def remove_keyword(self, user_id, keyword):
+    def remove_keyword(self, user_id, keyword):
+        try:
+            with sqlite3.connect(self.db_path) as conn:
+                cursor = conn.cursor()
+                cursor.execute("DELETE FROM keywords WHERE user_id = ? AND keyword = ?", (user_id, parse_keyword_spec(keyword)[0]))
+                conn.commit()
+            self._invalidate_keywords(user_id)
+            if cursor.rowcount > 0:
+                logger.info(f"用户 {user_id} 删除了关键词 '{keyword}'。")
+                return True
+            else:
+                logger.info(f"用户 {user_id} 没有找到关键词 '{keyword}'。")
+                return False
+        except Exception as e:
+            logger.error(f"删除关键词失败: {e}", exc_info=True)
+            return False
+
+    def add_keywords(self, user_id, keywords):
+        # 在一个事务中批量添加关键词（可带 ~N 容错后缀），返回 (新添加的关键词, 已存在的关键词)
+        # 同一个关键词只能保存一种错误数，已存在时不修改
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT keyword FROM keywords WHERE user_id = ?", (user_id,))
+            existing = {row[0] for row in cursor.fetchall()}
+            added, duplicates, rows = [], [], []
+            for spec in dict.fromkeys(keywords):
+                keyword, max_errors = parse_keyword_spec(spec)
+                if keyword in existing:
+                    duplicates.append(spec)
+                else:
+                    existing.add(keyword)
+                    added.append(spec)
+                    rows.append((user_id, keyword, max_errors))
+            cursor.executemany(
+                "INSERT OR IGNORE INTO keywords (user_id, keyword, max_errors) VALUES (?, ?, ?)", rows
+            )
+            conn.commit()
+        if added:
+            self._invalidate_keywords(user_id)
+            logger.info(f"用户 {user_id} 批量添加了 {len(added)} 个关键词。")
+        return added, duplicates
+
+    def _invalidate_keywords(self, user_id):
+        # 变更次数由 keywords 表上的触发器累加，这里读取最新值
+        self._keyword_cache.pop(user_id, None)
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT version FROM keyword_changes WHERE user_id = ?", (user_id,))
+            row = cursor.fetchone()
+        self._keyword_versions[user_id] = row[0] if row else 0
+
+    def load_keyword_versions(self):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT user_id, version FROM keyword_changes')
+            self._keyword_versions = dict(cursor.fetchall())
+
+    def get_keyword_version(self, user_id):
+        return self._keyword_versions.get(user_id, 0)
+
+    def get_keyword_versions(self):
+        # 返回所有有关键词的用户的 {用户ID: 关键词变更次数}
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT user_id, version FROM keyword_changes
+                WHERE EXISTS (SELECT 1 FROM keywords WHERE keywords.user_id = keyword_changes.user_id)
+            ''')
+            return dict(cursor.fetchall())
+
+    def remove_keyword_by_id(self, user_id, keyword_id):
+        # 按关键词ID删除，返回被删除的关键词，不存在时返回 None
         try:
             with sqlite3.connect(self.db_path) as conn:
                 cursor = conn.cursor()
-                cursor.execute("DELETE FROM keywords WHERE user_id = ? AND keyword = ?", (user_id, keyword))
+                cursor.execute("SELECT keyword, max_errors FROM keywords WHERE id = ? AND user_id = ?", (keyword_id, user_id))
+                row = cursor.fetchone()
+                if not row:
+                    return None
+                cursor.execute("DELETE FROM keywords WHERE id = ? AND user_id = ?", (keyword_id, user_id))
                 conn.commit()
-            if cursor.rowcount > 0:
-                logger.info(f"用户 {user_id} 删除了关键词 '{keyword}'。")
-                return True
-            else:
-                logger.info(f"用户 {user_id} 没有找到关键词 '{keyword}'。")
-                return False
+            self._invalidate_keywords(user_id)
+            keyword = format_keyword(*row)
+            logger.info(f"用户 {user_id} 删除了关键词 '{keyword}'。")
+            return keyword
         except Exception as e:
             logger.error(f"删除关键词失败: {e}", exc_info=True)
-            return False
+            return None
 
-    def get_keywords(self, user_id):
+    def get_keyword_entries(self, user_id):
+        # 返回 [(keyword_id, keyword), ...]，容错关键词带 ~N 后缀，优先使用缓存
+        cached = self._keyword_cache.get(user_id)
+        if cached is not None:
+            return cached
         try:
             with sqlite3.connect(self.db_path) as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT keyword FROM keywords WHERE user_id = ?", (user_id,))
-                rows = cursor.fetchall()
-            return [row[0] for row in rows] if rows else []
+                cursor.execute("SELECT id, keyword, max_errors FROM keywords WHERE user_id = ? ORDER BY id", (user_id,))
+                entries = [(keyword_id, format_keyword(keyword, max_errors)) for keyword_id, keyword, max_errors in cursor.fetchall()]
+            self._keyword_cache[user_id] = entries
+            return entries
         except Exception as e:
             logger.error(f"获取关键词列表失败: {e}", exc_info=True)
             return []
 
+    def get_keywords(self, user_id):
+        return [keyword for _, keyword in self.get_keyword_entries(user_id)]
+
     def is_keyword_exists(self, user_id, keyword):
         try:
             with sqlite3.connect(self.db_path) as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT 1 FROM keywords WHERE user_id = ? AND keyword = ?", (user_id, keyword))
+                cursor.execute("SELECT 1 FROM keywords WHERE user_id = ? AND keyword = ?", (user_id, parse_keyword_spec(keyword)[0]))
                 return cursor.fetchone() is not None
         except Exception as e:
             logger.error(f"检查关键词是否存在失败: {e}", exc_info=True)
@@ -419,7 +2699,10 @@ class DatabaseManager:
         try:
             with sqlite3.connect(self.db_path) as conn:
                 cursor = conn.cursor()
-                cursor.execute("SELECT COUNT(*) FROM push_logs WHERE user_id = ?", (user_id,))
+                cursor.execute('''
+                    SELECT (SELECT COUNT(*) FROM push_logs WHERE user_id = ?)
+                         + (SELECT IFNULL(SUM(count), 0) FROM push_log_daily WHERE user_id = ?)
+                ''', (user_id, user_id))
                 total_pushes = cursor.fetchone()[0]
             return total_pushes
         except Exception as e:
@@ -431,10 +2714,15 @@ class DatabaseManager:
         try:
             with sqlite3.connect(self.db_path) as conn:
                 cursor = conn.cursor()
-                cursor.execute(
-                    "SELECT keyword, COUNT(*) FROM push_logs WHERE user_id = ? GROUP BY keyword ORDER BY COUNT(*) DESC LIMIT 10",
-                    (user_id,)
-                )
+                # 原始日志与每日汇总合并统计
+                cursor.execute('''
+                    SELECT keyword, SUM(count) AS total FROM (
+                        SELECT keyword, COUNT(*) AS count FROM push_logs WHERE user_id = ? GROUP BY keyword
+                        UNION ALL
+                        SELECT keyword, SUM(count) AS count FROM push_log_daily WHERE user_id = ? GROUP BY keyword
+                    )
+                    GROUP BY keyword ORDER BY total DESC LIMIT 10
+                ''', (user_id, user_id))
                 keyword_stats = cursor.fetchall()
             return keyword_stats
         except Exception as e:
@@ -446,14 +2734,110 @@ class DatabaseManager:
         try:
             with sqlite3.connect(self.db_path) as conn:
                 cursor = conn.cursor()
-                cursor.execute(
-                    "INSERT INTO push_logs (user_id, keyword, chat_id, message_id, timestamp) VALUES (?, ?, ?, ?, ?)",
-                    (user_id, keyword, chat_id, message_id, timestamp)
-                )
+                self._insert_pushes(cursor, [{
+                    'user_id': user_id, 'keyword': keyword, 'chat_id': chat_id,
+                    'message_id': message_id, 'timestamp': timestamp,
+                }])
                 conn.commit()
         except Exception as e:
             logger.error(f"记录推送日志失败: {e}", exc_info=True)
-        
+
+    def _insert_pushes(self, cursor, pushes):
+        # pushes: [{'user_id', 'keyword', 'chat_id', 'message_id', 'timestamp', 'chat_title', 'sender_id', 'sender_name'}]
+        cursor.executemany(
+            "INSERT INTO push_logs (user_id, keyword, chat_id, message_id, timestamp) VALUES (?, ?, ?, ?, ?)",
+            [(p['user_id'], p['keyword'], p['chat_id'], p['message_id'], p['timestamp']) for p in pushes]
+        )
+        # 先在内存中合并同一批次的计数，再批量更新汇总表
+        totals, hourly, daily, labels = Counter(), Counter(), Counter(), {}
+        for p in pushes:
+            user_id, timestamp = p['user_id'], p['timestamp']
+            day = timestamp.strftime('%Y-%m-%d')
+            totals[user_id] += 1
+            hourly[(user_id, timestamp.strftime('%Y-%m-%d %H'))] += 1
+            daily[(user_id, day, 'keyword', p['keyword'])] += 1
+            labels[(user_id, day, 'keyword', p['keyword'])] = p['keyword']
+            if p.get('chat_id') is not None:
+                key = (user_id, day, 'chat', str(p['chat_id']))
+                daily[key] += 1
+                labels[key] = p.get('chat_title')
+            if p.get('sender_id') is not None:
+                key = (user_id, day, 'sender', str(p['sender_id']))
+                daily[key] += 1
+                labels[key] = p.get('sender_name')
+        cursor.executemany('''
+            INSERT INTO push_stats_totals (user_id, total) VALUES (?, ?)
+            ON CONFLICT(user_id) DO UPDATE SET total = total + excluded.total
+        ''', list(totals.items()))
+        cursor.executemany('''
+            INSERT INTO push_stats_hourly (user_id, hour, count) VALUES (?, ?, ?)
+            ON CONFLICT(user_id, hour) DO UPDATE SET count = count + excluded.count
+        ''', [key + (count,) for key, count in hourly.items()])
+        cursor.executemany('''
+            INSERT INTO push_stats_daily (user_id, day, kind, item, label, count) VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT(user_id, day, kind, item) DO UPDATE SET
+                count = count + excluded.count,
+                label = COALESCE(excluded.label, label)
+        ''', [key + (labels[key], count) for key, count in daily.items()])
+
+    # 推送统计汇总查询，只读取汇总表，开销与推送总量无关
+    def get_push_stats_total(self, user_id):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('SELECT total FROM push_stats_totals WHERE user_id = ?', (user_id,))
+            row = cursor.fetchone()
+            return row[0] if row else 0
+
+    def get_hourly_pushes(self, user_id, since_hour):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT hour, count FROM push_stats_hourly WHERE user_id = ? AND hour >= ?
+            ''', (user_id, since_hour))
+            return dict(cursor.fetchall())
+
+    def get_daily_pushes(self, user_id, since_day):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT day, SUM(count) FROM push_stats_daily
+                WHERE user_id = ? AND day >= ? AND kind = 'keyword'
+                GROUP BY day
+            ''', (user_id, since_day))
+            return dict(cursor.fetchall())
+
+    def get_top_items(self, user_id, kind, since_day, limit=5):
+        # 返回 [(item, label, count), ...]，按时间窗口内的推送次数降序
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('''
+                SELECT item, MAX(label), SUM(count) AS total FROM push_stats_daily
+                WHERE user_id = ? AND kind = ? AND day >= ?
+                GROUP BY item ORDER BY total DESC LIMIT ?
+            ''', (user_id, kind, since_day, limit))
+            return cursor.fetchall()
+
+    def get_item_counts(self, user_id, kind, items, since_day, until_day):
+        # 返回指定条目在 [since_day, until_day) 内的推送次数，用于计算趋势
+        if not items:
+            return {}
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            placeholders = ','.join('?' * len(items))
+            cursor.execute(f'''
+                SELECT item, SUM(count) FROM push_stats_daily
+                WHERE user_id = ? AND kind = ? AND day >= ? AND day < ? AND item IN ({placeholders})
+                GROUP BY item
+            ''', (user_id, kind, since_day, until_day, *items))
+            return dict(cursor.fetchall())
+
+    def prune_push_stats(self, hour_cutoff, day_cutoff):
+        with sqlite3.connect(self.db_path) as conn:
+            cursor = conn.cursor()
+            cursor.execute('DELETE FROM push_stats_hourly WHERE hour < ?', (hour_cutoff,))
+            cursor.execute('DELETE FROM push_stats_daily WHERE day < ?', (day_cutoff,))
+            conn.commit()
+
 
 # 主机器人类
 class TelegramBot:
@@ -464,9 +2848,75 @@ class TelegramBot:
         self.api_id = int(api_id)
         self.api_hash = api_hash
         self.db_manager = DatabaseManager(db_path)
+        self.config = RuntimeConfig(self.db_manager)
+        boot_timer.phase("初始化数据库")
         self.parseMode = 'Markdown'
-        self.application = Application.builder().token(self.token).build()
+        self.rate_limiter = FairRateLimiter()
+        self.config.subscribe('rate_limit.global_rate', lambda value: setattr(self.rate_limiter, 'rate', value))
+        self.config.subscribe('rate_limit.quantum', lambda value: setattr(self.rate_limiter, 'quantum', value))
+        self.config.subscribe('rate_limit.max_retries', lambda value: setattr(self.rate_limiter, 'max_retries', value))
+        bot = ExtBot(
+            token=self.token,
+            base_url=TELEGRAM_API_BASE_URL,
+            base_file_url=re.sub(r'/bot$', '/file/bot', TELEGRAM_API_BASE_URL),
+            request=HTTPXRequest(
+                connection_pool_size=SEND_POOL_SIZE,
+                connect_timeout=HTTP_CONNECT_TIMEOUT,
+                read_timeout=SEND_TIMEOUT,
+                write_timeout=SEND_TIMEOUT,
+                pool_timeout=SEND_POOL_TIMEOUT,
+            ),
+            get_updates_request=HTTPXRequest(
+                connection_pool_size=1,
+                connect_timeout=HTTP_CONNECT_TIMEOUT,
+                read_timeout=POLL_READ_TIMEOUT,
+                pool_timeout=HTTP_CONNECT_TIMEOUT,
+            ),
+            rate_limiter=self.rate_limiter,
+        )
+        self.application = (
+            Application.builder()
+            .updater(FallbackUpdater(bot, asyncio.Queue()))
+            .post_init(self.post_init)
+            .post_shutdown(self.post_shutdown)
+            .build()
+        )
         self.user_clients = {}  # key: account_id, value: TelegramClient
+        self.account_owners = {}  # key: account_id, value: 账号所属用户ID
+        self.background_tasks = []  # 后台任务，在 post_shutdown 中统一取消
+        # 断线补偿相关状态
+        self.chat_watermarks = {}  # key: account_id, value: {chat_id: [last_message_id, access_hash]}
+        self.dirty_watermarks = set()  # 待写回数据库的 (account_id, chat_id)
+        self.recent_messages = OrderedDict()  # 最近处理过的 (account_id, chat_id, message_id)，用于补拉去重
+        self.chat_owners = self.db_manager.get_chat_owners()  # key: (用户ID, 聊天ID), value: 负责接收该聊天的账号ID
+        self.dirty_chat_owners = set()  # 待写回数据库的 (用户ID, 聊天ID)
+        self.chat_activity = {}  # key: (账号ID, 聊天ID), value: 该账号最近一次处理完该聊天消息的时间
+        self.chat_sightings = {}  # key: (用户ID, 聊天ID), value: 非归属账号收到该聊天消息、而归属账号尚未处理的起始时间
+        self.live_inflight = 0  # 正在处理的实时消息数量，补拉会让路给实时消息
+        self.backfill_lock = asyncio.Lock()  # 同一时间只补拉一个账号，避免抢占实时流量
+        # 账号健康状态，key: account_id, value: {'healthy', 'connected_since', 'failures', 'next_retry', 'revoked'}
+        self.account_health = {}
+        self.keyword_matchers = {}  # key: 用户ID, value: (关键词版本, KeywordMatcher)
+        self.matcher_snapshot = MatcherSnapshot(
+            KEYWORD_SNAPSHOT_PATH or f"{db_path}.matchers", self.db_manager.get_database_id()
+        )
+        self.matcher_snapshot.open()
+        self.group_sync_tasks = {}  # key: 用户ID, value: 正在进行的群组同步任务
+        self.replay_tasks = {}  # key: 用户ID, value: 正在进行的关键词回放任务
+        self.replay_fetched = {}  # key: 聊天ID, value: 上次拉取历史消息的时间
+        self.webhook_enabled = False  # 是否以 webhook 模式启动
+        self.export_tasks = {}  # key: 用户ID, value: 正在进行的推送记录导出任务
+        self.idle_accounts = {}  # key: account_id, value: 低内存模式下暂不连接的账号信息
+        self.rss_baseline = None  # 连接账号之前的常驻内存
+        self.spam_filter = None
+        for key in ('spam.window', 'spam.max_per_sender', 'spam.simhash_distance'):
+            self.config.subscribe(key, lambda value: self._rebuild_spam_filter())
+        self.config.subscribe('log.max_bytes', lambda value: setattr(file_handler, 'maxBytes', value))
+        # 持久化推送队列相关状态
+        self.enqueue_buffer = []  # 待批量写入队列的 (user_id, payload)
+        self.enqueue_flush_handle = None
+        self.enqueue_lock = asyncio.Lock()
+        self.delivery_wakeup = asyncio.Event()
         self.setup_handlers()
         
         # 设置底部命令菜单
@@ -474,30 +2924,44 @@ class TelegramBot:
             BotCommand("start", "启动机器人"),
             BotCommand("help", "帮助信息"),
             BotCommand("login", "登录账号"),
+            BotCommand("import_accounts", "批量导入账号"),
             BotCommand("list_accounts", "账号列表"),
             BotCommand("remove_account", "删除账号"),
             BotCommand("add_keyword", "添加关键词"),
             BotCommand("remove_keyword", "删除关键词"),
             BotCommand("list_keywords", "关键词列表"),
+            BotCommand("import_keywords", "导入关键词"),
+            BotCommand("export_keywords", "导出关键词"),
+            BotCommand("export_pushes", "导出推送记录"),
+            BotCommand("replay_keywords", "回放测试关键词"),
+            BotCommand("sync_groups", "同步群组"),
+            BotCommand("select_groups", "选择监听群组"),
             BotCommand("block", "屏蔽用户"),
             BotCommand("unblock", "解除屏蔽"),
             BotCommand("list_blocked_users", "屏蔽列表"),
             BotCommand("my_stats", "数据统计")
         ]
-        
-        # 在 setup_handlers 后设置命令菜单
-        asyncio.get_event_loop().run_until_complete(
-            self.application.bot.set_my_commands(self.commands)
-        )
+        # 命令菜单在 post_init 中设置，菜单没有变化时跳过
+        self.first_update_seen = False
+        boot_timer.phase("创建机器人")
 
     def setup_handlers(self):
+        # 记录启动后收到的第一个更新
+        self.application.add_handler(TypeHandler(Update, self._log_first_update), group=-1)
         # 添加命令处理器
         self.application.add_handler(CommandHandler("start", self.start))
         self.application.add_handler(CommandHandler("help", self.help_command))
         self.application.add_handler(CommandHandler("login", self.login))
+        self.application.add_handler(CommandHandler("import_accounts", self.import_accounts))
         self.application.add_handler(CommandHandler("add_keyword", self.add_keyword))
         self.application.add_handler(CommandHandler("remove_keyword", self.remove_keyword))
         self.application.add_handler(CommandHandler("list_keywords", self.list_keywords))
+        self.application.add_handler(CommandHandler("import_keywords", self.import_keywords))
+        self.application.add_handler(CommandHandler("export_keywords", self.export_keywords))
+        self.application.add_handler(CommandHandler("export_pushes", self.export_pushes))
+        self.application.add_handler(CommandHandler("replay_keywords", self.replay_keywords))
+        self.application.add_handler(CommandHandler("sync_groups", self.sync_groups))
+        self.application.add_handler(CommandHandler("select_groups", self.select_groups))
         self.application.add_handler(CommandHandler("list_accounts", self.list_accounts))
         self.application.add_handler(CommandHandler("remove_account", self.remove_account))
         self.application.add_handler(CommandHandler("block", self.block_user))
@@ -505,11 +2969,30 @@ class TelegramBot:
         self.application.add_handler(CommandHandler("list_blocked_users", self.list_blocked_users))
         self.application.add_handler(CommandHandler("my_account", self.my_account))
         self.application.add_handler(CommandHandler("my_stats", self.my_stats))
-        self.application.add_handler(CallbackQueryHandler(self.handle_callback_query))
+        # 管理员命令
+        self.application.add_handler(CommandHandler("send_announcement", self.send_announcement))
+        self.application.add_handler(CommandHandler("config", self.show_config))
+        self.application.add_handler(CommandHandler("set_config", self.set_config))
+        self.application.add_handler(CommandHandler("profile", self.profile))
+        self.application.add_handler(CommandHandler("memory_report", self.memory_report))
+        self.application.add_handler(CommandHandler("gblock", self.global_block))
+        self.application.add_handler(CommandHandler("gunblock", self.global_unblock))
+        self.setup_callback_handlers()
         self.application.add_handler(MessageHandler(filters.Document.FileExtension("session") & ~filters.COMMAND, self.handle_login_step))
+        self.application.add_handler(MessageHandler(
+            (filters.Document.FileExtension("zip") | filters.Document.FileExtension("tar")
+             | filters.Document.FileExtension("gz") | filters.Document.FileExtension("tgz")
+             | filters.Document.FileExtension("txt") | filters.Document.FileExtension("csv")) & ~filters.COMMAND,
+            self.handle_login_step
+        ))
+        # 为所有命令和回调处理器加上计时包装，性能分析关闭时几乎没有开销
+        for handlers in self.application.handlers.values():
+            for handler in handlers:
+                handler.callback = profiled(handler.callback)
         logger.debug("已设置所有命令处理器。")
         
     def restricted(func):
+        @functools.wraps(func)
         async def wrapped(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
             user = update.effective_user
             if not user:
@@ -522,7 +3005,7 @@ class TelegramBot:
             logger.debug(f"用户 {user_id} 请求执行命令: {message_text}.")
 
             # 指定群组的 chat_id（确保这是一个有效的群组 ID）
-            chat_id = -1002271927749  # 替换为你的实际群组 ID
+            chat_id = self.config['access.group_id']
 
             try:
                 # 获取群组信息
@@ -532,7 +3015,7 @@ class TelegramBot:
 
                 if member.status in ['left', 'kicked', 'restricted']:
                     keyboard = InlineKeyboardMarkup([[
-                        InlineKeyboardButton("📢 加入群组", url='https://t.me/demon_discuss')
+                        InlineKeyboardButton("📢 加入群组", url=self.config['access.group_link'])
                     ]])
                     await update.message.reply_text(
                         "❌ 请先加入我们的群组后再申请使用机器人。",
@@ -557,6 +3040,18 @@ class TelegramBot:
 
         return wrapped
 
+    def admin_only(func):
+        @functools.wraps(func)
+        async def wrapped(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+            user_id = update.effective_user.id
+            if user_id not in self.admin_ids:
+                await update.message.reply_text("❌ 你没有权限执行此命令。")
+                logger.warning(f"用户 {user_id} 尝试执行管理员命令但没有权限。")
+                return
+            return await func(self, update, context)
+
+        return wrapped
+
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
         user_id = user.id
@@ -577,11 +3072,17 @@ class TelegramBot:
             f"📖 *功能说明*\n\n"
             f"*账号管理*\n"
             f"• 登录账号 - 添加新的监控账号\n"
+            f"• 批量导入 - 一次导入多个会话文件\n"
             f"• 账号列表 - 查看已登录的账号\n\n"
             f"*关键词管理*\n"
             f"• 添加关键词 - 设置需要监控的关键词\n"
             f"• 删除关键词 - 移除不需要的关键词\n"
-            f"• 关键词列表 - 查看所有关键词\n\n"
+            f"• 关键词列表 - 查看所有关键词\n"
+            f"• 导入/导出 - 通过文件批量管理关键词\n"
+            f"• 容错匹配 - 关键词后加 ~1 可容忍 1 个错别字或插入的符号，如 招聘会~1\n\n"
+            f"*群组管理*\n"
+            f"• 同步群组 - 从账号的对话列表中读取群组\n"
+            f"• 选择群组 - 只监听选中的群组，未选择时监听全部\n\n"
             f"*用户管理*\n"
             f"• 屏蔽用户 - 不再接收某用户的消息\n"
             f"• 解除屏蔽 - 恢复接收某用户的消息\n"
@@ -619,6 +3120,132 @@ class TelegramBot:
         if stage == 'awaiting_session':
             # 处理会话文件上传
             await self._handle_session_file(update, context)
+        elif stage == 'awaiting_keywords':
+            # 处理关键词文件导入
+            await self._handle_keyword_import(update, context)
+        elif stage == 'awaiting_bulk_import':
+            # 处理批量导入的压缩包或 session string 列表
+            await self._handle_bulk_import(update, context)
+
+    @restricted
+    async def import_accounts(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        await update.message.reply_text(
+            "📦 请上传包含多个 .session 文件的压缩包（.zip / .tar / .tar.gz），"
+            "或每行一个 StringSession 的 .txt 文件。",
+            parse_mode=None
+        )
+        logger.info(f"用户 {user_id} 启动了批量导入流程。")
+        context.user_data['login_stage'] = 'awaiting_bulk_import'
+
+    async def _handle_bulk_import(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        document = update.message.document
+        progress = await update.message.reply_text("⏳ 正在导入账号，请稍候……", parse_mode=None)
+        results = []
+        try:
+            file = await document.get_file()
+            data = bytes(await file.download_as_bytearray())
+            try:
+                entries = await asyncio.to_thread(extract_session_entries, document.file_name, data)
+            except (UnicodeDecodeError, ValueError) as e:
+                await progress.edit_text(f"❌ 无法读取上传的文件：{e}")
+                logger.warning(f"用户 {user_id} 上传的批量导入文件无法读取: {e}")
+                return
+            if not entries:
+                await progress.edit_text("❌ 文件中没有找到会话。")
+                return
+
+            # 并发验证，限制同时连接的数量
+            semaphore = asyncio.Semaphore(self.config['import.concurrency'])
+
+            async def validate(name, kind, value):
+                async with semaphore:
+                    return await self._validate_session_entry(name, kind, value)
+
+            results = await asyncio.gather(*(validate(*entry) for entry in entries))
+            valid = [r for r in results if r['client']]
+            invalid = [r for r in results if not r['client']]
+
+            # 去掉同一批次中重复的会话，然后在一个事务中写入数据库
+            seen, unique = set(), []
+            for r in valid:
+                if r['session_string'] in seen:
+                    r['error'] = '批次内重复'
+                    invalid.append(r)
+                    continue
+                seen.add(r['session_string'])
+                unique.append(r)
+            account_ids = await asyncio.to_thread(
+                self.db_manager.add_user_accounts,
+                user_id,
+                [(r['username'], r['firstname'], r['lastname'], r['session_string']) for r in unique]
+            )
+
+            imported, duplicates = [], []
+            for r, account_id in zip(unique, account_ids):
+                if account_id is None:
+                    duplicates.append(r)
+                else:
+                    self.attach_client(account_id, user_id, r['client'])
+                    r['attached'] = True
+                    imported.append((account_id, r))
+            if imported:
+                await self.rebalance_chat_owners(user_id)
+
+            summary = (
+                f"📦 批量导入完成\n\n"
+                f"• 发现会话：{len(entries)}\n"
+                f"• 导入成功：{len(imported)}\n"
+                f"• 已存在：{len(duplicates)}\n"
+                f"• 无效：{len(invalid)}\n"
+            )
+            if imported:
+                summary += "\n✅ 新账号：\n" + '\n'.join(
+                    f"  {account_id} - @{r['username'] or '无'} {r['firstname']} {r['lastname']}".rstrip()
+                    for account_id, r in imported[:20]
+                ) + ('\n  ……' if len(imported) > 20 else '')
+            if invalid:
+                summary += "\n❌ 无效会话：\n" + '\n'.join(
+                    f"  {r['name']}：{r['error']}" for r in invalid[:20]
+                ) + ('\n  ……' if len(invalid) > 20 else '')
+            await progress.edit_text(summary)
+            logger.info(f"用户 {user_id} 批量导入账号：成功 {len(imported)}，已存在 {len(duplicates)}，无效 {len(invalid)}。")
+        except Exception as e:
+            await progress.edit_text(f"❌ 批量导入时出错：{e}")
+            logger.error(f"用户 {user_id} 批量导入账号时出错：{e}", exc_info=True)
+        finally:
+            # 没有交给监听的客户端（批次内重复、已存在或写入数据库失败）统一断开，避免连接泄漏
+            await asyncio.gather(
+                *(r['client'].disconnect() for r in results if r['client'] and not r.get('attached')),
+                return_exceptions=True
+            )
+            context.user_data.clear()
+
+    async def _validate_session_entry(self, name, kind, value):
+        result = {'name': name, 'client': None, 'error': None}
+        client = None
+        try:
+            session_string = await convert_session_bytes(value) if kind == 'file' else value
+            client = self.create_client(session_string)
+            await asyncio.wait_for(client.connect(), self.config['supervisor.probe_timeout'])
+            if not await client.is_user_authorized():
+                result['error'] = '未授权'
+                await client.disconnect()
+                return result
+            me = await client.get_me()
+            result.update(
+                client=client,
+                session_string=session_string,
+                username=me.username or '',
+                firstname=me.first_name or '',
+                lastname=me.last_name or '',
+            )
+        except Exception as e:
+            result['error'] = str(e) or type(e).__name__
+            if client:
+                await client.disconnect()
+        return result
         
     async def _handle_session_file(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
@@ -643,7 +3270,6 @@ class TelegramBot:
             logger.warning(f"用户 {user_id} 上传了非 .session 文件：{document.file_name}")
             return
 
-        temp_session_file = None
         try:
             # 获取 File 对象
             file = await document.get_file()
@@ -651,37 +3277,19 @@ class TelegramBot:
             # 下载会话文件内容
             session_bytes = await file.download_as_bytearray()
 
-            # 创建临时会话文件用于验证
-            temp_session_filename = f'temp_session_{uuid.uuid4().hex}.session'
-            temp_session_file = os.path.join(os.getcwd(), temp_session_filename)
-
-            # 保存临时会话文件
-            with open(temp_session_file, 'wb') as f:
-                f.write(session_bytes)            
-            # 设置文件权限（仅所有者可读写）
-            os.chmod(temp_session_file, stat.S_IRUSR | stat.S_IWUSR)            # 使用临时会话文件创建客户端，只为获取 session string，无需连接
-            tmp_client = TelegramClient(temp_session_file, self.api_id, self.api_hash)
-
-            # 获取 session string
-            session_string = StringSession.save(tmp_client.session)
-            print(session_string)
-            # 关闭临时客户端连接以释放文件句柄
-            if hasattr(tmp_client, '_connection') and tmp_client._connection:
-                await tmp_client.disconnect()
-            
-            # 安全地清理临时文件
-            if temp_session_file and os.path.exists(temp_session_file):
-                try:
-                    os.remove(temp_session_file)
-                    temp_session_file = None  # 避免在 finally 中重复删除
-                    logger.debug(f"已清理临时会话文件")
-                except PermissionError:
-                    # 在 Windows 上可能因为文件被占用而无法立即删除
-                    logger.warning(f"无法立即删除临时会话文件，将在 finally 中重试")
-                    pass
+            # 直接在内存中把 SQLite 会话转换为 session string，不落盘
+            try:
+                session_string = await convert_session_bytes(session_bytes)
+            except (sqlite3.DatabaseError, ValueError) as e:
+                await update.message.reply_text(
+                    "❌ 会话文件无效或已损坏。请确认您上传的是 Telethon 生成的 .session 文件。",
+                    parse_mode=None
+                )
+                logger.warning(f"用户 {user_id} 上传的会话文件无法解析: {e}")
+                return
 
             # 使用 session string 创建新的客户端并连接
-            client = TelegramClient(StringSession(session_string), self.api_id, self.api_hash)
+            client = self.create_client(session_string)
             await client.connect()
             
             # 如果未授权，则提示错误
@@ -701,7 +3309,8 @@ class TelegramBot:
             lastname = user.last_name or ''
 
             # 添加用户账号到数据库，使用 session string
-            account_id = self.db_manager.add_user_account(
+            account_id = await asyncio.to_thread(
+                self.db_manager.add_user_account,
                 user_id=user_id,
                 username=username,
                 firstname=firstname,
@@ -710,11 +3319,9 @@ class TelegramBot:
                 is_authenticated=1
             )
 
-            # 将客户端添加到用户客户端字典
-            self.user_clients[account_id] = client
-
-            # 注册消息事件处理器
-            client.add_event_handler(lambda event, uid=user_id: self.handle_new_message(event, uid), events.NewMessage)
+            # 将客户端添加到用户客户端字典并注册消息事件处理器
+            self.attach_client(account_id, user_id, client)
+            await self.rebalance_chat_owners(user_id)
 
             await update.message.reply_text(
                 "🎉 登录成功！您的会话已保存，您现在可以使用机器人。",
@@ -732,30 +3339,723 @@ class TelegramBot:
             logger.error(f"用户 {user_id} 处理会话文件时出错：{e}", exc_info=True)
         
         finally:
-            # 清理临时文件（如果还存在的话）
-            if temp_session_file and os.path.exists(temp_session_file):
-                max_retries = 3
-                for attempt in range(max_retries):
-                    try:
-                        os.remove(temp_session_file)
-                        logger.debug(f"已清理临时会话文件: {temp_session_file}")
-                        break
-                    except PermissionError as e:
-                        if attempt < max_retries - 1:
-                            logger.warning(f"删除临时文件失败 (尝试 {attempt + 1}/{max_retries})，稍后重试: {e}")
-                            # 等待一小段时间后重试
-                            time.sleep(0.1)
-                        else:
-                            logger.error(f"删除临时文件失败，已达到最大重试次数: {e}")
-                    except Exception as e:
-                        logger.error(f"删除临时文件时发生未知错误: {e}")
-                        break
             # 清理用户数据
             context.user_data.clear()
             
-    async def handle_new_message(self, event: Message, uid: int):
+    def attach_client(self, account_id, user_id, client):
+        # 记录客户端并加载该账号的聊天水位线，然后注册消息事件处理器
+        self.user_clients[account_id] = client
+        self.account_owners[account_id] = user_id
+        self.account_health[account_id] = {
+            'healthy': True,
+            'connected_since': time.monotonic() if client.is_connected() else None,
+            'failures': 0,
+            'next_retry': 0.0,
+            'revoked': False,
+            'persisted': False,  # 数据库中的健康状态可能是上次运行留下的，首次探测成功后写回
+        }
+        self.chat_watermarks[account_id] = {
+            chat_id: [last_message_id, access_hash]
+            for chat_id, (last_message_id, access_hash) in self.db_manager.get_chat_watermarks(account_id).items()
+        }
+        # 先登记其他账号负责的聊天中收到的消息，用于判断归属账号是否停滞；Telethon 按注册顺序依次调用处理器
+        client.add_event_handler(
+            lambda event, uid=user_id, aid=account_id: self.note_chat_message(event, uid, aid),
+            events.NewMessage()
+        )
+        # 归属于该用户其他账号的聊天在 Telethon 分发事件时就被过滤，不会进入处理流程；过滤器只读，认领在处理器中进行
+        client.add_event_handler(
+            lambda event, uid=user_id, aid=account_id: self.handle_new_message(event, uid, aid),
+            events.NewMessage(func=lambda event, uid=user_id, aid=account_id: self._may_own_chat(uid, aid, event.chat_id))
+        )
+        client.add_event_handler(
+            lambda event, aid=account_id: self.handle_chat_left(event, aid),
+            events.ChatAction(func=lambda event: event.user_left or event.user_kicked)
+        )
+
+    def detach_client(self, account_id):
+        client = self.user_clients.pop(account_id, None)
+        self.account_owners.pop(account_id, None)
+        self.account_health.pop(account_id, None)
+        self.chat_watermarks.pop(account_id, None)
+        self.dirty_watermarks = {key for key in self.dirty_watermarks if key[0] != account_id}
+        self.chat_activity = {key: value for key, value in self.chat_activity.items() if key[0] != account_id}
+        return client
+
+    async def handle_chat_left(self, event, account_id):
+        # 账号自己退出或被移出聊天时，删除它在该聊天的水位线和归属，之后由该用户的其他账号认领
+        me = await event.client.get_me(input_only=True)
+        if me.user_id not in event.user_ids:
+            return
+        logger.info(f"账号 {account_id} 已不在聊天 {event.chat_id} 中，移除其水位线和聊天归属。")
+        await self.forget_account_chats(account_id, [event.chat_id])
+
+    def _forget_chats_in_memory(self, account_id, chat_ids):
+        uid = self.account_owners.get(account_id)
+        watermarks = self.chat_watermarks.get(account_id, {})
+        for chat_id in chat_ids:
+            watermarks.pop(chat_id, None)
+            self.dirty_watermarks.discard((account_id, chat_id))
+            self.chat_activity.pop((account_id, chat_id), None)
+            if uid is not None and self.chat_owners.get((uid, chat_id)) == account_id:
+                del self.chat_owners[(uid, chat_id)]
+                self.dirty_chat_owners.discard((uid, chat_id))
+                self.chat_sightings.pop((uid, chat_id), None)
+
+    async def forget_account_chats(self, account_id, chat_ids):
+        self._forget_chats_in_memory(account_id, chat_ids)
+        try:
+            await asyncio.to_thread(self.db_manager.forget_account_chats, account_id, chat_ids)
+        except Exception as e:
+            logger.error(f"删除账号 {account_id} 的聊天记录失败: {e}", exc_info=True)
+
+    async def post_init(self, application: Application):
+        # 应用初始化完成后启动后台任务；账号在后台并发连接，不阻塞机器人开始处理更新
+        boot_timer.phase("初始化机器人")
+        self.background_tasks.append(asyncio.create_task(self.watermark_flush_loop()))
+        self.background_tasks.append(asyncio.create_task(self.supervisor_loop()))
+        self.background_tasks.append(asyncio.create_task(self.delivery_worker()))
+        self.background_tasks.append(asyncio.create_task(self.retention_loop()))
+        self.background_tasks.append(asyncio.create_task(self.warm_keyword_matchers()))
+        self.background_tasks.append(asyncio.create_task(self.connect_accounts()))
+        self.background_tasks.append(asyncio.create_task(self.sync_bot_commands()))
+        if self.webhook_enabled:
+            self.background_tasks.append(asyncio.create_task(self.webhook_health_loop()))
+
+    async def sync_bot_commands(self):
+        # 命令菜单的摘要保存在 config 表中，没有变化时不再调用 set_my_commands
+        digest = hashlib.sha256(
+            json.dumps([[c.command, c.description] for c in self.commands], ensure_ascii=False).encode('utf-8')
+        ).hexdigest()
+        stored = await asyncio.to_thread(self.db_manager.get_config_values, ['bot_commands_hash'])
+        if stored.get('bot_commands_hash') == digest:
+            logger.debug("命令菜单没有变化，跳过设置。")
+            return
+        try:
+            await self.application.bot.set_my_commands(self.commands)
+            await asyncio.to_thread(self.db_manager.set_config_value, 'bot_commands_hash', digest)
+            logger.info("已更新命令菜单。")
+        except Exception as e:
+            logger.error(f"设置命令菜单失败: {e}", exc_info=True)
+
+    async def _log_first_update(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        if not self.first_update_seen:
+            self.first_update_seen = True
+            boot_timer.phase("收到首个更新")
+
+    def create_client(self, session_string):
+        # 低内存模式下使用有界的会话实体和实体缓存，且不追赶离线期间的更新（由补拉负责）
+        if self.config['memory.low_memory']:
+            limit = self.config['memory.entity_cache_limit']
+            return TelegramClient(
+                CompactSession(session_string, limit), self.api_id, self.api_hash,
+                entity_cache_limit=limit, catch_up=False
+            )
+        return TelegramClient(StringSession(session_string), self.api_id, self.api_hash)
+
+    def wake_idle_accounts(self, user_id):
+        # 用户添加关键词后，连接其之前因空闲而未连接的账号
+        for account in [account for account in self.idle_accounts.values() if account[1] == user_id]:
+            del self.idle_accounts[account[0]]
+            task = asyncio.create_task(self._connect_account(*account))
+            self.background_tasks.append(task)
+            task.add_done_callback(lambda t: t in self.background_tasks and self.background_tasks.remove(t))
+
+    async def connect_accounts(self):
+        # 并发连接所有已登录的账号，每个账号连接成功后立即开始监听并补拉
+        self.rss_baseline = current_rss()
+        accounts = await asyncio.to_thread(self.db_manager.get_all_authenticated_accounts)
+        semaphore = asyncio.Semaphore(self.config['startup.connect_concurrency'])
+
+        async def connect(account):
+            async with semaphore:
+                await self._connect_account(*account)
+
+        await asyncio.gather(*(connect(account) for account in accounts))
+        boot_timer.phase(f"连接 {len(self.user_clients)}/{len(accounts)} 个账号")
+
+    async def _connect_account(self, account_id, user_id, username, firstname, lastname, session_string):
+        # 检查 session_string 是否存在
+        if not session_string:
+            # 如果 session_string 不存在，删除该账号的记录
+            await asyncio.to_thread(self.db_manager.remove_user_account, account_id)
+            logger.warning(f"用户 {user_id} 的会话为空，已删除该账号记录 (账号ID: {account_id})。")
+            return
+
+        # 低内存模式下，没有关键词的账号暂不连接，添加关键词后再连接
+        if self.config['memory.low_memory'] and not self.db_manager.get_keywords(user_id):
+            self.idle_accounts[account_id] = (account_id, user_id, username, firstname, lastname, session_string)
+            logger.info(f"用户 {user_id} 没有设置关键词，账号 {account_id} 暂不连接。")
+            return
+
+        try:
+            client = self.create_client(session_string)
+        except Exception as decode_error:
+            logger.error(f"解码用户 {user_id} (账号ID: {account_id}) 的会话失败: {decode_error}")
+            return
+
+        try:
+            await asyncio.wait_for(client.connect(), self.config['supervisor.probe_timeout'])
+            if not await client.is_user_authorized():
+                raise errors.UnauthorizedError(None, "会话未授权或已失效")
+
+            # 注册消息事件处理器
+            self.attach_client(account_id, user_id, client)
+            self.schedule_backfill(account_id)
+
+            logger.info(f"已启动并连接用户 {user_id} 用户名： @{username} 全名： {firstname} {lastname} 的 Telethon 客户端 (账号ID: {account_id})。")
+        except Exception as e:
+            # 捕获并记录单个客户端的启动错误，但不影响其他客户端和整个程序
+            logger.error(f"启动用户 {user_id} (账号ID: {account_id}) 的 Telethon 客户端失败: {e}", exc_info=True)
+            await asyncio.to_thread(self.db_manager.set_account_health, account_id, False, str(e))
+            self.detach_client(account_id)
+            try:
+                await client.disconnect()
+            except Exception:
+                pass
+
+    async def post_shutdown(self, application: Application):
+        profiler.stop()
+        for task in self.background_tasks:
+            task.cancel()
+        await asyncio.gather(*self.background_tasks, return_exceptions=True)
+        self.background_tasks.clear()
+        # 先把尚未入队的推送写入队列，再写回水位线，保证水位线之前的消息都已持久化
+        await self.flush_watermarks()
+        await self.flush_chat_owners()
+        self.save_matcher_snapshot()
+        self.matcher_snapshot.close()
+        # 客户端在机器人的事件循环中连接，也在这里断开
+        results = await asyncio.gather(
+            *(client.disconnect() for client in self.user_clients.values()), return_exceptions=True
+        )
+        for error in results:
+            if isinstance(error, Exception):
+                logger.error(f"断开客户端连接时发生错误: {error}")
+        logger.info("所有 Telethon 客户端已断开连接。")
+
+    def _mark_processed(self, account_id, message):
+        # 记录消息已开始处理，返回 False 表示该消息已处理过
+        key = (account_id, message.chat_id, message.id)
+        if key in self.recent_messages:
+            return False
+        self.recent_messages[key] = None
+        while len(self.recent_messages) > 10000:
+            self.recent_messages.popitem(last=False)
+        return True
+
+    def _advance_watermark(self, account_id, message):
+        # 消息处理完成（已放入推送队列或被忽略）后才推进水位线
+        self.chat_activity[(account_id, message.chat_id)] = time.monotonic()
+        watermarks = self.chat_watermarks.setdefault(account_id, {})
+        entry = watermarks.get(message.chat_id)
+        if entry is None:
+            entry = watermarks[message.chat_id] = [0, None]
+        if entry[1] is None:
+            entry[1] = getattr(message.input_chat, 'access_hash', None)
+        if message.id > entry[0]:
+            entry[0] = message.id
+            self.dirty_watermarks.add((account_id, message.chat_id))
+
+    def _may_own_chat(self, uid, account_id, chat_id):
+        # Telethon 事件过滤器，不修改任何状态：该账号是归属账号，或者可以接管该聊天时返回 True
+        owner = self.chat_owners.get((uid, chat_id))
+        if owner is None or owner == account_id:
+            return True
+        health = self.account_health.get(owner)
+        return not health or not health['healthy'] or self._owner_stalled((uid, chat_id), owner)
+
+    async def note_chat_message(self, event, uid, account_id):
+        # 其他账号负责的聊天收到消息时记下开始等待的时间；归属账号在此之后处理过该聊天的消息就重新计时
+        key = (uid, event.chat_id)
+        owner = self.chat_owners.get(key)
+        if owner is None or owner == account_id:
+            return
+        since = self.chat_sightings.get(key)
+        if since is None or self.chat_activity.get((owner, event.chat_id), 0) >= since:
+            self.chat_sightings[key] = time.monotonic()
+
+    def _owns_chat(self, uid, account_id, chat_id, live=False):
+        # 判断该账号是否负责接收该聊天的消息，需要时认领；没有归属或所属账号断开、异常时由当前账号接管
+        # live 表示当前账号刚收到该聊天的实时消息，归属账号长时间没有跟上时也由当前账号接管
+        key = (uid, chat_id)
+        owner = self.chat_owners.get(key)
+        if owner == account_id:
+            return True
+        if owner is not None:
+            health = self.account_health.get(owner)
+            if not health or not health['healthy']:
+                logger.info(f"账号 {owner} 不可用，用户 {uid} 的聊天 {chat_id} 改由账号 {account_id} 接收。")
+            elif live and self._owner_stalled(key, owner):
+                logger.info(
+                    f"账号 {owner} 超过 {self.config['chat_owner.stall_timeout']} 秒没有处理聊天 {chat_id} 的消息，"
+                    f"用户 {uid} 的该聊天改由账号 {account_id} 接收。"
+                )
+            else:
+                return False
+            self._inherit_watermark(account_id, owner, chat_id)
+        self.chat_owners[key] = account_id
+        self.dirty_chat_owners.add(key)
+        self.chat_sightings.pop(key, None)
+        return True
+
+    def _owner_stalled(self, key, owner):
+        # 其他账号收到消息后超过阈值，归属账号仍没有处理过该聊天的消息，视为停滞
+        since = self.chat_sightings.get(key)
+        if since is None or self.chat_activity.get((owner, key[1]), 0) >= since:
+            return False
+        return time.monotonic() - since >= self.config['chat_owner.stall_timeout']
+
+    def _inherit_watermark(self, account_id, previous_account_id, chat_id):
+        # 频道和超级群组的消息ID在所有账号间一致，归属转移时沿用原账号的水位线，避免之后补拉重复的消息
+        if utils.resolve_id(chat_id)[1] is not types.PeerChannel:
+            return
+        previous = self.chat_watermarks.get(previous_account_id, {}).get(chat_id)
+        if previous is None:
+            return
+        entry = self.chat_watermarks.setdefault(account_id, {}).setdefault(chat_id, [0, None])
+        if previous[0] > entry[0]:
+            entry[0] = previous[0]
+            self.dirty_watermarks.add((account_id, chat_id))
+
+    async def flush_chat_owners(self):
+        # 在事件循环中取出待写回的归属，只把整理好的行交给线程写入数据库
+        dirty, self.dirty_chat_owners = self.dirty_chat_owners, set()
+        rows = [(uid, chat_id, self.chat_owners[(uid, chat_id)]) for uid, chat_id in dirty if (uid, chat_id) in self.chat_owners]
+        try:
+            await asyncio.to_thread(self.db_manager.save_chat_owners, rows)
+        except Exception as e:
+            self.dirty_chat_owners |= dirty
+            logger.error(f"写回聊天归属失败: {e}", exc_info=True)
+
+    async def rebalance_chat_owners(self, uid):
+        # 账号增减或群组同步后重新分配该用户的聊天归属，先写回运行中新认领的归属和水位线
+        try:
+            await self.flush_chat_owners()
+            await self.flush_watermarks()
+            assigned = await asyncio.to_thread(
+                self.db_manager.rebalance_chat_owners, uid, time.time() - self.config['chat_owner.active_days'] * 86400
+            )
+        except Exception as e:
+            logger.error(f"重新分配用户 {uid} 的聊天归属失败: {e}", exc_info=True)
+            return
+        previous = {chat_id: owner for (owner_uid, chat_id), owner in self.chat_owners.items() if owner_uid == uid}
+        for chat_id in previous:
+            del self.chat_owners[(uid, chat_id)]
+        moved = 0
+        for chat_id, account_id in assigned.items():
+            self.chat_owners[(uid, chat_id)] = account_id
+            if previous.get(chat_id, account_id) != account_id:
+                self._inherit_watermark(account_id, previous[chat_id], chat_id)
+                moved += 1
+        logger.info(f"已重新分配用户 {uid} 的 {len(assigned)} 个聊天归属，其中 {moved} 个更换了账号。")
+
+    async def flush_watermarks(self):
+        # 先把推送缓冲区写入队列，缓冲区清空后才写回水位线，保证水位线之前的消息都已持久化
+        # 写入队列失败时不写回水位线，重启后会从旧的水位线补拉这些消息
+        if not await self.flush_enqueue_buffer() or self.enqueue_buffer:
+            logger.warning("推送缓冲区尚未写入队列，暂不写回聊天水位线。")
+            return False
+        # 在事件循环中取出待写回的水位线，此时它们对应的推送都已写入队列
+        dirty, self.dirty_watermarks = self.dirty_watermarks, set()
+        rows = []
+        for account_id, chat_id in dirty:
+            entry = self.chat_watermarks.get(account_id, {}).get(chat_id)
+            if entry:
+                rows.append((account_id, chat_id, entry[0], entry[1]))
+        try:
+            await asyncio.to_thread(self.db_manager.save_chat_watermarks, rows)
+        except Exception as e:
+            self.dirty_watermarks |= dirty
+            logger.error(f"写回聊天水位线失败: {e}", exc_info=True)
+            return False
+        return True
+
+    async def watermark_flush_loop(self):
+        while True:
+            await asyncio.sleep(self.config['backfill.watermark_flush_interval'])
+            if self.dirty_watermarks:
+                await self.flush_watermarks()
+            if self.dirty_chat_owners:
+                await self.flush_chat_owners()
+
+    async def supervisor_loop(self):
+        # 周期性探测每个账号的连接和授权状态，探测均匀分散在整个周期内并带随机抖动，避免集中请求 Telegram
+        while True:
+            account_ids = list(self.user_clients)
+            if not account_ids:
+                await asyncio.sleep(self.config['supervisor.interval'])
+                continue
+            spacing = self.config['supervisor.interval'] / len(account_ids)
+            for account_id in account_ids:
+                await asyncio.sleep(spacing * random.uniform(0.5, 1.5))
+                if account_id in self.user_clients:
+                    try:
+                        await self.probe_account(account_id)
+                    except asyncio.CancelledError:
+                        raise
+                    except Exception as e:
+                        logger.error(f"探测账号 {account_id} 时发生错误: {e}", exc_info=True)
+
+    async def probe_account(self, account_id):
+        client = self.user_clients.get(account_id)
+        state = self.account_health.get(account_id)
+        if not client or not state or state['revoked']:
+            return
+        if time.monotonic() < state['next_retry']:
+            return  # 仍在退避中
+
+        reconnected = False
+        try:
+            if not client.is_connected():
+                await asyncio.wait_for(client.connect(), self.config['supervisor.probe_timeout'])
+                reconnected = True
+            # is_user_authorized 会缓存结果，这里发送一个轻量请求来真正确认会话仍然有效
+            await asyncio.wait_for(client(functions.updates.GetStateRequest()), self.config['supervisor.probe_timeout'])
+        except errors.UnauthorizedError as e:
+            await self._mark_account_revoked(account_id, e)
+            return
+        except Exception as e:
+            await self._mark_account_failed(account_id, e)
+            return
+
+        state['failures'] = 0
+        state['next_retry'] = 0.0
+        if state['connected_since'] is None or reconnected:
+            state['connected_since'] = time.monotonic()
+        if not state['healthy'] or reconnected:
+            state['healthy'] = True
+            await asyncio.to_thread(self.db_manager.set_account_health, account_id, True)
+            logger.info(f"账号 {account_id} 已恢复连接。")
+            await self._notify_account_owner(account_id, f"✅ 账号ID {account_id} 已恢复连接，正在补拉断线期间的消息。")
+            self.schedule_backfill(account_id)
+        elif not state['persisted']:
+            await asyncio.to_thread(self.db_manager.set_account_health, account_id, True)
+        state['persisted'] = True
+
+    async def _mark_account_failed(self, account_id, error):
+        state = self.account_health[account_id]
+        state['failures'] += 1
+        state['connected_since'] = None
+        # 带抖动的指数退避
+        delay = min(
+            self.config['supervisor.reconnect_max_delay'],
+            self.config['supervisor.reconnect_base_delay'] * 2 ** (state['failures'] - 1)
+        )
+        state['next_retry'] = time.monotonic() + delay * random.uniform(0.5, 1.5)
+        logger.warning(f"账号 {account_id} 探测失败（第 {state['failures']} 次），约 {delay} 秒后重试: {error}")
+        if state['healthy']:
+            state['healthy'] = False
+            await asyncio.to_thread(self.db_manager.set_account_health, account_id, False, str(error))
+            await self._notify_account_owner(account_id, f"⚠️ 账号ID {account_id} 连接已断开，正在自动重连。")
+
+    async def _mark_account_revoked(self, account_id, error):
+        # 会话已失效，重连没有意义，停止该账号并提示用户重新登录
+        state = self.account_health[account_id]
+        state['healthy'] = False
+        state['revoked'] = True
+        state['connected_since'] = None
+        logger.error(f"账号 {account_id} 的会话已失效: {error}")
+        await asyncio.to_thread(self.db_manager.set_account_health, account_id, False, str(error))
+        await self._notify_account_owner(
+            account_id, f"❌ 账号ID {account_id} 的会话已失效或被撤销，请使用 /login 重新上传会话文件。"
+        )
+        client = self.user_clients.get(account_id)
+        if client:
+            try:
+                await client.disconnect()
+            except Exception as e:
+                logger.error(f"断开账号 {account_id} 的客户端失败: {e}", exc_info=True)
+
+    async def _notify_account_owner(self, account_id, text):
+        uid = self.account_owners.get(account_id)
+        if uid is None:
+            return
+        try:
+            await self.application.bot.send_message(chat_id=uid, text=text, rate_limit_args=PRIORITY_ALERT)
+        except Exception as e:
+            logger.error(f"通知用户 {uid} 账号状态失败: {e}", exc_info=True)
+
+    def get_account_uptime(self, account_id):
+        # 返回账号当前连续在线的秒数，未运行或已断开时返回 None
+        state = self.account_health.get(account_id)
+        if not state or not state['healthy'] or state['connected_since'] is None:
+            return None
+        return time.monotonic() - state['connected_since']
+
+    @staticmethod
+    def _format_duration(seconds):
+        seconds = int(seconds)
+        days, seconds = divmod(seconds, 86400)
+        hours, seconds = divmod(seconds, 3600)
+        minutes = seconds // 60
+        if days:
+            return f"{days}天{hours}小时"
+        if hours:
+            return f"{hours}小时{minutes}分钟"
+        return f"{minutes}分钟"
+
+    def enqueue_delivery(self, uid, payload):
+        # 放入内存缓冲区，攒够一批或等待 queue.batch_window 秒后一次性写入持久化队列
+        self.enqueue_buffer.append((uid, payload))
+        if len(self.enqueue_buffer) >= self.config['queue.batch_size']:
+            asyncio.create_task(self.flush_enqueue_buffer())
+        elif self.enqueue_flush_handle is None:
+            loop = asyncio.get_running_loop()
+            self.enqueue_flush_handle = loop.call_later(
+                self.config['queue.batch_window'], lambda: asyncio.create_task(self.flush_enqueue_buffer())
+            )
+
+    async def flush_enqueue_buffer(self):
+        if self.enqueue_flush_handle is not None:
+            self.enqueue_flush_handle.cancel()
+            self.enqueue_flush_handle = None
+        async with self.enqueue_lock:
+            batch, self.enqueue_buffer = self.enqueue_buffer, []
+            if not batch:
+                return True
+            try:
+                await asyncio.to_thread(self.db_manager.enqueue_deliveries, batch)
+            except Exception as e:
+                self.enqueue_buffer[:0] = batch
+                logger.error(f"写入推送队列失败: {e}", exc_info=True)
+                return False
+        self.delivery_wakeup.set()
+        return True
+
+    async def delivery_worker(self):
+        # 从持久化队列批量取出消息发送，成功后确认；失败按退避重试，超过次数后丢弃
+        while True:
+            try:
+                batch = await asyncio.to_thread(self.db_manager.claim_deliveries, self.config['queue.batch_size'])
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"读取推送队列失败: {e}", exc_info=True)
+                batch = []
+            if not batch:
+                self.delivery_wakeup.clear()
+                try:
+                    await asyncio.wait_for(self.delivery_wakeup.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            results = await asyncio.gather(*(self._deliver(uid, payload) for _, uid, payload, _ in batch))
+            acked, pushes, retries, dropped = [], [], [], []
+            now = time.time()
+            for (queue_id, uid, payload, attempts), error in zip(batch, results):
+                if error is None:
+                    acked.append(queue_id)
+                    pushes.append({
+                        'user_id': uid,
+                        'keyword': payload['keyword'],
+                        'chat_id': payload['chat_id'],
+                        'message_id': payload['message_id'],
+                        'timestamp': datetime.fromisoformat(payload['timestamp']),
+                        'chat_title': payload.get('chat_title'),
+                        'sender_id': payload['sender_id'],
+                        'sender_name': payload.get('sender_name'),
+                    })
+                elif isinstance(error, (Forbidden, BadRequest)) or attempts >= self.config['queue.max_attempts']:
+                    logger.error(f"推送给用户 {uid} 的消息 {queue_id} 已放弃（第 {attempts} 次）: {error}")
+                    dropped.append(queue_id)
+                else:
+                    delay = error.retry_after if isinstance(error, RetryAfter) else min(300, 5 * 2 ** attempts)
+                    if hasattr(delay, 'total_seconds'):
+                        delay = delay.total_seconds()
+                    retries.append((queue_id, now + float(delay)))
+            try:
+                await asyncio.to_thread(self._settle_deliveries, acked, pushes, retries, dropped)
+            except Exception as e:
+                logger.error(f"确认推送队列失败，消息将在租约到期后重新投递: {e}", exc_info=True)
+
+    def _settle_deliveries(self, acked, pushes, retries, dropped):
+        self.db_manager.ack_deliveries(acked, pushes)
+        self.db_manager.retry_deliveries(retries)
+        self.db_manager.drop_deliveries(dropped)
+
+    async def _deliver(self, uid, payload):
+        # 发送一条推送，成功返回 None，失败返回异常
+        keyboard = InlineKeyboardMarkup([[
+            InlineKeyboardButton("🔗 跳转到原消息", url=payload['message_link']),
+            InlineKeyboardButton("🔒 屏蔽此用户", callback_data=encode_callback(CALLBACK_BLOCK_USER, payload['sender_id'], uid))
+        ]])
+        try:
+            await self.application.bot.send_message(
+                chat_id=uid,
+                text=payload['text'],
+                parse_mode='Markdown',
+                reply_markup=keyboard,
+                rate_limit_args=PRIORITY_ALERT
+            )
+            logger.info(f"消息已成功转发给用户 {uid}。")
+            return None
+        except Exception as e:
+            logger.error(f"转发消息给用户 {uid} 失败: {e}", exc_info=True)
+            return e
+
+    async def retention_loop(self):
+        # 定期压缩过期的推送日志并回收空间，数据库操作都在线程中执行，不阻塞事件循环
+        await asyncio.sleep(60)
+        while True:
+            try:
+                cutoff = (datetime.now() - timedelta(days=self.config['retention.days'])).strftime('%Y-%m-%d 00:00:00')
+                compacted = await asyncio.to_thread(self.db_manager.compact_push_logs, cutoff)
+                await asyncio.to_thread(
+                    self.db_manager.prune_push_stats,
+                    (datetime.now() - timedelta(days=2)).strftime('%Y-%m-%d %H'),
+                    (datetime.now() - timedelta(days=PUSH_STATS_DAYS)).strftime('%Y-%m-%d'),
+                )
+                reclaimed = await asyncio.to_thread(self.db_manager.incremental_vacuum)
+                if compacted or reclaimed:
+                    logger.info(f"推送日志压缩完成：汇总 {compacted} 条原始日志，回收 {reclaimed} 页。")
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"压缩推送日志失败: {e}", exc_info=True)
+            await asyncio.sleep(self.config['retention.interval'])
+
+    def schedule_backfill(self, account_id):
+        task = asyncio.create_task(self.backfill_account(account_id))
+        self.background_tasks.append(task)
+        task.add_done_callback(lambda t: t in self.background_tasks and self.background_tasks.remove(t))
+        return task
+
+    async def backfill_account(self, account_id):
+        # 对该账号所有有水位线的聊天进行有界、限速的补拉，走与实时消息相同的匹配流程
+        async with self.backfill_lock:
+            client = self.user_clients.get(account_id)
+            uid = self.account_owners.get(account_id)
+            if not client or uid is None:
+                return
+            watermarks = {chat_id: list(entry) for chat_id, entry in self.chat_watermarks.get(account_id, {}).items()}
+            total = 0
+            for chat_id, (last_message_id, access_hash) in watermarks.items():
+                if account_id not in self.user_clients:
+                    return  # 账号已被移除
+                if not self._owns_chat(uid, account_id, chat_id):
+                    continue  # 由该用户的其他账号负责
+                try:
+                    peer = self._build_input_peer(chat_id, access_hash)
+                    count = 0
+                    async for message in client.iter_messages(
+                        peer, limit=self.config['backfill.limit'], min_id=last_message_id, reverse=True, wait_time=1
+                    ):
+                        # 实时消息优先：有实时消息在处理时暂停补拉
+                        while self.live_inflight:
+                            await asyncio.sleep(self.config['backfill.delay'])
+                        await self.process_message(message, uid, account_id)
+                        count += 1
+                        await asyncio.sleep(self.config['backfill.delay'])
+                    if count >= self.config['backfill.limit']:
+                        logger.warning(f"账号 {account_id} 在聊天 {chat_id} 中的补拉达到上限 {self.config['backfill.limit']} 条，更早的消息已跳过。")
+                    total += count
+                except asyncio.CancelledError:
+                    raise
+                except (errors.ChannelPrivateError, errors.ChatForbiddenError, errors.UserNotParticipantError) as e:
+                    # 账号已退出或被移出该聊天
+                    logger.info(f"账号 {account_id} 已不在聊天 {chat_id} 中（{e}），移除其水位线和聊天归属。")
+                    await self.forget_account_chats(account_id, [chat_id])
+                except Exception as e:
+                    logger.error(f"账号 {account_id} 补拉聊天 {chat_id} 失败: {e}", exc_info=True)
+            logger.info(f"账号 {account_id} 补拉完成，共处理 {total} 条消息。")
+
+    @staticmethod
+    def _build_input_peer(chat_id, access_hash):
+        # 根据保存的聊天ID和 access_hash 构造 InputPeer，重启后无需实体缓存即可补拉
+        real_id, peer_type = utils.resolve_id(chat_id)
+        if peer_type is types.PeerChannel and access_hash is not None:
+            return types.InputPeerChannel(real_id, access_hash)
+        if peer_type is types.PeerChat:
+            return types.InputPeerChat(real_id)
+        if peer_type is types.PeerUser and access_hash is not None:
+            return types.InputPeerUser(real_id, access_hash)
+        return chat_id
+
+    def _rebuild_spam_filter(self):
+        # 刷屏过滤参数变更后重建过滤器，窗口内的历史记录会清空
+        self.spam_filter = SpamFilter(
+            self.config['spam.window'], self.config['spam.max_per_sender'], self.config['spam.simhash_distance']
+        )
+
+    def get_keyword_matcher(self, uid):
+        # 关键词有变更时才重建匹配器，批量导入只会触发一次重建
+        version = self.db_manager.get_keyword_version(uid)
+        cached = self.keyword_matchers.get(uid)
+        if cached and cached[0] == version:
+            return cached[1]
+        matcher = self.matcher_snapshot.load(uid, version) or KeywordMatcher(self.db_manager.get_keywords(uid))
+        self.keyword_matchers[uid] = (version, matcher)
+        return matcher
+
+    async def warm_keyword_matchers(self):
+        # 启动时只重新编译关键词有变化的用户并写回快照；未变化的用户留在内存映射中，首次匹配消息时再加载
+        started = time.perf_counter()
+        versions = await asyncio.to_thread(self.db_manager.get_keyword_versions)
+        snapshot_versions = self.matcher_snapshot.versions()
+        compiled = 0
+        for uid, version in versions.items():
+            cached = self.keyword_matchers.get(uid)
+            if snapshot_versions.get(uid) == version or (cached and cached[0] == version):
+                continue
+            matcher = await asyncio.to_thread(lambda: KeywordMatcher(self.db_manager.get_keywords(uid)))
+            self.keyword_matchers.setdefault(uid, (version, matcher))
+            compiled += 1
+        logger.info(
+            f"关键词匹配器：{len(versions)} 个用户中 {len(versions) - compiled} 个可直接使用快照，"
+            f"重新编译 {compiled} 个，耗时 {(time.perf_counter() - started) * 1000:.0f}ms。"
+        )
+        if versions != self.matcher_snapshot.versions():
+            await asyncio.to_thread(self.save_matcher_snapshot)
+
+    def save_matcher_snapshot(self):
+        # 关键词有变化时重写快照；内存中和快照中都没有当前版本的用户在这里编译
+        versions = self.db_manager.get_keyword_versions()
+        if versions == self.matcher_snapshot.versions():
+            return
+        try:
+            records = {}
+            for uid, version in versions.items():
+                cached = self.keyword_matchers.get(uid)
+                if cached and cached[0] == version:
+                    data = cached[1].to_snapshot()
+                else:
+                    data = self.matcher_snapshot.raw(uid, version)
+                    if data is None:
+                        data = KeywordMatcher(self.db_manager.get_keywords(uid)).to_snapshot()
+                records[uid] = (version, data)
+            self.matcher_snapshot.write(records)
+            logger.info(f"已写入 {len(records)} 个用户的关键词匹配器快照。")
+        except Exception as e:
+            logger.error(f"写入关键词匹配器快照失败: {e}", exc_info=True)
+
+    @profiled
+    async def handle_new_message(self, event: Message, uid: int, account_id: int = None):
+        if account_id is not None and not self._owns_chat(uid, account_id, event.chat_id, live=True):
+            return
+        self.live_inflight += 1
         try:
+            await self.process_message(event.message, uid, account_id)
+        finally:
+            self.live_inflight -= 1
+
+    async def process_message(self, event, uid, account_id=None):
+        # event 为 Telethon 的 Message 对象，实时消息与补拉消息共用此流程
+        try:
+            # 全局屏蔽的发送者在任何其他处理之前丢弃
+            if self.db_manager.is_globally_blocked(event.sender_id):
+                logger.debug(f"发送者 {event.sender_id} 已被全局屏蔽，忽略。")
+                return
+            if account_id is not None and not self._mark_processed(account_id, event):
+                logger.debug(f"消息 {event.chat_id}/{event.id} 已处理过，忽略。")
+                return
             chat_id = event.chat_id
+            # 用户选择了监听群组时，只处理这些群组中的消息
+            monitored_groups = self.db_manager.get_monitored_group_ids(uid)
+            if monitored_groups and chat_id not in monitored_groups:
+                logger.debug(f"聊天 {chat_id} 不在用户 {uid} 的监听群组中，忽略。")
+                return
             # 获取发送者信息
             sender = await event.get_sender()
             if not sender:
@@ -780,35 +4080,34 @@ class TelegramBot:
                 first_name = getattr(sender, 'first_name', '未知用户')
 
             logger.debug(f"消息发送者 ID: {user_id}, 用户名: {username}")
-            blocked_users = self.db_manager.list_blocked_users(uid)
             # 检查用户是否被屏蔽
-            if user_id in blocked_users:
+            if self.db_manager.is_blocked(uid, user_id) or self.db_manager.is_globally_blocked(user_id):
                 logger.debug(f"用户 {user_id} 已被屏蔽，忽略其消息。")
                 return
 
             # 获取消息内容
-            message = event.message.message
+            message = event.message
             if not message:
                 logger.debug("消息内容为空，忽略。")
                 return  # 忽略没有文本的消息
 
-            keyword_text = None
-
             # 查看是否包含关键词
-            keywords = self.db_manager.get_keywords(uid)
-            for keyword in keywords:
-                if keyword in message:
-                    logger.debug(f"消息包含关键词 '{keyword}',触发监控。")
-                    keyword_text = keyword
-                    break
+            keyword_text = self.get_keyword_matcher(uid).match(message)
 
             if not keyword_text:
                 logger.debug("消息不包含关键词，忽略。")
                 return
+            logger.debug(f"消息包含关键词 '{keyword_text}',触发监控。")
+
+            # 刷屏过滤，在构建和发送推送之前丢弃
+            reason = self.spam_filter.check(uid, user_id, message)
+            if reason:
+                logger.debug(f"用户 {user_id} 的消息被刷屏过滤（{reason}），不推送给用户 {uid}。")
+                return
 
             # 获取消息所在的聊天
             chat = await event.get_chat()
-            message_id = event.message.id
+            message_id = event.id
 
             # 处理聊天标题（支持群组或私人聊天）
             if chat:
@@ -852,13 +4151,6 @@ class TelegramBot:
 
             logger.debug(f"发送者链接: {sender_link}")
 
-            # 创建按钮，新增"🔒 屏蔽此用户"按钮
-            keyboard = InlineKeyboardMarkup([[
-                InlineKeyboardButton("🔗 跳转到原消息", url=message_link),
-                InlineKeyboardButton("🔒 屏蔽此用户", callback_data=f"block_user:{user_id}:{uid}")
-            ]])
-            logger.debug("创建了跳转按钮和屏蔽按钮。")
-
             # 构建转发消息的内容
             forward_text = (
                 f"📢 *新消息来自群组：* {group_display_name}\n\n"
@@ -867,23 +4159,25 @@ class TelegramBot:
             )
             logger.debug(f"构建的转发消息内容:\n{forward_text}")
 
-            # 尝试发送消息
-            try:
-                await self.application.bot.send_message(
-                    chat_id=uid,
-                    text=forward_text,
-                    parse_mode='Markdown',
-                    reply_markup=keyboard
-                )
-                logger.info(f"消息已成功转发给用户 {uid}。")
-                self.db_manager.record_push_log(uid, keyword_text, chat_id, message_id, datetime.now())
-                # 记录推送日志
-                logger.debug(f"已记录推送日志: 用户 {uid}, 聊天 {chat_id}, 消息 {message_id}")
-            except Exception as e:
-                logger.error(f"转发消息给用户 {uid} 失败: {e}", exc_info=True)
+            # 放入持久化推送队列，由发送任务负责发送、确认并记录推送日志
+            self.enqueue_delivery(uid, {
+                'text': forward_text,
+                'message_link': message_link,
+                'sender_id': user_id,
+                'sender_name': first_name,
+                'chat_title': chat_title,
+                'keyword': keyword_text,
+                'chat_id': chat_id,
+                'message_id': message_id,
+                'timestamp': datetime.now().isoformat(sep=' '),
+            })
+            logger.debug(f"消息已加入推送队列: 用户 {uid}, 聊天 {chat_id}, 消息 {message_id}")
 
         except Exception as e:
             logger.error(f"处理消息失败: {e}", exc_info=True)
+        finally:
+            if account_id is not None:
+                self._advance_watermark(account_id, event)
     @restricted
     async def my_account(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
@@ -928,79 +4222,146 @@ class TelegramBot:
             f"  *已认证*: {'✅ 是' if account[5] else '❌ 否'}\n"
         )
 
-        # 发送账号信息
-        await update.message.reply_text(account_info, parse_mode='Markdown')
-        logger.info(f"用户 {user_id} 查看了账号ID {account_id} 的信息。")
+        # 发送账号信息
+        await update.message.reply_text(account_info, parse_mode='Markdown')
+        logger.info(f"用户 {user_id} 查看了账号ID {account_id} 的信息。")
+
+    # 回调查询路由：每种动作注册一个 CallbackQueryHandler，按回调数据的首字符分发
+    def setup_callback_handlers(self):
+        # 兼容旧版本消息中的文本格式回调数据，需先于前缀路由注册
+        self.application.add_handler(CallbackQueryHandler(
+            self.on_legacy_callback, pattern=re.compile(r'^(block_user|delete):')
+        ))
+        routes = {
+            CALLBACK_BLOCK_USER: self.on_block_user_callback,
+            CALLBACK_PAGE: self.on_page_callback,
+            CALLBACK_DELETE_KEYWORD: self.on_delete_keyword_callback,
+            CALLBACK_NOOP: self.on_noop_callback,
+            CALLBACK_TOGGLE_GROUP: self.on_toggle_group_callback,
+        }
+        for action, handler in routes.items():
+            self.application.add_handler(CallbackQueryHandler(
+                self._callback_route(handler),
+                pattern=lambda data, action=action: isinstance(data, str) and data[:1] == action
+            ))
+        # 兜底处理未知的回调数据
+        self.application.add_handler(CallbackQueryHandler(self.handle_callback_query))
+
+    def _callback_route(self, handler):
+        async def route(update: Update, context: ContextTypes.DEFAULT_TYPE):
+            query = update.callback_query
+            logger.debug(f"收到回调查询: {query.data}")
+            try:
+                _, values = decode_callback(query.data)
+                await handler(query, update, context, *values)
+            except (ValueError, TypeError) as ve:
+                logger.error(f"解析回调数据失败: {ve}")
+                await query.answer("数据格式错误")
+                await self._edit_query_message(query, "❌ 操作失败：数据格式错误")
+            except Exception as e:
+                logger.error(f"处理回调查询时发生错误: {e}", exc_info=True)
+                await query.answer("处理请求时出错")
+                await self._edit_query_message(query, "❌ 操作失败，请稍后重试。")
+        route.__qualname__ = handler.__qualname__
+        return route
+
+    async def on_block_user_callback(self, query, update, context, target_user_id, receiving_user_id):
+        if receiving_user_id != update.effective_user.id:
+            await query.answer("无权执行此操作")
+            return
+        logger.debug(f"尝试屏蔽用户 - 目标用户ID: {target_user_id}, 接收用户ID: {receiving_user_id}")
+
+        # 检查是否已经屏蔽
+        if self.db_manager.is_blocked(receiving_user_id, target_user_id):
+            await query.answer("该用户已经在屏蔽列表中")
+            await query.edit_message_text(
+                "ℹ️ 该用户已经在您的屏蔽列表中。",
+                parse_mode='Markdown'
+            )
+            return
+
+        try:
+            # 获取目标用户信息
+            target_user = await context.bot.get_chat(target_user_id)
+            target_first_name = target_user.first_name or "未知用户"
+            target_username = target_user.username
+
+            # 添加到屏蔽列表
+            self.db_manager.add_blocked_user(
+                receiving_user_id,
+                target_user_id,
+                target_first_name,
+                target_username
+            )
+
+            # 更新消息
+            success_message = (
+                f"✅ 已将用户添加到屏蔽列表\n\n"
+                f"• 用户名: {target_first_name}\n"
+                f"• 用户ID: `{target_user_id}`"
+            )
+            if target_username:
+                success_message += f"\n• Username: @{target_username}"
+
+            await query.answer("已成功屏蔽用户")
+            await query.edit_message_text(
+                success_message,
+                parse_mode='Markdown'
+            )
+            logger.info(f"用户 {receiving_user_id} 成功屏蔽了用户 {target_user_id}")
+
+        except Exception as e:
+            error_message = (
+                f"❌ 屏蔽用户失败\n\n"
+                f"用户ID: `{target_user_id}`\n"
+                f"错误信息: {str(e)}"
+            )
+            await query.answer("操作失败")
+            await query.edit_message_text(
+                error_message,
+                parse_mode='Markdown'
+            )
+            logger.error(f"屏蔽用户失败: {e}", exc_info=True)
+
+    async def on_page_callback(self, query, update, context, view, page):
+        # 翻页
+        await self._handle_page_callback(query, update.effective_user.id, view, page)
 
-    # 修改 handle_callback_query 方法
-    async def handle_callback_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def on_delete_keyword_callback(self, query, update, context, keyword_id, page):
+        # 按关键词ID删除，并刷新当前页
+        user_id = update.effective_user.id
+        keyword = self.db_manager.remove_keyword_by_id(user_id, keyword_id)
+        if keyword is None:
+            await query.answer("关键词不存在或已删除")
+        elif self.db_manager.get_keyword_entries(user_id):
+            await query.answer(f"已删除关键词：{keyword}")
+        else:
+            await query.answer(f"已删除关键词：{keyword}")
+            await query.edit_message_text("ℹ️ 您当前没有设置任何关键词。", parse_mode='Markdown')
+            return
+        text, reply_markup = self._render_remove_keyword_page(user_id, page)
+        await self._edit_query_message(query, text, reply_markup)
+
+    async def on_noop_callback(self, query, update, context):
+        await query.answer()
+
+    async def on_toggle_group_callback(self, query, update, context, group_id, page):
+        # 切换群组监听状态，并刷新当前页
+        user_id = update.effective_user.id
+        monitored = self.db_manager.toggle_monitored_group(user_id, group_id)
+        await query.answer("已开始监听该群组" if monitored else "已取消监听该群组")
+        text, reply_markup = self._render_groups_page(user_id, page)
+        await self._edit_query_message(query, text, reply_markup)
+
+    async def on_legacy_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         query = update.callback_query
         data = query.data
-        logger.debug(f"收到回调查询: {data}")
-
+        logger.debug(f"收到旧格式回调查询: {data}")
         try:
             if data.startswith("block_user:"):
-                # 解析用户ID
                 _, target_user_id, receiving_user_id = data.split(":")
-                target_user_id = int(target_user_id)
-                receiving_user_id = int(receiving_user_id)
-                
-                logger.debug(f"尝试屏蔽用户 - 目标用户ID: {target_user_id}, 接收用户ID: {receiving_user_id}")
-
-                # 检查是否已经屏蔽
-                blocked_users = self.db_manager.list_blocked_users(receiving_user_id)
-                if target_user_id in blocked_users:
-                    await query.answer("该用户已经在屏蔽列表中")
-                    await query.edit_message_text(
-                        "ℹ️ 该用户已经在您的屏蔽列表中。",
-                        parse_mode='Markdown'
-                    )
-                    return
-
-                try:
-                    # 获取目标用户信息
-                    target_user = await context.bot.get_chat(target_user_id)
-                    target_first_name = target_user.first_name or "未知用户"
-                    target_username = target_user.username
-
-                    # 添加到屏蔽列表
-                    self.db_manager.add_blocked_user(
-                        receiving_user_id,
-                        target_user_id,
-                        target_first_name,
-                        target_username
-                    )
-
-                    # 更新消息
-                    success_message = (
-                        f"✅ 已将用户添加到屏蔽列表\n\n"
-                        f"• 用户名: {target_first_name}\n"
-                        f"• 用户ID: `{target_user_id}`"
-                    )
-                    if target_username:
-                        success_message += f"\n• Username: @{target_username}"
-
-                    await query.answer("已成功屏蔽用户")
-                    await query.edit_message_text(
-                        success_message,
-                        parse_mode='Markdown'
-                    )
-                    logger.info(f"用户 {receiving_user_id} 成功屏蔽了用户 {target_user_id}")
-
-                except Exception as e:
-                    error_message = (
-                        f"❌ 屏蔽用户失败\n\n"
-                        f"用户ID: `{target_user_id}`\n"
-                        f"错误信息: {str(e)}"
-                    )
-                    await query.answer("操作失败")
-                    await query.edit_message_text(
-                        error_message,
-                        parse_mode='Markdown'
-                    )
-                    logger.error(f"屏蔽用户失败: {e}", exc_info=True)
-
-            elif data.startswith("delete:"):
+                await self.on_block_user_callback(query, update, context, int(target_user_id), int(receiving_user_id))
+            else:
                 # 处理删除关键词的逻辑
                 keyword = data.split(":", 1)[1]
                 if self.db_manager.remove_keyword(update.effective_user.id, keyword):
@@ -1016,28 +4377,20 @@ class TelegramBot:
                         f"⚠️ 关键词 '{keyword}' 删除失败。",
                         parse_mode='Markdown'
                     )
-            else:
-                logger.warning(f"未知的回调查询数据: {data}")
-                await query.answer("未知的操作")
-                await query.edit_message_text(
-                    "❓ 未知的操作类型。",
-                    parse_mode='Markdown'
-                )
-
         except ValueError as ve:
             logger.error(f"解析回调数据失败: {ve}")
             await query.answer("数据格式错误")
-            await query.edit_message_text(
-                "❌ 操作失败：数据格式错误",
-                parse_mode='Markdown'
-            )
+            await self._edit_query_message(query, "❌ 操作失败：数据格式错误")
         except Exception as e:
             logger.error(f"处理回调查询时发生错误: {e}", exc_info=True)
             await query.answer("处理请求时出错")
-            await query.edit_message_text(
-                "❌ 操作失败，请稍后重试。",
-                parse_mode='Markdown'
-            )
+            await self._edit_query_message(query, "❌ 操作失败，请稍后重试。")
+
+    async def handle_callback_query(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        query = update.callback_query
+        logger.warning(f"未知的回调查询数据: {query.data}")
+        await query.answer("未知的操作")
+        await self._edit_query_message(query, "❓ 未知的操作类型。")
 
     @restricted
     async def block_user(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1141,17 +4494,196 @@ class TelegramBot:
             logger.info(f"用户 {user_id} 请求列出屏蔽用户，但没有被屏蔽的用户。")
             return
 
+        text, reply_markup = self._render_blocked_page(user_id, 0)
+        await update.message.reply_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+        logger.info(f"用户 {user_id} 列出了自己的屏蔽用户列表。")
+
+    # 分页视图：每个视图只渲染当前页，翻页时通过回调编辑原消息
+    @staticmethod
+    def _paginate(items, page, page_size):
+        total_pages = max(1, (len(items) + page_size - 1) // page_size)
+        page = min(max(page, 0), total_pages - 1)
+        return items[page * page_size:(page + 1) * page_size], page, total_pages
+
+    @staticmethod
+    def _page_nav_row(view, page, total_pages):
+        if total_pages <= 1:
+            return []
+        row = []
+        if page > 0:
+            row.append(InlineKeyboardButton("⬅️ 上一页", callback_data=encode_callback(CALLBACK_PAGE, view, page - 1)))
+        row.append(InlineKeyboardButton(f"{page + 1}/{total_pages}", callback_data=encode_callback(CALLBACK_NOOP)))
+        if page < total_pages - 1:
+            row.append(InlineKeyboardButton("下一页 ➡️", callback_data=encode_callback(CALLBACK_PAGE, view, page + 1)))
+        return [row]
+
+    def _render_keyword_page(self, user_id, page):
+        entries, page, total_pages = self._paginate(self.db_manager.get_keyword_entries(user_id), page, self.config['ui.page_size'])
+        keyword_list = '\n'.join(f"• {escape_markdown(kw)}" for _, kw in entries)
+        text = f"📄 *您设置的关键词列表：*\n{keyword_list}"
+        keyboard = self._page_nav_row(PAGE_VIEW_KEYWORDS, page, total_pages)
+        return text, InlineKeyboardMarkup(keyboard) if keyboard else None
+
+    def _render_remove_keyword_page(self, user_id, page):
+        entries, page, total_pages = self._paginate(self.db_manager.get_keyword_entries(user_id), page, self.config['ui.page_size'])
+        # callback_data 使用关键词ID，避免关键词文本超过 64 字节的限制
+        keyboard = [
+            [InlineKeyboardButton(kw, callback_data=encode_callback(CALLBACK_DELETE_KEYWORD, keyword_id, page))]
+            for keyword_id, kw in entries
+        ]
+        keyboard += self._page_nav_row(PAGE_VIEW_REMOVE_KEYWORDS, page, total_pages)
+        return "📋 *请选择要删除的关键词：*", InlineKeyboardMarkup(keyboard)
+
+    def _render_blocked_page(self, user_id, page):
+        blocked_users = list(self.db_manager.list_blocked_users(user_id).items())
+        entries, page, total_pages = self._paginate(blocked_users, page, self.config['ui.page_size'])
         # 构建用户列表，显示用户ID、姓名和用户名
         user_list = '\n'.join([
-            f"• `{uid}` - *{info['first_name']}* @{info['username']}" if info['username'] else f"• `{uid}` - *{info['first_name']}*"
-            for uid, info in blocked_users.items()
+            f"• `{uid}` - *{escape_markdown(info['first_name'] or '')}* @{escape_markdown(info['username'])}"
+            if info['username'] else f"• `{uid}` - *{escape_markdown(info['first_name'] or '')}*"
+            for uid, info in entries
         ])
+        text = f"📋 *您当前屏蔽的用户列表：*\n{user_list}"
+        keyboard = self._page_nav_row(PAGE_VIEW_BLOCKED, page, total_pages)
+        return text, InlineKeyboardMarkup(keyboard) if keyboard else None
 
-        await update.message.reply_text(
-            f"📋 *您当前屏蔽的用户列表：*\n{user_list}",
-            parse_mode='Markdown'
+    def _render_accounts_page(self, user_id, page):
+        accounts, page, total_pages = self._paginate(
+            self.db_manager.get_user_accounts(user_id), page, self.config['ui.accounts_page_size']
         )
-        logger.info(f"用户 {user_id} 列出了自己的屏蔽用户列表。")
+        # 创建账号列表的文本
+        account_list = '\n\n'.join([
+            f"• *账号ID*: `{account[0]}`\n"
+            f"  *用户名*: @{escape_markdown(account[1]) if account[1] else '无'}\n"
+            f"  *名称*: {escape_markdown(account[2] or '')} {escape_markdown(account[3] or '')}\n"
+            f"  *已认证*: {'✅ 是' if account[5] else '❌ 否'}\n"
+            f"  *状态*: {self._format_account_status(account[0], account[7])}\n"
+            for account in accounts
+        ])
+        text = f"📋 *您已登录的 Telegram 账号：*\n{account_list}"
+        keyboard = self._page_nav_row(PAGE_VIEW_ACCOUNTS, page, total_pages)
+        return text, InlineKeyboardMarkup(keyboard) if keyboard else None
+
+    def _render_groups_page(self, user_id, page):
+        groups = self.db_manager.get_user_account_groups(user_id)
+        entries, page, total_pages = self._paginate(groups, page, self.config['ui.page_size'])
+        monitored_count = sum(1 for _, _, monitored in groups if monitored)
+        text = (
+            f"📋 *选择要监听的群组*（已选择 {monitored_count}/{len(groups)}）\n"
+            f"点击群组切换监听状态，未选择任何群组时监听全部聊天。"
+        )
+        keyboard = [
+            [InlineKeyboardButton(
+                f"{'✅' if monitored else '⬜'} {group_name[:40]}",
+                callback_data=encode_callback(CALLBACK_TOGGLE_GROUP, group_id, page)
+            )]
+            for group_id, group_name, monitored in entries
+        ]
+        nav_row = self._page_nav_row(PAGE_VIEW_GROUPS, page, total_pages)
+        if nav_row:
+            keyboard.append(nav_row)
+        return text, InlineKeyboardMarkup(keyboard)
+
+    async def _handle_page_callback(self, query, user_id, view, page):
+        renderers = {
+            PAGE_VIEW_KEYWORDS: self._render_keyword_page,
+            PAGE_VIEW_REMOVE_KEYWORDS: self._render_remove_keyword_page,
+            PAGE_VIEW_BLOCKED: self._render_blocked_page,
+            PAGE_VIEW_ACCOUNTS: self._render_accounts_page,
+            PAGE_VIEW_GROUPS: self._render_groups_page,
+        }
+        if view not in renderers:
+            raise ValueError(f"未知的分页视图: {view}")
+        text, reply_markup = renderers[view](user_id, page)
+        await query.answer()
+        await self._edit_query_message(query, text, reply_markup)
+
+    @staticmethod
+    async def _edit_query_message(query, text, reply_markup=None):
+        try:
+            await query.edit_message_text(text, parse_mode='Markdown', reply_markup=reply_markup)
+        except BadRequest as e:
+            # 内容没有变化时 Telegram 会报错，忽略即可
+            if 'not modified' not in str(e).lower():
+                raise
+
+    @restricted
+    async def sync_groups(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        account_ids = [aid for aid, owner in self.account_owners.items() if owner == user_id]
+        if not account_ids:
+            await update.message.reply_text("ℹ️ 您当前没有已连接的账号，请先使用 /login 登录。", parse_mode=None)
+            return
+        running = self.group_sync_tasks.get(user_id)
+        if running and not running.done():
+            await update.message.reply_text("⏳ 群组同步正在进行中，请稍候。", parse_mode=None)
+            return
+
+        progress = await update.message.reply_text(
+            f"⏳ 正在同步 {len(account_ids)} 个账号的群组，完成后会通知您……", parse_mode=None
+        )
+        task = asyncio.create_task(self._sync_user_groups(user_id, account_ids, progress))
+        self.group_sync_tasks[user_id] = task
+        self.background_tasks.append(task)
+        task.add_done_callback(lambda t: t in self.background_tasks and self.background_tasks.remove(t))
+        logger.info(f"用户 {user_id} 开始同步 {len(account_ids)} 个账号的群组。")
+
+    async def _sync_user_groups(self, user_id, account_ids, progress):
+        total, failed = 0, []
+        for account_id in account_ids:
+            try:
+                total += await self._sync_account_groups(account_id)
+            except Exception as e:
+                failed.append(account_id)
+                logger.error(f"同步账号 {account_id} 的群组失败: {e}", exc_info=True)
+        # 群组成员关系更新后重新分配聊天归属
+        await self.rebalance_chat_owners(user_id)
+
+        summary = f"✅ 群组同步完成，共发现 {total} 个群组。"
+        if failed:
+            summary += f"\n⚠️ 以下账号同步失败：{', '.join(map(str, failed))}"
+        try:
+            await progress.edit_text(summary)
+            text, reply_markup = self._render_groups_page(user_id, 0)
+            await self.application.bot.send_message(
+                chat_id=user_id, text=text, parse_mode='Markdown', reply_markup=reply_markup
+            )
+        except Exception as e:
+            logger.error(f"发送群组同步结果给用户 {user_id} 失败: {e}")
+
+    async def _sync_account_groups(self, account_id):
+        # 分页读取对话列表，每批在一个事务中写入，批次之间限速等待
+        client = self.user_clients.get(account_id)
+        if not client:
+            return 0
+        synced_at = time.time()
+        batch, count, seen = [], 0, 0
+        async for dialog in client.iter_dialogs():
+            seen += 1
+            if dialog.is_group or dialog.is_channel:
+                batch.append((dialog.id, dialog.name or str(dialog.id)))
+            if seen % self.config['sync_groups.batch_size'] == 0:
+                if batch:
+                    await asyncio.to_thread(self.db_manager.upsert_account_groups, account_id, batch, synced_at)
+                    count += len(batch)
+                    batch = []
+                await asyncio.sleep(self.config['sync_groups.delay'])
+        if batch:
+            await asyncio.to_thread(self.db_manager.upsert_account_groups, account_id, batch, synced_at)
+            count += len(batch)
+        removed = await asyncio.to_thread(self.db_manager.prune_account_groups, account_id, synced_at)
+        self._forget_chats_in_memory(account_id, removed)
+        logger.info(f"账号 {account_id} 同步了 {count} 个群组，移除了 {len(removed)} 个已退出的群组。")
+        return count
+
+    @restricted
+    async def select_groups(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        if not self.db_manager.get_user_account_groups(user_id):
+            await update.message.reply_text("ℹ️ 还没有同步到任何群组，请先使用 /sync_groups。", parse_mode=None)
+            return
+        text, reply_markup = self._render_groups_page(user_id, 0)
+        await update.message.reply_text(text, parse_mode='Markdown', reply_markup=reply_markup)
 
     @restricted
     async def list_accounts(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -1167,23 +4699,24 @@ class TelegramBot:
             )
             logger.info(f"用户 {user_id} 请求列出账号，但没有登录的账号。")
             return
-        
-        # 创建账号列表的文本
-        account_list = '\n\n'.join([ 
-            f"• *账号ID*: `{account[0]}`\n"
-            f"  *用户名*: @{account[1] if account[1] else '无'}\n"
-            f"  *名称*: {account[2]} {account[3]}\n"
-            f"  *已认证*: {'✅ 是' if account[5] else '❌ 否'}\n"
-            for account in accounts
-        ])
-        
-        # 发送用户已登录的账号信息
-        await update.message.reply_text(
-            f"📋 *您已登录的 Telegram 账号：*\n{account_list}",
-            parse_mode='Markdown'
-        )
+
+        # 发送用户已登录的账号信息（分页）
+        text, reply_markup = self._render_accounts_page(user_id, 0)
+        await update.message.reply_text(text, parse_mode='Markdown', reply_markup=reply_markup)
         logger.info(f"用户 {user_id} 列出了他们的 Telegram 账号。")
     
+    def _format_account_status(self, account_id, is_healthy):
+        if account_id in self.idle_accounts:
+            return '💤 空闲（添加关键词后连接）'
+        if account_id not in self.user_clients:
+            return '⚪ 未运行'
+        uptime = self.get_account_uptime(account_id)
+        if uptime is not None:
+            return f"🟢 在线（已运行 {self._format_duration(uptime)}）"
+        if is_healthy:
+            return '🟡 连接中'
+        return '🔴 异常'
+
     @restricted
     async def remove_account(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user = update.effective_user
@@ -1218,13 +4751,14 @@ class TelegramBot:
             return
 
         # 断开 Telethon 客户端
-        client = self.user_clients.get(account_id)
+        client = self.detach_client(account_id)
+        self.idle_accounts.pop(account_id, None)
         if client:
-            client.disconnect()
-            del self.user_clients[account_id]
+            await client.disconnect()
 
-        # 从数据库移除账号
+        # 从数据库移除账号，并把该账号负责的聊天分配给其他账号
         self.db_manager.remove_user_account(account_id)
+        await self.rebalance_chat_owners(user_id)
 
         await update.message.reply_text(
             f"✅ 已移除账号ID `{account_id}`。",
@@ -1244,24 +4778,19 @@ class TelegramBot:
         # 获取用户输入的关键词，并按空格分割
         raw_keywords = ' '.join(context.args).strip()
         
-        # 使用空格分割关键词
-        keywords = [kw.strip() for kw in raw_keywords.split() if kw.strip()]  # 去除空白关键词
+        # 使用空格分割关键词，关键词后加 ~N 表示容错匹配
+        keywords, invalid_keywords = normalize_keyword_specs(kw.strip() for kw in raw_keywords.split() if kw.strip())
+        invalid_message = '\n'.join(f"❌ {spec}：{reason}" for spec, reason in invalid_keywords)
 
         if not keywords:
-            await update.message.reply_text("❌ 关键词不能为空。", parse_mode='Markdown')
-            logger.debug("添加关键词时关键词为空。")
+            await update.message.reply_text(invalid_message or "❌ 关键词不能为空。", parse_mode=None)
+            logger.debug("添加关键词时没有有效的关键词。")
             return
         
-        # 收集成功添加和失败的关键词
-        added_keywords = []
-        existing_keywords = []
-
-        # 遍历分词后的每个关键词，逐个添加
-        for keyword in keywords:
-            if self.db_manager.add_keyword(update.effective_user.id, keyword):
-                added_keywords.append(keyword)
-            else:
-                existing_keywords.append(keyword)
+        # 在一个事务中批量添加，收集成功添加和已存在的关键词
+        added_keywords, existing_keywords = self.db_manager.add_keywords(update.effective_user.id, keywords)
+        if added_keywords:
+            self.wake_idle_accounts(update.effective_user.id)
         
         # 构造返回的消息
         if added_keywords:
@@ -1276,10 +4805,107 @@ class TelegramBot:
 
         # 合并消息
         message = f"{added_message}\n{existing_message}"
+        if invalid_message:
+            message += f"\n{invalid_message}"
 
         # 发送消息
         await update.message.reply_text(message, parse_mode='Markdown')
 
+    @restricted
+    async def replay_keywords(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # /replay_keywords [消息数] [关键词...]，不提供关键词时回放当前的关键词
+        user_id = update.effective_user.id
+        args = list(context.args)
+        limit = int(args.pop(0)) if args and args[0].isdigit() else self.config['replay.default_limit']
+        keywords, invalid_keywords = normalize_keyword_specs(args)
+        if invalid_keywords:
+            await update.message.reply_text(
+                '\n'.join(f"❌ {spec}：{reason}" for spec, reason in invalid_keywords), parse_mode=None
+            )
+            return
+        keywords = keywords or self.db_manager.get_keywords(user_id)
+        if not keywords:
+            await update.message.reply_text("ℹ️ 请提供要测试的关键词，或先使用 /add_keyword 添加关键词。", parse_mode=None)
+            return
+
+        chat_accounts = self.db_manager.get_user_chat_accounts(user_id)
+        monitored = self.db_manager.get_monitored_group_ids(user_id)
+        chat_ids = [chat_id for chat_id in chat_accounts if not monitored or chat_id in monitored]
+        if not chat_ids:
+            await update.message.reply_text("ℹ️ 还没有同步到任何群组，请先使用 /sync_groups。", parse_mode=None)
+            return
+        running = self.replay_tasks.get(user_id)
+        if running and not running.done():
+            await update.message.reply_text("⏳ 关键词回放正在进行中，请稍候。", parse_mode=None)
+            return
+
+        progress = await update.message.reply_text(
+            f"⏳ 正在拉取 {len(chat_ids)} 个聊天的历史消息，完成后会回放最近 {limit} 条消息……", parse_mode=None
+        )
+        task = asyncio.create_task(self._run_replay(user_id, keywords, limit, chat_ids, chat_accounts, progress))
+        self.replay_tasks[user_id] = task
+        self.background_tasks.append(task)
+        task.add_done_callback(lambda t: t in self.background_tasks and self.background_tasks.remove(t))
+        logger.info(f"用户 {user_id} 开始回放 {len(keywords)} 个关键词。")
+
+    async def _run_replay(self, user_id, keywords, limit, chat_ids, chat_accounts, progress):
+        try:
+            for chat_id in chat_ids:
+                await self._fetch_chat_history(chat_id, chat_accounts[chat_id])
+
+            # 匹配在工作线程中进行，使用独立的刷屏过滤器，不影响实时推送
+            spam_filter = SpamFilter(
+                self.config['spam.window'], self.config['spam.max_per_sender'], self.config['spam.simhash_distance']
+            )
+            blocked = self.db_manager.get_global_blocked_ids().union(self.db_manager.get_blocked_ids(user_id))
+            started = time.perf_counter()
+            total, hits, alerts = await asyncio.to_thread(
+                lambda: replay_keywords(
+                    self.db_manager.iter_cached_messages(chat_ids, limit),
+                    keywords, blocked, spam_filter, user_id
+                )
+            )
+            elapsed = time.perf_counter() - started
+
+            lines = [
+                f"🔁 回放了 {len(chat_ids)} 个聊天中的 {total} 条消息（耗时 {elapsed:.1f} 秒），"
+                f"预计产生 {sum(alerts)} 条推送："
+            ]
+            ranked = sorted(range(len(keywords)), key=lambda i: (alerts[i], hits[i]), reverse=True)
+            for i in ranked:
+                lines.append(f"• {keywords[i]}：推送 {alerts[i]} 条，命中 {hits[i]} 条消息")
+            lines.append("\n命中数包含被屏蔽用户和刷屏过滤掉的消息；同一条消息只推送一次，计入顺序最靠前的关键词。")
+            text = '\n'.join(lines)
+            if len(text) > 4000:
+                text = text[:4000] + "\n……"
+            await progress.edit_text(text)
+            logger.info(f"用户 {user_id} 回放了 {total} 条消息，耗时 {elapsed:.2f} 秒。")
+        except Exception as e:
+            logger.error(f"用户 {user_id} 的关键词回放失败: {e}", exc_info=True)
+            await progress.edit_text("❌ 关键词回放失败，请稍后重试。")
+
+    async def _fetch_chat_history(self, chat_id, account_ids):
+        # 增量拉取聊天的最近消息写入缓存，同一聊天在 replay.refresh_interval 内只拉取一次
+        last_fetched = self.replay_fetched.get(chat_id)
+        if last_fetched is not None and time.monotonic() - last_fetched < self.config['replay.refresh_interval']:
+            return
+        client = next((self.user_clients[aid] for aid in account_ids if aid in self.user_clients), None)
+        if not client:
+            return
+        keep = self.config['replay.fetch_per_chat']
+        min_id = await asyncio.to_thread(self.db_manager.get_cached_max_message_id, chat_id)
+        rows = []
+        try:
+            async for message in client.iter_messages(chat_id, limit=keep, min_id=min_id):
+                if message.message:
+                    rows.append((message.id, message.sender_id, message.message, int(message.date.timestamp())))
+        except Exception as e:
+            logger.warning(f"拉取聊天 {chat_id} 的历史消息失败: {e}")
+            return
+        await asyncio.to_thread(self.db_manager.cache_messages, chat_id, rows, keep)
+        self.replay_fetched[chat_id] = time.monotonic()
+        await asyncio.sleep(self.config['replay.fetch_delay'])
+
     @restricted
     async def remove_keyword(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.debug("执行删除关键词命令。")
@@ -1288,11 +4914,8 @@ class TelegramBot:
             keywords = self.db_manager.get_keywords(update.effective_user.id)
             
             if keywords:
-                keyboard = [
-                    [InlineKeyboardButton(kw, callback_data=f"delete:{kw}")] for kw in keywords
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                await update.message.reply_text("📋 *请选择要删除的关键词：*", parse_mode='Markdown', reply_markup=reply_markup)
+                text, reply_markup = self._render_remove_keyword_page(update.effective_user.id, 0)
+                await update.message.reply_text(text, parse_mode='Markdown', reply_markup=reply_markup)
                 logger.info(f"向用户 {update.effective_user.id} 显示删除关键词按钮。")
             else:
                 await update.message.reply_text("ℹ️ 您当前没有设置任何关键词。", parse_mode='Markdown')
@@ -1301,23 +4924,6 @@ class TelegramBot:
             logger.error(f"获取关键词列表失败: {e}", exc_info=True)
             await update.message.reply_text("❌ 获取关键词列表时发生错误。", parse_mode='Markdown')
 
-    @restricted
-    async def button_callback(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        query = update.callback_query
-        data = query.data
-
-        if data.startswith("delete:"):
-            keyword_to_delete = data.split(":", 1)[1]
-            
-            # 使用 DatabaseManager 删除关键词
-            if self.db_manager.remove_keyword(update.effective_user.id, keyword_to_delete):
-                await query.answer()
-                await query.edit_message_text(f"✅ 关键词 '{keyword_to_delete}' 已删除。", parse_mode='Markdown')
-                logger.info(f"用户 {update.effective_user.id} 删除了关键词 '{keyword_to_delete}'。")
-            else:
-                await query.answer()
-                await query.edit_message_text(f"⚠️ 关键词 '{keyword_to_delete}' 未找到。", parse_mode='Markdown')
-
     @restricted
     async def list_keywords(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.debug("执行列出关键词命令。")
@@ -1326,8 +4932,8 @@ class TelegramBot:
             keywords = self.db_manager.get_keywords(update.effective_user.id)
 
             if keywords:
-                keyword_list = '\n'.join([f"• {kw}" for kw in keywords])
-                await update.message.reply_text(f"📄 *您设置的关键词列表：*\n{keyword_list}", parse_mode='Markdown')
+                text, reply_markup = self._render_keyword_page(update.effective_user.id, 0)
+                await update.message.reply_text(text, parse_mode='Markdown', reply_markup=reply_markup)
                 logger.info(f"用户 {update.effective_user.id} 列出了关键词。")
             else:
                 await update.message.reply_text("ℹ️ 您当前没有设置任何关键词。", parse_mode='Markdown')
@@ -1336,33 +4942,369 @@ class TelegramBot:
             logger.error(f"获取关键词列表失败: {e}", exc_info=True)
             await update.message.reply_text("❌ 获取关键词列表时发生错误。", parse_mode='Markdown')
 
+    @restricted
+    async def import_keywords(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        await update.message.reply_text(
+            "📥 请上传关键词文件：.txt 文件每行一个关键词，.csv 文件每个单元格一个关键词。",
+            parse_mode=None
+        )
+        context.user_data['login_stage'] = 'awaiting_keywords'
+        logger.info(f"用户 {update.effective_user.id} 启动了关键词导入流程。")
+
+    async def _handle_keyword_import(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        document = update.message.document
+        try:
+            if not document.file_name.lower().endswith(('.txt', '.csv')):
+                await update.message.reply_text("❌ 请上传 .txt 或 .csv 格式的关键词文件。", parse_mode=None)
+                return
+            file = await document.get_file()
+            data = bytes(await file.download_as_bytearray())
+            try:
+                keywords = parse_keyword_file(document.file_name, data)
+            except UnicodeDecodeError:
+                await update.message.reply_text("❌ 文件编码错误，请使用 UTF-8 编码。", parse_mode=None)
+                return
+            keywords, invalid_keywords = normalize_keyword_specs(keywords)
+            if not keywords:
+                await update.message.reply_text("❌ 文件中没有找到有效的关键词。", parse_mode=None)
+                return
+            if len(keywords) > self.config['import.max_keywords']:
+                await update.message.reply_text(f"❌ 单次最多导入 {self.config['import.max_keywords']} 个关键词。", parse_mode=None)
+                return
+
+            added, existing = await asyncio.to_thread(self.db_manager.add_keywords, user_id, keywords)
+            if added:
+                self.wake_idle_accounts(user_id)
+            await update.message.reply_text(
+                f"✅ 关键词导入完成\n\n• 新添加：{len(added)}\n• 已存在：{len(existing)}"
+                + (f"\n• 无效（已跳过）：{len(invalid_keywords)}" if invalid_keywords else ""),
+                parse_mode=None
+            )
+            logger.info(f"用户 {user_id} 导入关键词：新添加 {len(added)}，已存在 {len(existing)}。")
+        except Exception as e:
+            await update.message.reply_text(f"❌ 导入关键词时出错：{e}", parse_mode=None)
+            logger.error(f"用户 {user_id} 导入关键词时出错：{e}", exc_info=True)
+        finally:
+            context.user_data.clear()
+
+    @restricted
+    async def export_keywords(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        keywords = self.db_manager.get_keywords(user_id)
+        if not keywords:
+            await update.message.reply_text("ℹ️ 您当前没有设置任何关键词。", parse_mode='Markdown')
+            return
+
+        # /export_keywords csv 导出为 CSV，默认导出为每行一个关键词的文本文件
+        if context.args and context.args[0].lower() == 'csv':
+            import csv
+            buffer = io.StringIO()
+            writer = csv.writer(buffer)
+            writer.writerow(['keyword'])
+            writer.writerows([keyword] for keyword in keywords)
+            content, filename = buffer.getvalue(), f"keywords_{user_id}.csv"
+        else:
+            content, filename = '\n'.join(keywords) + '\n', f"keywords_{user_id}.txt"
+
+        await update.message.reply_document(
+            document=io.BytesIO(content.encode('utf-8')),
+            filename=filename,
+            caption=f"📤 共 {len(keywords)} 个关键词"
+        )
+        logger.info(f"用户 {user_id} 导出了 {len(keywords)} 个关键词。")
+
+    @restricted
+    async def export_pushes(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # /export_pushes [csv|ndjson] [用户ID|all]，导出为 gzip 压缩文件；管理员可以导出其他用户或全部用户的记录
+        user_id = update.effective_user.id
+        args = [arg.lower() for arg in context.args]
+        fmt = 'ndjson' if 'ndjson' in args else 'csv'
+        others = [arg for arg in args if arg not in ('csv', 'ndjson')]
+        target = user_id
+        if others:
+            if user_id not in self.admin_ids:
+                await update.message.reply_text("❌ 只有管理员可以导出其他用户的推送记录。", parse_mode=None)
+                return
+            if others[0] == 'all':
+                target = None
+            else:
+                try:
+                    target = int(others[0])
+                except ValueError:
+                    await update.message.reply_text("❌ 用法：/export_pushes [csv|ndjson] [用户ID|all]", parse_mode=None)
+                    return
+        running = self.export_tasks.get(user_id)
+        if running and not running.done():
+            await update.message.reply_text("⏳ 推送记录正在导出中，请稍候。", parse_mode=None)
+            return
+
+        progress = await update.message.reply_text("⏳ 正在导出推送记录……", parse_mode=None)
+        task = asyncio.create_task(self._run_push_export(user_id, target, fmt, progress))
+        self.export_tasks[user_id] = task
+        self.background_tasks.append(task)
+        task.add_done_callback(lambda t: t in self.background_tasks and self.background_tasks.remove(t))
+        logger.info(f"用户 {user_id} 开始导出推送记录（{fmt}，对象：{target if target is not None else '全部用户'}）。")
+
+    async def _run_push_export(self, user_id, target, fmt, progress):
+        # 在工作线程中分批读取并写入临时文件，完成后上传，文件大小不影响内存占用
+        import tempfile
+        fd, path = tempfile.mkstemp(suffix=f'.{fmt}.gz')
+        os.close(fd)
+        try:
+            chunk_size = self.config['export.chunk_size']
+            count = await asyncio.to_thread(
+                lambda: write_push_export(self.db_manager.iter_push_logs(target, chunk_size), fmt, path)
+            )
+            if not count:
+                await progress.edit_text("ℹ️ 没有可导出的推送记录。")
+                return
+            size = os.path.getsize(path)
+            if size > BOT_UPLOAD_LIMIT:
+                await progress.edit_text(f"❌ 导出文件有 {size / 1024 / 1024:.1f} MB，超过了 Telegram 的上传限制。")
+                return
+            name = target if target is not None else 'all'
+            with open(path, 'rb') as f:
+                await self.application.bot.send_document(
+                    chat_id=user_id,
+                    document=f,
+                    filename=f"pushes_{name}.{fmt}.gz",
+                    caption=f"📤 共 {count} 条推送记录（保留期 {self.config['retention.days']} 天内的明细）",
+                    write_timeout=120,
+                )
+            await progress.delete()
+            logger.info(f"用户 {user_id} 导出了 {count} 条推送记录（{size} 字节）。")
+        except Exception as e:
+            logger.error(f"用户 {user_id} 导出推送记录失败: {e}", exc_info=True)
+            await progress.edit_text("❌ 导出推送记录失败，请稍后重试。")
+        finally:
+            os.remove(path)
+
     # 查看自己的推送分析信息命令
     @restricted
     async def my_stats(self,update: Update, context: ContextTypes.DEFAULT_TYPE):
         logger.debug("执行查看自己的推送分析命令。")
         user_id = update.effective_user.id
-        
-        # 获取统计信息
-        total_pushes = self.db_manager.get_total_pushes(user_id)
-        keyword_stats = self.db_manager.get_keyword_stats(user_id)
-        
-        # 构建消息内容
+
+        # 统计窗口，支持 /my_stats 7 或 /my_stats 30
+        days = STATS_MAX_DAYS if context.args and context.args[0] == str(STATS_MAX_DAYS) else 7
+
+        # 获取统计信息，全部来自增量维护的汇总表
+        stats_text = await asyncio.to_thread(self._build_stats_text, user_id, days)
+
+        # 发送消息
+        await update.message.reply_text(stats_text, parse_mode='Markdown')
+        logger.info(f"用户 {user_id} 查看了自己的推送统计信息。")
+
+    def _build_stats_text(self, user_id, days):
+        now = datetime.now()
+        today = now.date()
+        since_day = (today - timedelta(days=days - 1)).strftime('%Y-%m-%d')
+        previous_day = (today - timedelta(days=2 * days - 1)).strftime('%Y-%m-%d')
+        since_hour = (now - timedelta(hours=23)).strftime('%Y-%m-%d %H')
+
+        total_pushes = self.db_manager.get_push_stats_total(user_id)
+        hourly = self.db_manager.get_hourly_pushes(user_id, since_hour)
+        daily = self.db_manager.get_daily_pushes(user_id, since_day)
+        top_keywords = self.db_manager.get_top_items(user_id, 'keyword', since_day, limit=10)
+        top_chats = self.db_manager.get_top_items(user_id, 'chat', since_day)
+        top_senders = self.db_manager.get_top_items(user_id, 'sender', since_day)
+        # 与上一个同等长度的窗口比较，得到关键词趋势
+        previous = self.db_manager.get_item_counts(
+            user_id, 'keyword', [item for item, _, _ in top_keywords], previous_day, since_day
+        )
+
+        # 最近24小时按小时分布
+        hour_counts = [hourly.get((now - timedelta(hours=h)).strftime('%Y-%m-%d %H'), 0) for h in range(23, -1, -1)]
+        # 窗口内按天分布
+        day_keys = [(today - timedelta(days=d)).strftime('%Y-%m-%d') for d in range(days - 1, -1, -1)]
+        day_counts = [daily.get(day, 0) for day in day_keys]
+
         stats_text = (
             f"📊 *您的推送统计信息：*\n\n"
-            f"• *总推送次数:* {total_pushes}\n\n"
-            f"• *按关键词统计（前10）:*\n"
+            f"• *总推送次数:* {total_pushes}\n"
+            f"• *最近24小时:* {sum(hour_counts)} 次\n"
+            f"  `{self._sparkline(hour_counts)}`\n"
+            f"• *最近{days}天:* {sum(day_counts)} 次，日均 {sum(day_counts) / days:.1f} 次\n"
+            f"  `{self._sparkline(day_counts)}`\n"
         )
-        
-        if keyword_stats:
-            for keyword, count in keyword_stats:
-                stats_text += f"  - {keyword}: {count} 次\n"
+        if days == 7:
+            stats_text += ''.join(
+                f"  - {day[5:]}: {count} 次\n" for day, count in zip(day_keys, day_counts)
+            )
+
+        stats_text += f"\n• *最近{days}天按关键词统计（前10）:*\n"
+        if top_keywords:
+            for keyword, _, count in top_keywords:
+                stats_text += f"  - {escape_markdown(keyword)}: {count} 次 {self._format_trend(count, previous.get(keyword, 0))}\n"
         else:
             stats_text += "  - 暂无数据。\n"
-        
-        # 发送消息
-        await update.message.reply_text(stats_text, parse_mode='Markdown')
-        logger.info(f"用户 {user_id} 查看了自己的推送统计信息。")
+
+        stats_text += f"\n• *最近{days}天推送最多的群组:*\n"
+        if top_chats:
+            for chat_id, label, count in top_chats:
+                stats_text += f"  - {escape_markdown(label or chat_id)}: {count} 次\n"
+        else:
+            stats_text += "  - 暂无数据。\n"
+
+        stats_text += f"\n• *最近{days}天推送最多的发送者:*\n"
+        if top_senders:
+            for sender_id, label, count in top_senders:
+                stats_text += f"  - {escape_markdown(label or sender_id)} (`{sender_id}`): {count} 次\n"
+        else:
+            stats_text += "  - 暂无数据。\n"
+        return stats_text
+
+    @staticmethod
+    def _sparkline(counts):
+        bars = '▁▂▃▄▅▆▇█'
+        peak = max(counts) if counts else 0
+        if not peak:
+            return bars[0] * len(counts)
+        return ''.join(bars[count * (len(bars) - 1) // peak] for count in counts)
+
+    @staticmethod
+    def _format_trend(current, previous):
+        if not previous:
+            return '🆕' if current else ''
+        change = (current - previous) * 100 // previous
+        if change > 0:
+            return f"↑{change}%"
+        if change < 0:
+            return f"↓{-change}%"
+        return '→'
             
+    @admin_only
+    async def show_config(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # /config 列出所有分区，/config <分区> 列出该分区的配置项
+        sections = self.config.sections()
+        if not context.args:
+            await update.message.reply_text(
+                "⚙️ 配置分区：" + '、'.join(sections) + "\n\n使用 /config <分区> 查看配置项，"
+                "使用 /set_config <配置名> <值> 修改，值为 default 时恢复默认。",
+                parse_mode=None
+            )
+            return
+        section = context.args[0]
+        if section not in sections:
+            await update.message.reply_text(f"❌ 未知的配置分区：{section}", parse_mode=None)
+            return
+        lines = [f"⚙️ {section}"]
+        for key, value in self.config.items(section):
+            marker = '*' if self.config.is_overridden(key) else ''
+            lines.append(f"• {key} = {value}{marker}\n  {CONFIG_SPEC[key][3]}")
+        lines.append("\n带 * 的配置项已被修改。")
+        await update.message.reply_text('\n'.join(lines), parse_mode=None)
+
+    @admin_only
+    async def set_config(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        if len(context.args) < 2:
+            await update.message.reply_text("❌ 用法：/set_config <配置名> <值>", parse_mode=None)
+            return
+        key, raw = context.args[0], ' '.join(context.args[1:])
+        try:
+            if raw == 'default':
+                value = self.config.reset(key)
+            else:
+                value = self.config.set(key, raw)
+        except ValueError as e:
+            await update.message.reply_text(f"❌ {e}", parse_mode=None)
+            return
+        await update.message.reply_text(f"✅ {key} 已设置为 {value}", parse_mode=None)
+        logger.info(f"管理员 {user_id} 将配置项 {key} 设置为 {value}。")
+
+    @admin_only
+    async def profile(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # /profile on|off|reset 开关或清空性能分析，/profile [N] 查看最慢的 N 次调用
+        action = context.args[0] if context.args else ''
+        if action == 'on':
+            profiler.start(self.config['profile.loop_interval'], self.config['profile.block_threshold'])
+            await update.message.reply_text("✅ 性能分析已开启。", parse_mode=None)
+        elif action == 'off':
+            profiler.stop()
+            await update.message.reply_text("✅ 性能分析已关闭，已收集的数据仍可查看。", parse_mode=None)
+        elif action == 'reset':
+            profiler.reset()
+            await update.message.reply_text("✅ 性能分析数据已清空。", parse_mode=None)
+        else:
+            top_n = int(action) if action.isdigit() else self.config['profile.top_n']
+            report = profiler.report(top_n)
+            await update.message.reply_text(report[:4000], parse_mode=None)
+
+    @admin_only
+    async def memory_report(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # 按账号统计实体缓存，并用连接账号前后的常驻内存差估算每个账号的内存占用
+        rss = current_rss()
+        connected = len(self.user_clients)
+        lines = [
+            f"🧠 内存报告（低内存模式：{'开启' if self.config['memory.low_memory'] else '关闭'}）",
+            f"• 当前常驻内存：{rss / 1024 / 1024:.1f} MB",
+            f"• 已连接账号：{connected}，空闲未连接账号：{len(self.idle_accounts)}",
+        ]
+        if self.rss_baseline and connected:
+            lines.append(
+                f"• 连接账号前：{self.rss_baseline / 1024 / 1024:.1f} MB，"
+                f"平均每个账号约 {(rss - self.rss_baseline) / connected / 1024:.0f} KB"
+            )
+        usage = sorted(
+            (
+                (len(client.session._entities), len(client._mb_entity_cache), account_id)
+                for account_id, client in self.user_clients.items()
+            ),
+            reverse=True
+        )
+        if usage:
+            lines.append(f"\n实体最多的账号（共 {sum(u[0] + u[1] for u in usage)} 个实体）：")
+            for session_entities, cached_entities, account_id in usage[:10]:
+                lines.append(f"• 账号ID {account_id}：会话实体 {session_entities}，实体缓存 {cached_entities}")
+        await update.message.reply_text('\n'.join(lines), parse_mode=None)
+
+    @admin_only
+    async def global_block(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        # /gblock <用户ID> 全局屏蔽，对所有用户生效；不带参数时列出全局屏蔽列表
+        user_id = update.effective_user.id
+        if not context.args:
+            blocked = self.db_manager.list_global_blocked_users()
+            if not blocked:
+                await update.message.reply_text("ℹ️ 全局屏蔽列表为空。用法：/gblock <用户ID>", parse_mode=None)
+                return
+            lines = [f"🚫 全局屏蔽列表（共 {len(blocked)} 个）："]
+            for target_id, info in list(blocked.items())[:100]:
+                name = info['first_name'] or ''
+                lines.append(f"• {target_id} {name} @{info['username']}" if info['username'] else f"• {target_id} {name}")
+            await update.message.reply_text('\n'.join(lines)[:4000], parse_mode=None)
+            return
+        try:
+            target_user_id = int(context.args[0])
+        except ValueError:
+            await update.message.reply_text("❌ 用户ID必须是整数。例如：/gblock 123456789", parse_mode=None)
+            return
+        # 机器人不一定能获取到发送者的信息，获取失败时只保存ID
+        try:
+            target = await self.application.bot.get_chat(target_user_id)
+            first_name, username = target.first_name, target.username
+        except Exception as e:
+            logger.debug(f"获取用户 {target_user_id} 信息失败: {e}")
+            first_name, username = None, None
+        self.db_manager.add_global_blocked_user(target_user_id, first_name, username, user_id)
+        await update.message.reply_text(f"✅ 已全局屏蔽用户 {target_user_id}，所有用户都不会再收到其消息的推送。", parse_mode=None)
+        logger.info(f"管理员 {user_id} 全局屏蔽了用户 {target_user_id}。")
+
+    @admin_only
+    async def global_unblock(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        user_id = update.effective_user.id
+        try:
+            target_user_id = int(context.args[0])
+        except (IndexError, ValueError):
+            await update.message.reply_text("❌ 用法：/gunblock <用户ID>", parse_mode=None)
+            return
+        if self.db_manager.remove_global_blocked_user(target_user_id):
+            await update.message.reply_text(f"✅ 已解除对用户 {target_user_id} 的全局屏蔽。", parse_mode=None)
+            logger.info(f"管理员 {user_id} 解除了对用户 {target_user_id} 的全局屏蔽。")
+        else:
+            await update.message.reply_text(f"ℹ️ 用户 {target_user_id} 不在全局屏蔽列表中。", parse_mode=None)
+
     async def send_announcement(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         user_id = update.effective_user.id
         logger.debug(f"用户 {user_id} 尝试发送公告。")
@@ -1394,12 +5336,14 @@ class TelegramBot:
             return
 
         # 确定并发发送的最大数量，避免触发速率限制
-        semaphore = asyncio.Semaphore(10)  # 每次最多30个并发任务
+        semaphore = asyncio.Semaphore(self.config['announcement.concurrency'])
 
         async def send_message(user_id, message):
             async with semaphore:
                 try:
-                    await context.bot.send_message(chat_id=user_id, text=message, parse_mode='Markdown')
+                    await context.bot.send_message(
+                        chat_id=user_id, text=message, parse_mode='Markdown', rate_limit_args=PRIORITY_BROADCAST
+                    )
                     logger.info(f"成功向用户 {user_id} 发送公告。")
                 except Exception as e:
                     logger.error(f"发送公告给用户 {user_id} 失败: {e}")
@@ -1414,58 +5358,89 @@ class TelegramBot:
         await update.message.reply_text(f"✅ 公告已成功发送给 {len(user_ids)} 个用户。")
         logger.info(f"用户 {user_id} 发送公告给 {len(user_ids)} 个用户。")
 
-    def run(self):
-        try:
-            # 启动所有已登录用户的 Telethon 客户端
-            authenticated_accounts = self.db_manager.get_all_authenticated_accounts()
-            for account in authenticated_accounts:
-                account_id, user_id, username, firstname, lastname, session_string = account
-
-                # 检查 session_string 是否存在
-                if not session_string:
-                    # 如果 session_string 不存在，删除该账号的记录
-                    self.db_manager.remove_user_account(account_id)
-                    logger.warning(f"用户 {user_id} 的会话为空，已删除该账号记录 (账号ID: {account_id})。")
-                    continue  # 跳过该账号，处理下一个账号
-
+    def _webhook_settings(self):
+        # 检查 webhook 模式的配置和依赖，不可用时返回 None 并回退到长轮询
+        if BOT_MODE == 'polling':
+            return None
+        if BOT_MODE != 'webhook':
+            logger.warning(f"未知的 BOT_MODE: {BOT_MODE}，使用长轮询模式。")
+            return None
+        if not WEBHOOK_URL.startswith('https://'):
+            logger.warning("webhook 模式需要设置 WEBHOOK_URL（https 地址），使用长轮询模式。")
+            return None
+        import importlib.util
+        if importlib.util.find_spec('tornado') is None:
+            logger.warning("webhook 模式需要安装 python-telegram-bot[webhooks]，使用长轮询模式。")
+            return None
+        secret_token = WEBHOOK_SECRET_TOKEN or hashlib.sha256(f"webhook:{self.token}".encode()).hexdigest()
+        if not re.fullmatch(r'[A-Za-z0-9_-]{1,256}', secret_token):
+            logger.warning("WEBHOOK_SECRET_TOKEN 只能包含字母、数字、_ 和 -，使用长轮询模式。")
+            return None
+        return {
+            'webhook_url': f"{WEBHOOK_URL}/{WEBHOOK_PATH}",
+            'secret_token': secret_token,
+        }
+
+    async def webhook_health_loop(self):
+        # webhook 模式下定期查询 Telegram 记录的推送状态，连续多次推送出错或积压过多时改用长轮询
+        updater = self.application.updater
+        failures = 0
+        while True:
+            interval = self.config['webhook.check_interval']
+            await asyncio.sleep(interval)
+            if not updater.webhook_active:
+                return
+            try:
+                info = await self.application.bot.get_webhook_info()
+            except Exception as e:
+                logger.warning(f"查询 webhook 状态失败: {e}")
+                continue
+            recent_error = info.last_error_date is not None and time.time() - info.last_error_date.timestamp() < interval
+            if recent_error or info.pending_update_count >= self.config['webhook.max_pending']:
+                failures += 1
+                logger.warning(
+                    f"webhook 状态异常（第 {failures} 次）：积压 {info.pending_update_count} 条更新，"
+                    f"最近错误：{info.last_error_message or '无'}"
+                )
+            else:
+                failures = 0
+            if failures >= self.config['webhook.max_failures']:
+                logger.error("webhook 持续无法接收更新，改用长轮询。")
                 try:
-                    
-                    # 解码 base64 编码的 session string
-                    try:
-                        client = TelegramClient(StringSession(session_string), self.api_id, self.api_hash)
-                    except Exception as decode_error:
-                        logger.error(f"解码用户 {user_id} (账号ID: {account_id}) 的会话失败: {decode_error}")
-                        continue
-                    
-                    self.user_clients[account_id] = client
-                    client.start()
-
-                    # 注册消息事件处理器
-                    client.add_event_handler(lambda event, uid=user_id: self.handle_new_message(event, uid), events.NewMessage)
-
-                    logger.info(f"已启动并连接用户 {user_id} 用户名： @{username} 全名： {firstname} {lastname} 的 Telethon 客户端 (账号ID: {account_id})。")
+                    await updater.switch_to_polling()
                 except Exception as e:
-                    # 捕获并记录单个客户端的启动错误，但不影响其他客户端和整个程序
-                    logger.error(f"启动用户 {user_id} (账号ID: {account_id}) 的 Telethon 客户端失败: {e}", exc_info=True)
-                    # 如果已经创建了客户端对象，从字典中移除
-                    if account_id in self.user_clients:
-                        del self.user_clients[account_id]
+                    logger.critical(f"切换到长轮询失败: {e}", exc_info=True)
+                return
+
+    def run(self):
+        try:
+            # 恢复上次运行中已出队但未确认的推送
+            pending = self.db_manager.recover_deliveries()
+            if pending:
+                logger.info(f"推送队列中有 {pending} 条待发送的消息，将在启动后继续发送。")
 
             # 启动机器人
-            self.application.run_polling()
+            webhook = self._webhook_settings()
+            if webhook:
+                logger.info(f"以 webhook 模式启动，监听 {WEBHOOK_LISTEN}:{WEBHOOK_PORT}/{WEBHOOK_PATH}，对外地址 {webhook['webhook_url']}")
+                # 启动失败时由 FallbackUpdater 改用长轮询，运行中持续失败时由 webhook_health_loop 切换
+                self.webhook_enabled = True
+                self.application.run_webhook(
+                    listen=WEBHOOK_LISTEN,
+                    port=WEBHOOK_PORT,
+                    url_path=WEBHOOK_PATH,
+                    webhook_url=webhook['webhook_url'],
+                    secret_token=webhook['secret_token'],
+                    max_connections=WEBHOOK_MAX_CONNECTIONS,
+                )
+            else:
+                # 长轮询启动时会删除已设置的 webhook
+                self.application.run_polling(timeout=POLL_TIMEOUT)
 
         except (KeyboardInterrupt, SystemExit):
             logger.info("程序已手动停止。")
         except Exception as e:
             logger.critical(f"程序异常终止: {e}", exc_info=True)
-        finally:
-            # 断开所有 Telethon 客户端连接
-            for client in self.user_clients.values():
-                try:
-                    client.disconnect()
-                except Exception as e:
-                    logger.error(f"断开客户端连接时发生错误: {e}", exc_info=True)
-            logger.info("所有 Telethon 客户端已断开连接。")
 
 # 启动脚本
 if __name__ == "__main__":
@@ -0,0 +1,231 @@
+#!/usr/bin/env python3
+"""端到端压测：在本地启动一个模拟的 Bot API 服务器，测量推送吞吐量和命令回复延迟。
+
+关键词匹配、推送队列、发送调度、python-telegram-bot 和 HTTP 连接池全部使用真实代码，
+只有 Telegram 服务器和 Telethon 收到的消息是模拟的。
+
+用法：
+    python scripts/load_test.py --alerts 2000 --users 50 --latency 0.05 --error-rate 0.01
+"""
+import argparse
+import asyncio
+import importlib
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from urllib.parse import parse_qs, urlsplit
+
+TOKEN = '123456:LOAD-TEST'
+PING_CHAT_ID = 1  # 管理员，用于测量命令回复延迟
+
+
+class FakeBotAPI:
+    # 最小的 HTTP/1.1 keep-alive 服务器，按 Bot API 的格式应答
+    def __init__(self, latency, error_rate, retry_after):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.delivered = {}  # key: chat_id, value: 成功发送的消息数
+        self.rate_limited = 0
+        self.connections = 0
+        self.peak_connections = 0
+        self.done = asyncio.Event()
+        self.expected = None
+        self.message_id = 0
+        self.server = None
+
+    async def start(self):
+        self.server = await asyncio.start_server(self._serve, '127.0.0.1', 0)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        self.server.close()
+        await self.server.wait_closed()
+
+    async def _serve(self, reader, writer):
+        self.connections += 1
+        self.peak_connections = max(self.peak_connections, self.connections)
+        try:
+            while True:
+                head = await reader.readuntil(b'\r\n\r\n')
+                request_line, *header_lines = head.decode('latin-1').split('\r\n')
+                headers = {}
+                for line in header_lines:
+                    if ':' in line:
+                        name, value = line.split(':', 1)
+                        headers[name.strip().lower()] = value.strip()
+                body = await reader.readexactly(int(headers.get('content-length', 0)))
+                method = urlsplit(request_line.split()[1]).path.rsplit('/', 1)[-1]
+                status, payload = await self._handle(method, self._parse_body(headers, body))
+                data = json.dumps(payload).encode('utf-8')
+                writer.write(
+                    f"HTTP/1.1 {status} {'OK' if status == 200 else 'Error'}\r\n"
+                    f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode('latin-1') + data
+                )
+                await writer.drain()
+        except (asyncio.IncompleteReadError, ConnectionError, asyncio.CancelledError):
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+
+    @staticmethod
+    def _parse_body(headers, body):
+        if not body:
+            return {}
+        if headers.get('content-type', '').startswith('application/json'):
+            return json.loads(body)
+        return {key: values[0] for key, values in parse_qs(body.decode('utf-8')).items()}
+
+    async def _handle(self, method, params):
+        if method == 'getUpdates':
+            # 长轮询：没有更新，等到超时后返回空列表
+            await asyncio.sleep(min(float(params.get('timeout', 0) or 0), 1.0))
+            return 200, {'ok': True, 'result': []}
+        await asyncio.sleep(self.latency)
+        if method == 'getMe':
+            return 200, {'ok': True, 'result': {
+                'id': int(TOKEN.split(':')[0]), 'is_bot': True, 'first_name': 'LoadTest', 'username': 'load_test_bot',
+            }}
+        if method != 'sendMessage':
+            return 200, {'ok': True, 'result': True}
+        if random.random() < self.error_rate:
+            self.rate_limited += 1
+            return 429, {
+                'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after},
+            }
+        chat_id = int(params['chat_id'])
+        self.message_id += 1
+        self.delivered[chat_id] = self.delivered.get(chat_id, 0) + 1
+        if self.expected is not None and self.alerts_delivered() >= self.expected:
+            self.done.set()
+        return 200, {'ok': True, 'result': {
+            'message_id': self.message_id, 'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'}, 'text': params.get('text', ''),
+        }}
+
+    def alerts_delivered(self):
+        return sum(count for chat_id, count in self.delivered.items() if chat_id != PING_CHAT_ID)
+
+
+class FakeMessage:
+    # 模拟 Telethon 的 Message，只提供 process_message 用到的属性
+    def __init__(self, chat_id, message_id, text, sender_id):
+        self.chat_id = chat_id
+        self.id = message_id
+        self.message = text
+        self.sender_id = sender_id
+
+    async def get_sender(self):
+        return type('User', (), {'id': self.sender_id, 'bot': False, 'username': None, 'first_name': '压测'})()
+
+    async def get_chat(self):
+        return type('Chat', (), {'title': '压测群组', 'username': 'load_test_group'})()
+
+
+async def ping_loop(bot, latencies, stop):
+    # 在推送洪峰期间持续发送命令回复（最高优先级），记录往返延迟
+    while not stop.is_set():
+        started = time.perf_counter()
+        try:
+            await bot.application.bot.send_message(chat_id=PING_CHAT_ID, text='ping')
+            latencies.append(time.perf_counter() - started)
+        except Exception as e:
+            print(f"命令回复失败: {e}", file=sys.stderr)
+        await asyncio.sleep(0.2)
+
+
+async def main(args):
+    api = FakeBotAPI(args.latency, args.error_rate, args.retry_after)
+    port = await api.start()
+
+    # 模块在导入时读取环境变量，因此先配置好再导入
+    workdir = tempfile.mkdtemp(prefix='load_test_')
+    os.chdir(workdir)
+    os.environ.update({
+        'TELEGRAM_BOT_TOKEN': TOKEN,
+        'TELEGRAM_API_ID': '1',
+        'TELEGRAM_API_HASH': 'load-test',
+        'ADMIN_IDS': str(PING_CHAT_ID),
+        'DATABASE_PATH': os.path.join(workdir, 'bot.db'),
+        'TELEGRAM_API_BASE_URL': f'http://127.0.0.1:{port}/bot',
+        'SEND_POOL_SIZE': str(args.pool_size),
+        'POLL_TIMEOUT': '1',
+    })
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    mk = importlib.import_module('monitor_keywords')
+    for handler in mk.logger.handlers:
+        handler.setLevel(args.log_level)
+
+    bot = mk.TelegramBot(TOKEN, str(PING_CHAT_ID), 'admin', '1', 'load-test', db_path=os.environ['DATABASE_PATH'])
+    bot.config.set('rate_limit.global_rate', str(args.rate))
+    bot.config.set('spam.simhash_distance', '-1')
+    bot.config.set('spam.max_per_sender', '0')
+    users = [1000 + i for i in range(args.users)]
+    for uid in users:
+        bot.db_manager.add_keywords(uid, ['招聘'])
+
+    app = bot.application
+    await app.initialize()
+    await app.start()
+    await app.updater.start_polling(timeout=1, poll_interval=0)
+    await bot.post_init(app)
+
+    # 推送按 Zipf 分布落到各个用户上，少数用户占大部分
+    weights = [1 / (rank + 1) for rank in range(args.users)]
+    targets = random.choices(users, weights=weights, k=args.alerts)
+    api.expected = args.alerts
+    latencies = []
+    stop = asyncio.Event()
+    pinger = asyncio.create_task(ping_loop(bot, latencies, stop))
+
+    started = time.perf_counter()
+    for n, uid in enumerate(targets):
+        message = FakeMessage(-1001234567890, n + 1, f'第 {n} 条招聘信息', sender_id=500000 + n)
+        await bot.process_message(message, uid)
+    enqueued = time.perf_counter() - started
+    try:
+        await asyncio.wait_for(api.done.wait(), timeout=args.timeout)
+        completed = True
+    except asyncio.TimeoutError:
+        completed = False
+    elapsed = time.perf_counter() - started
+    stop.set()
+    await pinger
+
+    await app.updater.stop()
+    await app.stop()
+    await bot.post_shutdown(app)
+    await app.shutdown()
+    await api.stop()
+
+    delivered = api.alerts_delivered()
+    print(f"推送: {delivered}/{args.alerts} 条{'' if completed else '（超时）'}，"
+          f"入队耗时 {enqueued:.2f}s，总耗时 {elapsed:.2f}s，吞吐量 {delivered / elapsed:.1f} 条/秒")
+    print(f"模拟 429: {api.rate_limited} 次，最大并发连接: {api.peak_connections}")
+    if latencies:
+        latencies.sort()
+        print(f"命令回复延迟: 中位数 {statistics.median(latencies) * 1000:.0f}ms，"
+              f"p95 {latencies[int(len(latencies) * 0.95)] * 1000:.0f}ms，最大 {latencies[-1] * 1000:.0f}ms"
+              f"（{len(latencies)} 次）")
+    return 0 if completed else 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='对本地模拟的 Bot API 进行端到端压测')
+    parser.add_argument('--alerts', type=int, default=2000, help='推送条数')
+    parser.add_argument('--users', type=int, default=50, help='接收推送的用户数')
+    parser.add_argument('--rate', type=float, default=1000.0, help='rate_limit.global_rate（每秒请求数）')
+    parser.add_argument('--pool-size', type=int, default=64, help='SEND_POOL_SIZE')
+    parser.add_argument('--latency', type=float, default=0.05, help='模拟服务器每个请求的处理延迟（秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='sendMessage 返回 429 的概率')
+    parser.add_argument('--retry-after', type=int, default=1, help='429 响应中的 retry_after（秒）')
+    parser.add_argument('--timeout', type=float, default=300, help='等待全部推送完成的最长时间（秒）')
+    parser.add_argument('--log-level', default='WARNING', help='机器人日志级别')
+    sys.exit(asyncio.run(main(parser.parse_args())))
@@ -0,0 +1,14 @@
+import os
+import sys
+import tempfile
+
+# monitor_keywords 在导入时读取环境变量并在当前目录创建日志文件，测试在临时目录中运行
+os.chdir(tempfile.mkdtemp(prefix='monitor_keywords_tests_'))
+for name, value in {
+    'TELEGRAM_BOT_TOKEN': '123456:TEST',
+    'ADMIN_IDS': '1',
+    'TELEGRAM_API_ID': '1',
+    'TELEGRAM_API_HASH': 'test',
+}.items():
+    os.environ.setdefault(name, value)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
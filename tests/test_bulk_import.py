@@ -0,0 +1,68 @@
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
+import monitor_keywords as mk
+
+
+class FakeClient:
+    def __init__(self):
+        self.disconnected = False
+
+    async def disconnect(self):
+        self.disconnected = True
+
+
+class FakeMessage:
+    def __init__(self):
+        self.edits = []
+        file = SimpleNamespace(download_as_bytearray=self._download)
+        self.document = SimpleNamespace(file_name='sessions.txt', get_file=lambda: self._async(file))
+
+    @staticmethod
+    async def _async(value):
+        return value
+
+    @staticmethod
+    async def _download():
+        return bytearray(b'')
+
+    async def reply_text(self, text, **kwargs):
+        return self
+
+    async def edit_text(self, text, **kwargs):
+        self.edits.append(text)
+
+
+def test_bulk_import_disconnects_clients_when_insert_fails(monkeypatch):
+    async def scenario():
+        bot = mk.TelegramBot('123456:TEST', {1}, 'admin', '1', 'test', db_path='bot.db')
+        entries = [('a', 'string', 's1'), ('b', 'string', 's1'), ('c', 'string', 's2')]
+        monkeypatch.setattr(mk, 'extract_session_entries', lambda name, data: entries)
+
+        clients = []
+
+        async def validate(name, kind, value):
+            client = FakeClient()
+            clients.append(client)
+            return {'name': name, 'client': client, 'error': None, 'session_string': value,
+                    'username': name, 'firstname': '', 'lastname': ''}
+
+        def add_user_accounts(user_id, accounts):
+            raise sqlite3.OperationalError('database is locked')
+
+        bot._validate_session_entry = validate
+        bot.db_manager.add_user_accounts = add_user_accounts
+
+        message = FakeMessage()
+        update = SimpleNamespace(effective_user=SimpleNamespace(id=1), message=message)
+        context = SimpleNamespace(user_data={'login_stage': 'awaiting_bulk_import'})
+        await bot._handle_bulk_import(update, context)
+
+        assert len(clients) == 3
+        assert all(client.disconnected for client in clients)
+        assert not bot.user_clients
+        assert message.edits[-1].startswith('❌ 批量导入时出错')
+        assert context.user_data == {}
+
+    asyncio.run(scenario())
@@ -0,0 +1,22 @@
+import asyncio
+import threading
+
+import monitor_keywords as mk
+
+
+def _watchdogs():
+    return [t for t in threading.enumerate() if getattr(t, '_target', None) and t._target.__name__ == '_watch_loop']
+
+
+def test_restarting_profiler_leaves_single_watchdog():
+    async def scenario():
+        profiler = mk.Profiler()
+        for _ in range(5):
+            profiler.start(loop_interval=0.05, block_threshold=0.2)
+            profiler.stop()
+        profiler.start(loop_interval=0.05, block_threshold=0.2)
+        assert len(_watchdogs()) == 1
+        profiler.stop()
+        assert not _watchdogs()
+
+    asyncio.run(scenario())
@@ -0,0 +1,91 @@
+import asyncio
+import time
+
+from telegram.error import RetryAfter
+
+import monitor_keywords as mk
+
+
+async def _limiter():
+    limiter = mk.FairRateLimiter(rate=1000, max_retries=1)
+    await limiter.initialize()
+    return limiter
+
+
+def _request(limiter, callback, chat_id, priority=None):
+    return limiter.process_request(callback, (), {}, 'sendMessage', {'chat_id': chat_id}, priority)
+
+
+def test_retry_after_on_alert_does_not_delay_interactive_request():
+    async def scenario():
+        limiter = await _limiter()
+        alert_calls = []
+
+        async def alert():
+            alert_calls.append(time.monotonic())
+            if len(alert_calls) == 1:
+                raise RetryAfter(5)
+            return 'alert'
+
+        async def reply():
+            return 'reply'
+
+        alert_task = asyncio.create_task(_request(limiter, alert, 100, mk.PRIORITY_ALERT))
+        await asyncio.sleep(0.05)
+        assert len(alert_calls) == 1  # 推送被限流，聊天 100 暂停 5 秒
+
+        started = time.monotonic()
+        assert await asyncio.wait_for(_request(limiter, reply, 200), timeout=1) == 'reply'
+        assert time.monotonic() - started < 0.5
+        assert not alert_task.done()
+        assert limiter.pending()[mk.PRIORITY_ALERT] == 1
+
+        alert_task.cancel()
+        await limiter.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_paused_chat_is_retried_after_retry_after():
+    async def scenario():
+        limiter = await _limiter()
+        calls = []
+
+        async def alert():
+            calls.append(time.monotonic())
+            if len(calls) == 1:
+                raise RetryAfter(1)
+            return 'sent'
+
+        async def other():
+            return 'other'
+
+        task = asyncio.create_task(_request(limiter, alert, 100, mk.PRIORITY_ALERT))
+        assert await _request(limiter, other, 300, mk.PRIORITY_ALERT) == 'other'
+        assert await asyncio.wait_for(task, timeout=3) == 'sent'
+        assert calls[1] - calls[0] >= 0.9
+        assert limiter.pending() == [0, 0, 0]
+        await limiter.shutdown()
+
+    asyncio.run(scenario())
+
+
+def test_retry_after_without_chat_pauses_all_requests():
+    async def scenario():
+        limiter = await _limiter()
+
+        async def get_updates():
+            raise RetryAfter(1)
+
+        async def reply():
+            return time.monotonic()
+
+        started = time.monotonic()
+        try:
+            await limiter.process_request(get_updates, (), {}, 'getUpdates', {}, None)
+        except RetryAfter:
+            pass
+        assert await _request(limiter, reply, 200) - started >= 0.9
+        await limiter.shutdown()
+
+    asyncio.run(scenario())